@@ -1,16 +1,49 @@
-from flask import Flask, request, jsonify
-from models import db, Group, Profile, User, Chat, Message
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask import Flask, request, jsonify, Response, stream_with_context, abort
+from models import db, Group, Profile, User, Chat, GroupDeletion
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, verify_jwt_in_request
 from flask_cors import CORS
+from flask_sock import Sock
+from flask_migrate import Migrate
 import os
-from werkzeug.exceptions import BadRequest  
+from datetime import datetime
+from werkzeug.exceptions import BadRequest, ServiceUnavailable, TooManyRequests
 from services import (
     validate_group_data, validate_profile_data, is_strong_password,
-    create_group, update_group, create_profile,
-    validate_chat_data, create_chat, update_chat, get_user_info, authenticate
+    create_group, update_group, create_profile, provision_groups_and_profiles,
+    request_group_deletion,
+    validate_chat_data, create_chat, update_chat, add_chat_participants, remove_chat_participant,
+    get_user_info, authenticate,
+    get_messages_page, create_message as create_message_record,
+    latest_message_cursor, message_cursor, create_messages_batch,
+    mark_chat_read, chat_select, list_group_chats, participant_mode,
+    get_chat_participants_page, list_projected, CHAT_FIELDS, USER_SECTIONS, USER_FIELDS,
+    projected_query, group_chats_query, chat_history_query,
+    chat_transcript_query, group_version, profile_version, chat_version, chat_row_version,
+    chat_messages_version, chat_history_version, group_chats_version
+)
+from serializers import (
+    JSONProvider, GROUP_SCHEMA, PROFILE_SCHEMA, MESSAGE_SCHEMA, dumps, loads,
+    serialize_chat, serialize_chats, serialize_message, serialize_transcript_entry, serialize_group_deletion
+)
+from pagination import parse_limit, parse_fields, parse_ids, decode_cursor
+from broker import create_broker, get_broker, publish, chat_channel, group_channel
+from gateway import GatewaySession, CLOSE_POLICY_VIOLATION
+from write_buffer import MessageWriteBuffer
+from purger import GroupPurger
+from passwords import PasswordHasher, DEFAULT_HASH_METHOD
+from ratelimit import create_rate_limiter
+from compression import ResponseCompressor, COMPRESSIBLE_MIMETYPES
+from user_cache import UserInfoCache, render_document
+from conditional import conditional, set_version
+from streaming import (
+    STREAM_FORMATS, stream_format, stream_listing, streaming_response, iter_partitions,
+    encode_json_array, encode_ndjson
 )
 import logging
 
+# Versioned schema migrations (Alembic, via Flask-Migrate)
+MIGRATIONS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
 def create_app(test_config=None):
     """
     Creates and configures the Flask application.
@@ -22,18 +55,100 @@ def create_app(test_config=None):
         Flask: Configured Flask application.
     """
     app = Flask(__name__)
+    app.json = JSONProvider(app)
     CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True, allow_headers=["Content-Type", "Authorization"], methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
     
     if test_config:
         app.config.update(test_config)
     else:
         app.config['SQLALCHEMY_DATABASE_URI'] = f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@db:5432/{os.getenv('POSTGRES_DB', 'postgres')}"
+        app.config['BROKER_BACKEND'] = os.getenv('BROKER_BACKEND', 'postgres')
+        app.config['MESSAGE_WRITE_BUFFER'] = os.getenv('MESSAGE_WRITE_BUFFER', '0') == '1'
+        app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD)
+        app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+        app.config['RATE_LIMIT_BACKEND'] = os.getenv('RATE_LIMIT_BACKEND', 'memory')
     
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'default_jwt_secret_key')
+    app.config.setdefault('SSE_HEARTBEAT_SECONDS', 15)
+    app.config.setdefault('SSE_BATCH_SIZE', 100)
+    app.config.setdefault('GATEWAY_SEND_QUEUE_SIZE', 256)
+    app.config.setdefault('GATEWAY_SEND_TIMEOUT_SECONDS', 10)
+    app.config.setdefault('GATEWAY_MAX_CHATS', 50)
+    app.config.setdefault('SOCK_SERVER_OPTIONS', {'max_message_size': 16 * 1024, 'ping_interval': 25})
+    app.config.setdefault('MESSAGE_BATCH_MAX_ITEMS', 5000)
+    app.config.setdefault('PROVISION_MAX_ITEMS', 10000)
+    app.config.setdefault('MESSAGE_WRITE_BUFFER', False)
+    app.config.setdefault('MESSAGE_BUFFER_MAX_ROWS', 100)
+    app.config.setdefault('MESSAGE_BUFFER_MAX_DELAY_MS', 5)
+    app.config.setdefault('MESSAGE_BUFFER_ACK_TIMEOUT_SECONDS', 5)
+    app.config.setdefault('STREAM_BATCH_SIZE', 1000)
+    app.config.setdefault('USER_INFO_CACHE_SIZE', 1024)
+    app.config.setdefault('USER_INFO_CACHE_TTL_SECONDS', 60)
+    app.config.setdefault('GROUP_PURGE_BATCH_SIZE', 500)
+    app.config.setdefault('GROUP_PURGE_POLL_SECONDS', 5)
+    app.config.setdefault('GROUP_PURGE_PAUSE_MS', 10)
+    app.config.setdefault('GROUP_PURGE_MAX_ATTEMPTS', 5)
+    app.config.setdefault('GROUP_PURGE_AUTOSTART', not app.testing)
+    app.config.setdefault('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD)
+    app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+    app.config.setdefault('PASSWORD_HASH_QUEUE_DEADLINE_SECONDS', 2)
+    app.config.setdefault('RATE_LIMIT_BACKEND', 'memory')
+    app.config.setdefault('RATE_LIMIT_MAX_KEYS', 100000)
+    app.config.setdefault('LOGIN_RATE_LIMIT_PER_IP', '30/60')
+    app.config.setdefault('LOGIN_RATE_LIMIT_PER_EMAIL', '10/300')
+    app.config.setdefault('REGISTER_RATE_LIMIT_PER_IP', '20/3600')
+    app.config.setdefault('REGISTER_RATE_LIMIT_PER_EMAIL', '5/3600')
+    app.config.setdefault('COMPRESSION_ENABLED', True)
+    app.config.setdefault('COMPRESSION_MIN_SIZE', 1024)
+    app.config.setdefault('COMPRESSION_LEVEL', 6)
+    app.config.setdefault('COMPRESSION_BROTLI_QUALITY', 4)
+    app.config.setdefault('COMPRESSION_ZSTD_LEVEL', 3)
+    app.config.setdefault('COMPRESSION_MIMETYPES', COMPRESSIBLE_MIMETYPES)
+    app.config.setdefault('COMPRESSION_CACHE_MAX_BYTES', 16 * 1024 * 1024)
     
     db.init_app(app)
+    Migrate(app, db, directory=MIGRATIONS_DIRECTORY)
+    app.extensions['broker'] = create_broker(app)
+    app.extensions['message_write_buffer'] = MessageWriteBuffer(
+        app,
+        max_rows=app.config['MESSAGE_BUFFER_MAX_ROWS'],
+        max_delay=app.config['MESSAGE_BUFFER_MAX_DELAY_MS'] / 1000.0,
+        ack_timeout=app.config['MESSAGE_BUFFER_ACK_TIMEOUT_SECONDS']
+    )
+    app.extensions['group_purger'] = GroupPurger(
+        app,
+        batch_size=app.config['GROUP_PURGE_BATCH_SIZE'],
+        poll_interval=app.config['GROUP_PURGE_POLL_SECONDS'],
+        pause=app.config['GROUP_PURGE_PAUSE_MS'] / 1000.0,
+        max_attempts=app.config['GROUP_PURGE_MAX_ATTEMPTS']
+    )
+    if app.config['GROUP_PURGE_AUTOSTART']:
+        # Resume jobs left behind by a restart; workers are forked after create_app, hence a request hook
+        app.before_request(app.extensions['group_purger'].start)
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        queue_deadline=app.config['PASSWORD_HASH_QUEUE_DEADLINE_SECONDS']
+    )
+    app.extensions['rate_limiter'] = create_rate_limiter(app)
+    app.extensions['user_info_cache'] = UserInfoCache(
+        app.extensions['broker'],
+        max_entries=app.config['USER_INFO_CACHE_SIZE'],
+        ttl=app.config['USER_INFO_CACHE_TTL_SECONDS']
+    )
+    app.extensions['response_compressor'] = ResponseCompressor(
+        min_size=app.config['COMPRESSION_MIN_SIZE'],
+        level=app.config['COMPRESSION_LEVEL'],
+        brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY'],
+        zstd_level=app.config['COMPRESSION_ZSTD_LEVEL'],
+        mimetypes=app.config['COMPRESSION_MIMETYPES'],
+        cache_max_bytes=app.config['COMPRESSION_CACHE_MAX_BYTES']
+    )
+    if app.config['COMPRESSION_ENABLED']:
+        app.after_request(app.extensions['response_compressor'].compress_response)
     jwt = JWTManager(app)
+    sock = Sock(app)
     
     logging.basicConfig(level=logging.DEBUG)
     
@@ -57,6 +172,130 @@ def create_app(test_config=None):
         """
         return jsonify({'message': e.description}), 400
     
+    @app.errorhandler(ServiceUnavailable)
+    def handle_service_unavailable(e):
+        """
+        Handles ServiceUnavailable exceptions globally.
+
+        Args:
+            e (ServiceUnavailable): The exception instance.
+
+        Returns:
+            Response: JSON response with error message and status code 503.
+        """
+        return jsonify({'message': e.description}), 503
+    
+    @app.errorhandler(TooManyRequests)
+    def handle_too_many_requests(e):
+        """
+        Handles TooManyRequests exceptions globally.
+
+        Args:
+            e (TooManyRequests): The exception instance.
+
+        Returns:
+            Response: JSON response with error message, status code 429 and a Retry-After header.
+        """
+        return jsonify({'message': e.description}), 429, {'Retry-After': str(e.retry_after)}
+    
+    def limit_attempts(action, data):
+        """
+        Counts a credential request against the per-IP and per-email rate limits.
+
+        Runs before any database lookup or password hashing, so rejected attempts stay cheap.
+
+        Args:
+            action (str): 'login' or 'register'.
+            data: The parsed request body.
+
+        Raises:
+            TooManyRequests: If the client IP or the email is over its limit.
+        """
+        limiter = app.extensions['rate_limiter']
+        limiter.check(f'{action}:ip', request.remote_addr or 'unknown')
+        email = data.get('email') if isinstance(data, dict) else None
+        if isinstance(email, str):
+            limiter.check(f'{action}:email', email.strip().lower()[:254])
+
+    def read_batch_items(name, max_items):
+        """
+        Reads the items of a batch request body.
+
+        The body is a JSON array, an object with the array under `name`, or NDJSON
+        (`Content-Type: application/x-ndjson`) with one item per line. Lines that
+        are not valid JSON become None items, to be reported as invalid.
+
+        Args:
+            name (str): Kind of item, also the key of the array in an object body.
+            max_items (int): Maximum number of items.
+
+        Returns:
+            list: The items.
+
+        Raises:
+            BadRequest: If there are no items or too many.
+        """
+        if request.mimetype == 'application/x-ndjson':
+            items = []
+            for line in request.get_data(as_text=True).splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    items.append(loads(line))
+                except ValueError:
+                    items.append(None)  # reported as an invalid item
+        else:
+            items = request.get_json(silent=True)
+            if isinstance(items, dict):
+                items = items.get(name)
+        if not isinstance(items, list) or not items:
+            raise BadRequest(f'Expected a non-empty list of {name}')
+        if len(items) > max_items:
+            raise BadRequest(f'A batch may contain at most {max_items} {name}')
+        return items
+
+    def requested_chats_version(group_id):
+        """
+        Looks up the version of the chat listing requested from list_chats.
+
+        Args:
+            group_id (str): ID of the group.
+
+        Returns:
+            tuple: (version, last modified), see group_chats_version.
+        """
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit')
+        paginated = cursor is not None or limit is not None
+        return group_chats_version(group_id, profile_id=request.args.get('profile_id'), sort=request.args.get('sort'),
+                                   cursor=cursor, limit=parse_limit(limit) if paginated else None)
+
+    def jsonify_listing(name, model, schema, filters):
+        """
+        Builds the response of a projected listing route from the request's
+        `fields`, `limit`, `cursor` and `stream` query parameters.
+
+        Args:
+            name (str): Key holding the items in a paginated response.
+            model: Mapped class to list.
+            schema (Schema): Schema of the model; its fields can be selected.
+            filters (list): SQL conditions to apply.
+
+        Returns:
+            Response: JSON list of items, a page of items with a cursor, or a streamed listing.
+        """
+        fields = parse_fields(request.args.get('fields'), schema.names)
+        fmt = stream_format()
+        if fmt:
+            query, names = projected_query(model, schema, fields, filters)
+            return stream_listing(query, lambda row: schema.dump(row, names), fmt, app.config['STREAM_BATCH_SIZE'])
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit')
+        if cursor is None and limit is None:
+            return jsonify(list_projected(model, schema, fields, filters)['items'])
+        page = list_projected(model, schema, fields, filters, cursor=cursor, limit=parse_limit(limit))
+        return jsonify({name: page['items'], 'next_cursor': page['next_cursor'], 'has_more': page['has_more']})
+    
     ### Route Definitions Start ###
     
     @app.route('/health')
@@ -69,6 +308,16 @@ def create_app(test_config=None):
         """
         return jsonify({'status': 'healthy'}), 200
     
+    @app.route('/metrics/compression')
+    def compression_metrics():
+        """
+        Endpoint reporting response compression counters of this worker process.
+
+        Returns:
+            Response: JSON with bytes saved and CPU time spent per content coding.
+        """
+        return jsonify(app.extensions['response_compressor'].metrics())
+    
     @app.route('/groups', methods=['POST'])
     @jwt_required()
     def create_group_route():
@@ -94,20 +343,31 @@ def create_app(test_config=None):
 
         Requires JWT authentication.
 
+        Without `limit` or `cursor` every matching group is returned as a list; with
+        either, a page of groups is returned together with a `next_cursor`.
+
+        Query parameters:
+            ids: Comma-separated group ids to return.
+            fields: Comma-separated group fields to include.
+            limit, cursor: Keyset pagination by id.
+            stream: `json` or `ndjson` to stream every matching group.
+
         Returns:
-            Response: JSON list of groups.
+            Response: JSON list of groups, or a page of groups with a cursor.
         """
         app.logger.debug('Fetching all groups')
-        groups = Group.query.all()
-        return jsonify([{'id': group.id, 'name': group.name, 'picture': group.picture, 'max_profiles': group.max_profiles} for group in groups])
+        ids = parse_ids(request.args.get('ids'))
+        filters = [Group.id.in_(ids)] if ids is not None else []
+        return jsonify_listing('groups', Group, GROUP_SCHEMA, filters)
     
     @app.route('/groups/<group_id>', methods=['GET'])
     @jwt_required()
+    @conditional(group_version, reported=lambda: True)
     def get_group(group_id):
         """
         Endpoint to retrieve a specific group by ID.
 
-        Requires JWT authentication.
+        Requires JWT authentication. Supports conditional requests (ETag and Last-Modified).
 
         Args:
             group_id (str): ID of the group.
@@ -117,7 +377,8 @@ def create_app(test_config=None):
         """
         app.logger.debug('Fetching group with id: %s', group_id)
         group = Group.query.get_or_404(group_id)
-        return jsonify({'id': group.id, 'name': group.name, 'picture': group.picture, 'max_profiles': group.max_profiles})
+        set_version((group.updated_at,), group.updated_at)
+        return jsonify(GROUP_SCHEMA.dump(group))
     
     @app.route('/groups/<group_id>', methods=['PUT'])
     @jwt_required()
@@ -147,18 +408,74 @@ def create_app(test_config=None):
 
         Requires JWT authentication.
 
+        With `mode=async` the group is marked deleted, which hides it and everything
+        in it from all reads at once, and its rows are purged by a background job
+        whose progress is available at the returned `status_url`.
+
         Args:
             group_id (str): ID of the group to delete.
 
         Returns:
-            Response: Empty response with status code 204.
+            Response: Empty response with status code 204, or the queued job with status code 202.
         """
-        app.logger.debug('Deleting group with id: %s', group_id)
+        mode = request.args.get('mode', 'sync')
+        if mode not in ('sync', 'async'):
+            raise BadRequest('Invalid delete mode')
+        app.logger.debug('Deleting group with id: %s (%s)', group_id, mode)
+        if mode == 'async':
+            job = request_group_deletion(group_id)
+            app.extensions['group_purger'].wake()
+            status_url = f'/group-deletions/{job.id}'
+            response = jsonify({**serialize_group_deletion(job), 'status_url': status_url})
+            response.headers['Location'] = status_url
+            return response, 202
         group = Group.query.get_or_404(group_id)
         db.session.delete(group)
         db.session.commit()
+        publish(group_channel(group_id), {'type': 'group.deleted', 'group_id': group_id})
         return '', 204
+
+    @app.route('/group-deletions/<job_id>', methods=['GET'])
+    @jwt_required()
+    def get_group_deletion(job_id):
+        """
+        Endpoint to follow the progress of an asynchronous group deletion.
+
+        Requires JWT authentication.
+
+        Args:
+            job_id (str): ID of the deletion job.
+
+        Returns:
+            Response: JSON status of the job and the number of rows purged so far.
+        """
+        job = GroupDeletion.query.get_or_404(job_id)
+        return jsonify(serialize_group_deletion(job))
     
+    @app.route('/provision', methods=['POST'])
+    @jwt_required()
+    def provision_route():
+        """
+        Endpoint to create many groups and profiles with one request and one transaction.
+
+        Requires JWT authentication.
+
+        The body is NDJSON (`Content-Type: application/x-ndjson`) with one group or
+        profile per line, a JSON array of them, or an object with an `items` array.
+
+        Returns:
+            Response: Per-item results in input order; 201 if every item was stored, 207 otherwise.
+        """
+        items = read_batch_items('items', app.config['PROVISION_MAX_ITEMS'])
+        app.logger.debug('Provisioning %d groups and profiles', len(items))
+        results = provision_groups_and_profiles(items)
+        failed = sum(1 for result in results if 'error' in result)
+        return jsonify({
+            'results': results,
+            'created': len(results) - failed,
+            'failed': failed
+        }), 201 if not failed else 207
+
     @app.route('/profiles/check', methods=['POST'])
     @jwt_required()
     def check_profile():
@@ -194,13 +511,7 @@ def create_app(test_config=None):
         user_id = get_jwt_identity()
         try:
             new_profile = create_profile(data, user_id)
-            return jsonify({
-                'id': str(new_profile.id),
-                'name': new_profile.name,
-                'picture': new_profile.picture,
-                'bio': new_profile.bio,
-                'group_id': str(new_profile.group_id)
-            }), 201
+            return jsonify(PROFILE_SCHEMA.dump(new_profile)), 201
         except BadRequest as e:
             return jsonify({'message': str(e)}), 400
     
@@ -212,20 +523,37 @@ def create_app(test_config=None):
 
         Requires JWT authentication.
 
+        Without `limit` or `cursor` every matching profile is returned as a list;
+        with either, a page of profiles is returned together with a `next_cursor`.
+
+        Query parameters:
+            group_id: Only profiles of this group.
+            ids: Comma-separated profile ids to return.
+            fields: Comma-separated profile fields to include.
+            limit, cursor: Keyset pagination by id.
+            stream: `json` or `ndjson` to stream every matching profile.
+
         Returns:
-            Response: JSON list of profiles.
+            Response: JSON list of profiles, or a page of profiles with a cursor.
         """
         app.logger.debug('Fetching all profiles')
-        profiles = Profile.query.all()
-        return jsonify([{'id': profile.id, 'name': profile.name, 'picture': profile.picture, 'bio': profile.bio, 'group_id': profile.group_id} for profile in profiles])
+        filters = []
+        group_id = request.args.get('group_id')
+        if group_id is not None:
+            filters.append(Profile.group_id == group_id)
+        ids = parse_ids(request.args.get('ids'))
+        if ids is not None:
+            filters.append(Profile.id.in_(ids))
+        return jsonify_listing('profiles', Profile, PROFILE_SCHEMA, filters)
     
     @app.route('/profiles/<profile_id>', methods=['GET'])
     @jwt_required()
+    @conditional(profile_version, reported=lambda: True)
     def get_profile(profile_id):
         """
         Endpoint to retrieve a specific profile by ID.
 
-        Requires JWT authentication.
+        Requires JWT authentication. Supports conditional requests (ETag and Last-Modified).
 
         Args:
             profile_id (str): ID of the profile.
@@ -235,7 +563,8 @@ def create_app(test_config=None):
         """
         app.logger.debug('Fetching profile with id: %s', profile_id)
         profile = Profile.query.get_or_404(profile_id)
-        return jsonify({'id': profile.id, 'name': profile.name, 'picture': profile.picture, 'bio': profile.bio, 'group_id': profile.group_id})
+        set_version((profile.updated_at,), profile.updated_at)
+        return jsonify(PROFILE_SCHEMA.dump(profile))
     
     @app.route('/register', methods=['POST'])
     def register():
@@ -247,6 +576,7 @@ def create_app(test_config=None):
         """
         data = request.get_json()
         app.logger.debug('Register data: %s', data)
+        limit_attempts('register', data)
         if User.query.filter_by(email=data['email']).first():
             return jsonify({'message': 'User already exists'}), 400
         if not is_strong_password(data['password']):
@@ -266,8 +596,12 @@ def create_app(test_config=None):
         """
         data = request.get_json()
         app.logger.debug('Login data: %s', data)
+        limit_attempts('login', data)
         user = User.query.filter_by(email=data['email']).first()
         if user and user.check_password(data['password']):
+            if user in db.session.dirty:
+                # The stored hash was upgraded to the configured method and cost
+                db.session.commit()
             access_token = create_access_token(identity=str(user.id))
             return jsonify({'token': access_token}), 200
         return jsonify({'message': 'Invalid credentials'}), 401
@@ -302,52 +636,78 @@ def create_app(test_config=None):
         data = request.get_json()
         app.logger.debug('Create chat data: %s', data)
         try:
-            new_chat = create_chat(data, group_id)
-            user_id = get_jwt_identity()
-            if user_id:
-                profile = Profile.query.filter_by(user_id=user_id, group_id=group_id).first()
-                if profile and profile not in new_chat.participants:
-                    new_chat.participants.append(profile)
-            db.session.commit()
+            new_chat = create_chat(data, group_id, get_jwt_identity())
             return jsonify({'id': str(new_chat.id)}), 201
         except BadRequest as e:
             return jsonify({'message': str(e)}), 400
     
     @app.route('/groups/<group_id>/chats', methods=['GET'])
     @jwt_required()
+    @conditional(requested_chats_version, reported=lambda: 'stream' not in request.args)
     def list_chats(group_id):
         """
         Endpoint to list all chats within a group, optionally filtered by profile ID.
 
-        Requires JWT authentication.
+        Requires JWT authentication. Supports conditional requests: ETag, and
+        Last-Modified unless filtered by profile.
+
+        Chats and their participants are read with a single SQL statement. Without
+        `limit` or `cursor` every chat is returned as a list; with either, a page of
+        chats is returned together with a `next_cursor` for the following page.
+
+        Query parameters:
+            profile_id: Only chats this profile participates in; each chat then
+                includes the profile's `unread_count`.
+            sort: `activity` to order by most recent message first (chats without
+                messages rank by creation time).
+            participants: `ids` (default) for participant_ids, `count` for
+                participant_count only, or `none`.
+            fields: Comma-separated chat fields to include.
+            limit, cursor: Keyset pagination.
+            stream: `json` or `ndjson` to stream every matching chat.
 
         Args:
             group_id (str): ID of the group.
 
         Returns:
-            Response: JSON list of chats.
+            Response: JSON list of chats, or a page of chats with a cursor.
         """
         app.logger.debug('Listing chats for group: %s', group_id)
         profile_id = request.args.get('profile_id')
-        if profile_id:
-            chats = Chat.query.filter(Chat.group_id == group_id, Chat.participants.any(id=profile_id)).all()
-        else:
-            chats = Chat.query.filter_by(group_id=group_id).all()
-        return jsonify([{
-            'id': chat.id,
-            'name': chat.name,
-            'created_at': chat.created_at.isoformat(),
-            'updated_at': chat.updated_at.isoformat(),
-            'participant_ids': [str(p.id) for p in chat.participants]
-        } for chat in chats])
+        fields = parse_fields(request.args.get('fields'), CHAT_FIELDS)
+        participants = participant_mode(request.args.get('participants'), fields)
+        fmt = stream_format()
+        if fmt:
+            query = group_chats_query(group_id, profile_id=profile_id, sort=request.args.get('sort'),
+                                      participants=participants)
+            return stream_listing(query, lambda row: serialize_chat(row, participants, fields),
+                                  fmt, app.config['STREAM_BATCH_SIZE'])
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit')
+        paginated = cursor is not None or limit is not None
+        page = list_group_chats(group_id, profile_id=profile_id, sort=request.args.get('sort'),
+                                participants=participants, cursor=cursor,
+                                limit=parse_limit(limit) if paginated else None)
+        set_version(*page['version'])
+        chats = serialize_chats(page['chats'], participants, fields)
+        if not paginated:
+            return jsonify(chats)
+        return jsonify({'chats': chats, 'next_cursor': page['next_cursor'], 'has_more': page['has_more']})
     
     @app.route('/chats/<chat_id>', methods=['GET'])
     @jwt_required()
+    @conditional(chat_version, reported=lambda: True)
     def get_chat(chat_id):
         """
         Endpoint to retrieve a specific chat by ID.
 
-        Requires JWT authentication.
+        Requires JWT authentication. Supports conditional requests (ETag and Last-Modified).
+
+        Query parameters:
+            participants: `ids` (default) for participant_ids, `count` for
+                participant_count only, or `none`. Use `count` together with the
+                participants endpoint for chats with many members.
+            fields: Comma-separated chat fields to include.
 
         Args:
             chat_id (str): ID of the chat.
@@ -356,16 +716,80 @@ def create_app(test_config=None):
             Response: JSON representation of the chat.
         """
         app.logger.debug('Fetching chat with id: %s', chat_id)
-        chat = Chat.query.get_or_404(chat_id)
-        return jsonify({
-            'id': chat.id,
-            'name': chat.name,
-            'created_at': chat.created_at.isoformat(),
-            'updated_at': chat.updated_at.isoformat(),
-            'group_id': chat.group_id,
-            'participant_ids': [str(p.id) for p in chat.participants]
-        })
+        fields = parse_fields(request.args.get('fields'), CHAT_FIELDS)
+        participants = participant_mode(request.args.get('participants'), fields)
+        chat = db.session.execute(chat_select(participants).where(Chat.id == chat_id)).first()
+        if chat is None:
+            abort(404)
+        set_version(*chat_row_version(chat))
+        return jsonify(serialize_chat(chat, participants, fields))
+    
+    @app.route('/chats/<chat_id>/participants', methods=['GET'])
+    @jwt_required()
+    def list_chat_participants(chat_id):
+        """
+        Endpoint to page through a chat's participants.
+
+        Requires JWT authentication.
+
+        Query parameters:
+            limit, cursor: Keyset pagination by profile id.
+
+        Args:
+            chat_id (str): ID of the chat.
+
+        Returns:
+            Response: A page of participant profiles with a cursor for the next page.
+        """
+        app.logger.debug('Listing participants of chat: %s', chat_id)
+        limit = parse_limit(request.args.get('limit'))
+        if db.session.query(Chat.id).filter_by(id=chat_id).first() is None:
+            abort(404)
+        return jsonify(get_chat_participants_page(chat_id, cursor=request.args.get('cursor'), limit=limit))
     
+    @app.route('/chats/<chat_id>/participants', methods=['POST'])
+    @jwt_required()
+    def add_chat_participants_route(chat_id):
+        """
+        Endpoint to add profiles to a chat.
+
+        Requires JWT authentication.
+
+        The body is `{"profile_ids": [...]}`; profiles that already participate are
+        ignored and existing memberships are not rewritten.
+
+        Args:
+            chat_id (str): ID of the chat.
+
+        Returns:
+            Response: JSON with the number of participants added.
+        """
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or 'profile_ids' not in data:
+            raise BadRequest('profile_ids is required')
+        app.logger.debug('Adding participants to chat %s: %s', chat_id, data['profile_ids'])
+        added = add_chat_participants(chat_id, data['profile_ids'])
+        return jsonify({'id': chat_id, 'added': added})
+
+    @app.route('/chats/<chat_id>/participants/<profile_id>', methods=['DELETE'])
+    @jwt_required()
+    def remove_chat_participant_route(chat_id, profile_id):
+        """
+        Endpoint to remove a profile from a chat.
+
+        Requires JWT authentication.
+
+        Args:
+            chat_id (str): ID of the chat.
+            profile_id (str): ID of the participant to remove.
+
+        Returns:
+            Response: Empty response with status code 204.
+        """
+        app.logger.debug('Removing participant %s from chat %s', profile_id, chat_id)
+        remove_chat_participant(chat_id, profile_id)
+        return '', 204
+
     @app.route('/chats/<chat_id>', methods=['PUT'])
     @jwt_required()
     def update_chat_route(chat_id):
@@ -374,6 +798,9 @@ def create_app(test_config=None):
 
         Requires JWT authentication.
 
+        If `participant_ids` is given, only the memberships that differ from it are
+        inserted or deleted.
+
         Args:
             chat_id (str): ID of the chat to update.
 
@@ -386,6 +813,29 @@ def create_app(test_config=None):
         updated_chat = update_chat(chat, data)
         return jsonify({'id': updated_chat.id})
     
+    @app.route('/chats/<chat_id>/read', methods=['PUT'])
+    @jwt_required()
+    def mark_chat_read_route(chat_id):
+        """
+        Endpoint to move a profile's read marker in a chat.
+
+        Requires JWT authentication.
+
+        The body holds `profile_id` and `cursor`, a message cursor as returned by the
+        messages, stream and gateway endpoints. Everything up to and including that
+        message counts as read. Markers only move forward.
+
+        Args:
+            chat_id (str): ID of the chat.
+
+        Returns:
+            Response: JSON with the profile's read marker and unread_count.
+        """
+        data = request.get_json(silent=True)
+        app.logger.debug('Mark chat read data: %s', data)
+        Chat.query.get_or_404(chat_id)
+        return jsonify(mark_chat_read(chat_id, data))
+
     @app.route('/messages', methods=['POST'])
     @jwt_required()
     def create_message():
@@ -399,34 +849,193 @@ def create_app(test_config=None):
         """
         data = request.get_json()
         app.logger.debug('Create message data: %s', data)
-        new_message = Message(content=data['content'], chat_id=data['chat_id'], profile_id=data['profile_id'])
-        db.session.add(new_message)
-        db.session.commit()
+        new_message = create_message_record(data)
         return jsonify({'id': str(new_message.id)}), 201
 
+    @app.route('/chats/<chat_id>/messages:batch', methods=['POST'])
+    @jwt_required()
+    def create_messages_batch_route(chat_id):
+        """
+        Endpoint to create many messages in a chat with one request and one transaction.
+
+        Requires JWT authentication.
+
+        The body is a JSON array of messages (`content`, `profile_id`), an object with a
+        `messages` array, or NDJSON (`Content-Type: application/x-ndjson`) with one message
+        per line.
+
+        Args:
+            chat_id (str): ID of the chat.
+
+        Returns:
+            Response: Per-item results in input order; 201 if every item was stored, 207 otherwise.
+        """
+        items = read_batch_items('messages', app.config['MESSAGE_BATCH_MAX_ITEMS'])
+        app.logger.debug('Creating %d messages in chat: %s', len(items), chat_id)
+        results = create_messages_batch(chat_id, items)
+        failed = sum(1 for result in results if 'error' in result)
+        return jsonify({
+            'results': results,
+            'created': len(results) - failed,
+            'failed': failed
+        }), 201 if not failed else 207
+
     @app.route('/chats/<chat_id>/messages', methods=['GET'])
     @jwt_required()
+    @conditional(chat_messages_version, reported=lambda: not any(
+        name in request.args for name in ('stream', 'after', 'before', 'limit')))
     def get_messages(chat_id):
         """
-        Endpoint to retrieve all messages from a chat.
+        Endpoint to retrieve messages from a chat.
 
-        Requires JWT authentication.
+        Requires JWT authentication. Supports conditional requests (ETag and Last-Modified).
+
+        Without query parameters the full history is returned as a list; with
+        `stream=json` or `stream=ndjson` it is streamed from a server-side cursor.
+        When any of `after`, `before` or `limit` is given, a bounded page is returned
+        together with cursors for fetching newer (`next_cursor`) and older
+        (`prev_cursor`) messages.
 
         Args:
             chat_id (str): ID of the chat.
 
         Returns:
-            Response: JSON list of messages.
+            Response: JSON list of messages, or a page of messages with cursors.
         """
         app.logger.debug('Fetching messages for chat: %s', chat_id)
-        messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at).all()
-        return jsonify([{
-            'id': message.id,
-            'content': message.content,
-            'created_at': message.created_at.isoformat(),
-            'chat_id': message.chat_id,
-            'profile_id': message.profile_id
-        } for message in messages])
+        after = request.args.get('after')
+        before = request.args.get('before')
+        limit = request.args.get('limit')
+        fmt = stream_format()
+        if fmt:
+            return stream_listing(chat_history_query(chat_id), serialize_message, fmt, app.config['STREAM_BATCH_SIZE'])
+        if after is None and before is None and limit is None:
+            messages = db.session.execute(chat_history_query(chat_id)).all()
+            set_version(*chat_history_version(messages))
+            return jsonify(MESSAGE_SCHEMA.dump_many(messages))
+        page = get_messages_page(chat_id, after=after, before=before, limit=parse_limit(limit))
+        return jsonify({
+            'messages': MESSAGE_SCHEMA.dump_many(page['messages']),
+            'next_cursor': page['next_cursor'],
+            'prev_cursor': page['prev_cursor'],
+            'has_more': page['has_more']
+        })
+    
+    @app.route('/chats/<chat_id>/export', methods=['GET'])
+    @jwt_required()
+    def export_chat(chat_id):
+        """
+        Endpoint to download a chat's full transcript.
+
+        Requires JWT authentication.
+
+        The transcript is streamed from a server-side cursor, so exporting a chat of
+        any size uses a constant amount of memory. With `format=ndjson` (default)
+        each line is one message; with `format=json` the body is a document with the
+        chat and its `messages`.
+
+        Args:
+            chat_id (str): ID of the chat.
+
+        Returns:
+            Response: The transcript as a file download.
+        """
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in STREAM_FORMATS:
+            raise BadRequest('Invalid format')
+        chat = db.session.execute(chat_select('count').where(Chat.id == chat_id)).first()
+        if chat is None:
+            abort(404)
+        app.logger.debug('Exporting chat: %s', chat_id)
+        partitions = iter_partitions(chat_transcript_query(chat_id), app.config['STREAM_BATCH_SIZE'])
+        if fmt == 'ndjson':
+            chunks = encode_ndjson(partitions, serialize_transcript_entry)
+        else:
+            def document():
+                yield '{{"chat":{},"messages":'.format(dumps(serialize_chat(chat, 'count')))
+                yield from encode_json_array(partitions, serialize_transcript_entry)
+                yield '}'
+            chunks = document()
+        return streaming_response(chunks, fmt, filename=f'chat-{chat_id}.{fmt}')
+
+    @app.route('/chats/<chat_id>/stream', methods=['GET'])
+    @jwt_required(locations=['headers', 'query_string'])
+    def stream_messages(chat_id):
+        """
+        Server-Sent Events endpoint pushing new messages of a chat as they are created.
+
+        Requires JWT authentication, either as a bearer token or as the `jwt` query
+        parameter (EventSource cannot set headers). Each event's id is a message cursor;
+        a reconnecting client resumes after the `Last-Event-ID` header, or after the
+        `last_event_id` query parameter on first connect. Heartbeat comments are sent
+        while the chat is idle.
+
+        Args:
+            chat_id (str): ID of the chat.
+
+        Returns:
+            Response: A text/event-stream response.
+        """
+        Chat.query.get_or_404(chat_id)
+        cursor = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        if cursor:
+            decode_cursor(cursor, datetime, str)  # rejects malformed cursors before streaming starts
+        heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+        batch_size = app.config['SSE_BATCH_SIZE']
+
+        def events(cursor):
+            # Subscribe before reading so no message committed in between is missed
+            subscription = get_broker().subscribe([chat_channel(chat_id)])
+            try:
+                if cursor is None:
+                    cursor = latest_message_cursor(chat_id)
+                yield 'retry: 3000\n\n'
+                while True:
+                    page = get_messages_page(chat_id, after=cursor, limit=batch_size)
+                    for message in page['messages']:
+                        yield 'id: {}\nevent: message\ndata: {}\n\n'.format(
+                            message_cursor(message), dumps(serialize_message(message)))
+                    cursor = page['next_cursor']
+                    # Give the connection back to the pool while waiting for the next event
+                    db.session.remove()
+                    if page['has_more']:
+                        continue
+                    if subscription.get(timeout=heartbeat) is None:
+                        yield ': heartbeat\n\n'
+            finally:
+                subscription.close()
+                db.session.remove()
+
+        response = Response(stream_with_context(events(cursor)), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+    
+    @sock.route('/ws')
+    def chat_gateway(ws):
+        """
+        WebSocket gateway for joining chats, receiving their messages and sending acked messages.
+
+        The JWT is verified once when the connection opens, from the `jwt` query parameter
+        or the Authorization header; invalid tokens close the socket with code 1008.
+        See GatewaySession for the frame protocol.
+
+        Args:
+            ws: The WebSocket connection.
+        """
+        try:
+            verify_jwt_in_request(locations=['query_string', 'headers'])
+        except Exception:
+            ws.close(reason=CLOSE_POLICY_VIOLATION, message='Authorization token is missing or invalid')
+            return
+        app.logger.debug('Gateway connection opened by user: %s', get_jwt_identity())
+        GatewaySession(
+            ws, app, get_broker(),
+            send_queue_size=app.config['GATEWAY_SEND_QUEUE_SIZE'],
+            send_timeout=app.config['GATEWAY_SEND_TIMEOUT_SECONDS'],
+            max_chats=app.config['GATEWAY_MAX_CHATS'],
+            heartbeat=app.config['SSE_HEARTBEAT_SECONDS']
+        ).run()
     
     @app.route('/users/me', methods=['GET'])
     @authenticate
@@ -436,13 +1045,40 @@ def create_app(test_config=None):
 
         Requires JWT authentication.
 
+        Query parameters:
+            include: Comma-separated sections to return (profiles, groups, chats).
+            fields: Comma-separated fields to return: `id`, `email`, or section
+                fields qualified with the section name, e.g. `chats.name`.
+            chats_limit, chats_cursor: Keyset pagination of the chats section.
+
+        The full document is cached per user until one of the user's profiles,
+        groups or chats changes. Every response carries an ETag; a request whose
+        If-None-Match matches gets an empty 304 response.
+
         Returns:
             Response: JSON representation of the user's information.
         """
         user_id = request.user_id
+        cache = app.extensions['user_info_cache']
         try:
-            user_info = get_user_info(user_id)
-            return jsonify(user_info), 200
+            include = parse_fields(request.args.get('include'), USER_SECTIONS, label='section')
+            fields = parse_fields(request.args.get('fields'), USER_FIELDS)
+            chats_cursor = request.args.get('chats_cursor')
+            chats_limit = request.args.get('chats_limit')
+            if include is None and fields is None and chats_cursor is None and chats_limit is None:
+                cached = cache.get(user_id)
+                if cached is None:
+                    cached = cache.set(user_id, get_user_info(user_id))
+            else:
+                paginated = chats_cursor is not None or chats_limit is not None
+                cached = render_document(get_user_info(
+                    user_id, include=include or USER_SECTIONS, fields=fields, chats_cursor=chats_cursor,
+                    chats_limit=parse_limit(chats_limit) if paginated else None))
+            body, etag = cached
+            response = app.response_class(body, mimetype='application/json')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response.make_conditional(request)
         except BadRequest as e:
             return jsonify({'message': str(e)}), 400
         except Exception as e:
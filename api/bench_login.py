@@ -0,0 +1,104 @@
+"""
+Benchmark of login throughput against the number of password hashing processes.
+
+The process runs like one gevent web worker: concurrent clients log in through
+the WSGI app in greenlets while a probe requests /health every few
+milliseconds. For each PASSWORD_HASH_WORKERS value (0 hashes inline) it reports
+logins per second, logins shed with 503, and the /health latency (including
+the wait to be scheduled) during the storm, which shows whether hashing pins
+the worker.
+
+Usage:
+    python bench_login.py [--workers 0,1,2,4] [--clients 32] [--logins 20] [--method scrypt:32768:8:1]
+
+Set BENCH_DATABASE_URL to run against Postgres; by default a temporary SQLite
+file is used.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import os
+import tempfile
+import time
+import gevent
+from app import create_app
+from models import db, User
+
+def build_app(database_url, method, workers, queue_deadline):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'JWT_SECRET_KEY': 'bench',
+        'BROKER_BACKEND': 'memory',
+        'PASSWORD_HASH_METHOD': method,
+        'PASSWORD_HASH_WORKERS': workers,
+        'PASSWORD_HASH_QUEUE_DEADLINE_SECONDS': queue_deadline
+    })
+    app.logger.setLevel('WARNING')
+    return app
+
+def seed(app):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add(User(email='bench@example.com', password='Password1'))
+        db.session.commit()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def run(app, clients, logins):
+    statuses = []
+    health = []
+    done = False
+
+    def login():
+        client = app.test_client()
+        for _ in range(logins):
+            response = client.post('/login', json={'email': 'bench@example.com', 'password': 'Password1'})
+            statuses.append(response.status_code)
+
+    def probe():
+        client = app.test_client()
+        while not done:
+            # Includes the time the probe waits to be scheduled, as a queued request would
+            start = time.perf_counter()
+            gevent.sleep(0.005)
+            client.get('/health')
+            health.append(time.perf_counter() - start - 0.005)
+
+    # Start the pool processes before timing
+    with app.app_context():
+        User.query.first().check_password('Password1')
+    prober = gevent.spawn(probe)
+    start = time.perf_counter()
+    gevent.joinall([gevent.spawn(login) for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+    done = True
+    prober.join()
+    return statuses.count(200) / elapsed, statuses.count(503), percentile(health, 0.5), percentile(health, 0.99)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', default='0,1,2,4', help='comma-separated PASSWORD_HASH_WORKERS values')
+    parser.add_argument('--clients', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--logins', type=int, default=20, help='logins per client')
+    parser.add_argument('--method', default='scrypt:32768:8:1', help='PASSWORD_HASH_METHOD')
+    parser.add_argument('--queue-deadline', type=float, default=30, help='PASSWORD_HASH_QUEUE_DEADLINE_SECONDS')
+    args = parser.parse_args()
+
+    database_url = os.getenv('BENCH_DATABASE_URL')
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    print(f'database: {database_url.split("@")[-1]}, method: {args.method}, cpus: {os.cpu_count()}, '
+          f'clients: {args.clients}, logins/client: {args.logins}')
+    for workers in (int(value) for value in args.workers.split(',')):
+        app = build_app(database_url, args.method, workers, args.queue_deadline)
+        seed(app)
+        rate, shed, health_p50, health_p99 = run(app, args.clients, args.logins)
+        print(f'workers {workers:>2}: {rate:8.1f} logins/s, {shed:4d} shed, '
+              f'/health p50 {health_p50 * 1000:7.1f} ms, p99 {health_p99 * 1000:7.1f} ms')
+
+if __name__ == '__main__':
+    main()
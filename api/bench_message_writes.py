@@ -0,0 +1,128 @@
+"""
+Benchmarks of message write throughput.
+
+1. Per-row commit versus the group-commit buffer: concurrent writer threads call
+   the message write path directly (no HTTP or JWT overhead) so the numbers
+   reflect transaction cost only.
+2. Batch ingest (create_messages_batch) versus a raw DB-API executemany of the
+   same rows. Both generate ids and sequence numbers inside the timed region;
+   the raw insert skips validation, the chat counters and the read markers.
+
+Usage:
+    python bench_message_writes.py [--writers 16] [--messages 200] [--batch-size 5000]
+
+Set BENCH_DATABASE_URL to run against Postgres; by default a temporary SQLite
+file is used.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+from app import create_app
+from models import db, Group, Profile, User, Chat
+from services import create_message, create_messages_batch
+
+def build_app(database_url, buffered, max_rows, max_delay_ms):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': database_url,
+        'JWT_SECRET_KEY': 'bench',
+        'BROKER_BACKEND': 'memory',
+        'MESSAGE_WRITE_BUFFER': buffered,
+        'MESSAGE_BUFFER_MAX_ROWS': max_rows,
+        'MESSAGE_BUFFER_MAX_DELAY_MS': max_delay_ms
+    })
+    app.logger.setLevel('WARNING')
+    return app
+
+def seed(app):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(email='bench@example.com', password='Password1')
+        group = Group(name='Bench', picture='', max_profiles=10)
+        db.session.add_all([user, group])
+        db.session.flush()
+        profile = Profile(name='Bench', picture='', bio='', group_id=group.id, user_id=user.id)
+        chat = Chat(name='general', group_id=group.id)
+        db.session.add_all([profile, chat])
+        db.session.commit()
+        return chat.id, profile.id
+
+def run(app, chat_id, profile_id, writers, messages):
+    def writer(index):
+        with app.app_context():
+            for i in range(messages):
+                create_message({'content': f'writer {index} message {i}', 'chat_id': chat_id, 'profile_id': profile_id})
+            db.session.remove()
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return writers * messages / (time.perf_counter() - start)
+
+def run_batch(app, chat_id, profile_id, batch_size):
+    items = [{'content': f'batch message {i}', 'profile_id': profile_id} for i in range(batch_size)]
+    with app.app_context():
+        start = time.perf_counter()
+        create_messages_batch(chat_id, items)
+        elapsed = time.perf_counter() - start
+        db.session.remove()
+    return batch_size / elapsed
+
+def run_raw_executemany(app, chat_id, profile_id, batch_size):
+    contents = [f'raw message {i}' for i in range(batch_size)]
+    with app.app_context():
+        connection = db.engine.raw_connection()
+        placeholder = '?' if db.engine.dialect.paramstyle == 'qmark' else '%s'
+        try:
+            start = time.perf_counter()
+            now = datetime.utcnow()
+            rows = [(str(uuid.uuid4()), content, now, chat_id, profile_id, seq) for seq, content in enumerate(contents, 1)]
+            cursor = connection.cursor()
+            cursor.executemany(
+                'INSERT INTO message (id, content, created_at, chat_id, profile_id, seq) VALUES ({})'.format(', '.join([placeholder] * 6)),
+                rows)
+            connection.commit()
+            elapsed = time.perf_counter() - start
+        finally:
+            connection.close()
+    return batch_size / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=16, help='concurrent writer threads')
+    parser.add_argument('--messages', type=int, default=200, help='messages per writer')
+    parser.add_argument('--max-rows', type=int, default=100, help='MESSAGE_BUFFER_MAX_ROWS')
+    parser.add_argument('--max-delay-ms', type=float, default=5, help='MESSAGE_BUFFER_MAX_DELAY_MS')
+    parser.add_argument('--batch-size', type=int, default=5000, help='messages per batch ingest')
+    args = parser.parse_args()
+
+    database_url = os.getenv('BENCH_DATABASE_URL')
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    print(f'database: {database_url.split("@")[-1]}, writers: {args.writers}, messages/writer: {args.messages}')
+    for label, buffered in (('per-row commit', False), ('group commit', True)):
+        app = build_app(database_url, buffered, args.max_rows, args.max_delay_ms)
+        chat_id, profile_id = seed(app)
+        rate = run(app, chat_id, profile_id, args.writers, args.messages)
+        print(f'{label:>15}: {rate:10.1f} messages/s')
+
+    app = build_app(database_url, False, args.max_rows, args.max_delay_ms)
+    chat_id, profile_id = seed(app)
+    with app.app_context():
+        # Batch ingest checks membership, so make the sender a participant
+        chat = db.session.get(Chat, chat_id)
+        chat.participants.append(db.session.get(Profile, profile_id))
+        db.session.commit()
+    print(f'batch of {args.batch_size}:')
+    print(f'{"batch endpoint":>15}: {run_batch(app, chat_id, profile_id, args.batch_size):10.1f} messages/s')
+    print(f'{"raw executemany":>15}: {run_raw_executemany(app, chat_id, profile_id, args.batch_size):10.1f} messages/s')
+
+if __name__ == '__main__':
+    main()
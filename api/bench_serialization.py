@@ -0,0 +1,110 @@
+"""
+Benchmark of API payload encoding: time to serialize and JSON-encode 10k messages and chats.
+
+Compares the previous hand-built dicts encoded with the standard library
+against the schemas of serializers.py, with the standard library encoder and
+with orjson when it is installed. Messages are encoded both from selected rows
+and from ORM objects; chats from chat_select rows. Database reads are not
+timed.
+
+Usage:
+    python bench_serialization.py [--rows 10000] [--repeat 5]
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+import serializers
+from app import create_app
+from models import db, User, Group, Profile, Chat, Message
+from serializers import MESSAGE_SCHEMA, serialize_chats
+from services import chat_history_query, chat_select
+
+def seed(app, rows):
+    with app.app_context():
+        db.create_all()
+        group = Group(name='Bench', picture='', max_profiles=10)
+        db.session.add(group)
+        db.session.flush()
+        user_id, profile_id = str(uuid.uuid4()), str(uuid.uuid4())
+        # Password hashes are not needed to encode payloads
+        db.session.execute(insert(User.__table__).values(id=user_id, email='bench@example.com', password='unused'))
+        db.session.execute(insert(Profile.__table__).values(id=profile_id, name='Bench', picture='', bio='',
+                                                            group_id=group.id, user_id=user_id))
+        now = datetime.utcnow()
+        chat_id = str(uuid.uuid4())
+        db.session.execute(insert(Chat.__table__), [
+            {'id': chat_id if i == 0 else str(uuid.uuid4()), 'name': f'Chat {i}', 'group_id': group.id,
+             'created_at': now, 'updated_at': now, 'message_count': 0, 'last_message_at': now,
+             'last_message_preview': f'Preview {i}'} for i in range(rows)])
+        db.session.execute(insert(Message.__table__), [
+            {'id': str(uuid.uuid4()), 'content': f'Message {i} with some text', 'chat_id': chat_id,
+             'profile_id': profile_id, 'created_at': now + timedelta(microseconds=i)} for i in range(rows)])
+        db.session.commit()
+        return chat_id, group.id
+
+def hand_built_message(message):
+    return {
+        'id': message.id,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+        'chat_id': message.chat_id,
+        'profile_id': message.profile_id
+    }
+
+def hand_built_chat(row):
+    return {
+        'id': row.id,
+        'name': row.name,
+        'created_at': row.created_at.isoformat(),
+        'updated_at': row.updated_at.isoformat(),
+        'group_id': row.group_id,
+        'last_message_at': row.last_message_at.isoformat() if row.last_message_at else None,
+        'message_count': row.message_count,
+        'last_message_preview': row.last_message_preview,
+        'participant_count': row.participant_count
+    }
+
+def best_time(encode, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='messages and chats to encode')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement; the best is reported')
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:', 'JWT_SECRET_KEY': 'bench', 'BROKER_BACKEND': 'memory'})
+    app.logger.setLevel('WARNING')
+    chat_id, group_id = seed(app, args.rows)
+    fast_backend = serializers.orjson
+    with app.app_context():
+        message_rows = db.session.execute(chat_history_query(chat_id)).all()
+        message_objects = Message.query.all()
+        chat_rows = db.session.execute(chat_select('count').where(Chat.group_id == group_id)).all()
+        cases = {
+            'messages (rows)': (message_rows, hand_built_message, MESSAGE_SCHEMA.dump_many),
+            'messages (ORM)': (message_objects, hand_built_message, MESSAGE_SCHEMA.dump_many),
+            'chats (rows)': (chat_rows, hand_built_chat, lambda rows: serialize_chats(rows, 'count'))
+        }
+        print(f'{args.rows} items, best of {args.repeat}; orjson {"installed" if fast_backend else "not installed"}')
+        for label, (items, hand_built, schema_dump) in cases.items():
+            results = [('hand-built + json', best_time(lambda: json.dumps([hand_built(item) for item in items]), args.repeat))]
+            serializers.orjson = None
+            results.append(('schema + json', best_time(lambda: serializers.dumps(schema_dump(items)), args.repeat)))
+            serializers.orjson = fast_backend
+            if fast_backend is not None:
+                results.append(('schema + orjson', best_time(lambda: serializers.dumps(schema_dump(items)), args.repeat)))
+            print(label)
+            for name, seconds in results:
+                print(f'  {name:>18}: {seconds * 1000:8.1f} ms per {args.rows}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+import json
+import logging
+import os
+import queue
+import select
+import threading
+from flask import current_app
+
+class Subscription:
+    """
+    A consumer's view of one or more broker channels.
+
+    Events are buffered in a bounded queue. If the consumer falls behind and the
+    queue fills up, further events are dropped and `overflowed` is set; consumers
+    treat events as wake-up hints and re-read the database, so nothing is lost.
+
+    Several subscriptions may share one bounded `sink` queue, so a consumer that
+    follows many channels can wait on all of them at once.
+
+    Attributes:
+        channels (tuple): Channels this subscription listens to.
+        overflowed (bool): Whether events were dropped since the last get().
+    """
+    def __init__(self, broker, channels, maxsize, sink=None):
+        self.broker = broker
+        self.channels = tuple(channels)
+        self.overflowed = False
+        self._queue = sink if sink is not None else queue.Queue(maxsize=maxsize)
+
+    def deliver(self, channel, event):
+        """
+        Queues an event for this subscription without blocking the publisher.
+
+        Args:
+            channel (str): Channel the event was published on.
+            event (dict): The event payload.
+        """
+        try:
+            self._queue.put_nowait((channel, event))
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout=None):
+        """
+        Waits for the next event.
+
+        Args:
+            timeout (float, optional): Seconds to wait before giving up.
+
+        Returns:
+            tuple: (channel, event), or None if the timeout expired.
+        """
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.overflowed = False
+        return item
+
+    def close(self):
+        """
+        Stops receiving events.
+        """
+        self.broker.unsubscribe(self)
+
+class InProcessBroker:
+    """
+    Publish/subscribe broker that fans events out to subscribers in the same process.
+    """
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        """
+        Publishes an event to every subscriber of a channel.
+
+        Args:
+            channel (str): Channel name, e.g. 'chat:<chat_id>'.
+            event (dict): JSON-serializable event payload.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.deliver(channel, event)
+
+    def subscribe(self, channels, sink=None):
+        """
+        Subscribes to one or more channels.
+
+        Args:
+            channels (Iterable[str]): Channel names.
+            sink (queue.Queue, optional): Bounded queue to deliver events into instead of a private one.
+
+        Returns:
+            Subscription: The new subscription.
+        """
+        subscription = Subscription(self, channels, self.queue_size, sink=sink)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes a subscription from all of its channels.
+
+        Args:
+            subscription (Subscription): The subscription to remove.
+        """
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+class PostgresBroker:
+    """
+    Publish/subscribe broker backed by Postgres LISTEN/NOTIFY.
+
+    Events published by any worker process are delivered to subscribers in every
+    process connected to the same database. Each process keeps one listening
+    connection, LISTENs only on channels it has local subscribers for, and fans
+    notifications out through an InProcessBroker.
+    """
+    def __init__(self, dsn, queue_size=100):
+        self.dsn = dsn
+        self._local = InProcessBroker(queue_size=queue_size)
+        self._listen_counts = {}
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._publish_conn = None
+        self._publish_pid = None
+        self._listener = None
+        self._listener_pid = None
+        self._wakeup_r, self._wakeup_w = None, None
+
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+
+    def publish(self, channel, event):
+        """
+        Publishes an event to every subscriber of a channel in any process.
+
+        Args:
+            channel (str): Channel name, e.g. 'chat:<chat_id>'.
+            event (dict): JSON-serializable event payload (must encode to under 8000 bytes).
+        """
+        payload = json.dumps(event)
+        with self._publish_lock:
+            for attempt in (1, 2):
+                try:
+                    # A connection inherited across fork must not be shared with the parent
+                    if self._publish_conn is None or self._publish_conn.closed or self._publish_pid != os.getpid():
+                        self._publish_conn = self._connect()
+                        self._publish_pid = os.getpid()
+                    with self._publish_conn.cursor() as cursor:
+                        cursor.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+                    return
+                except Exception:
+                    # Retry once on a fresh connection if the old one was dropped
+                    self._publish_conn = None
+                    if attempt == 2:
+                        raise
+
+    def subscribe(self, channels, sink=None):
+        """
+        Subscribes to one or more channels.
+
+        Args:
+            channels (Iterable[str]): Channel names.
+            sink (queue.Queue, optional): Bounded queue to deliver events into instead of a private one.
+
+        Returns:
+            Subscription: The new subscription.
+        """
+        subscription = self._local.subscribe(channels, sink=sink)
+        subscription.broker = self
+        with self._lock:
+            self._ensure_listener()
+            for channel in subscription.channels:
+                self._listen_counts[channel] = self._listen_counts.get(channel, 0) + 1
+                if self._listen_counts[channel] == 1:
+                    self._pending.put(('LISTEN', channel))
+        self._wake()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes a subscription and stops listening on channels nobody needs anymore.
+
+        Args:
+            subscription (Subscription): The subscription to remove.
+        """
+        self._local.unsubscribe(subscription)
+        with self._lock:
+            for channel in subscription.channels:
+                remaining = self._listen_counts.get(channel, 0) - 1
+                if remaining > 0:
+                    self._listen_counts[channel] = remaining
+                else:
+                    self._listen_counts.pop(channel, None)
+                    self._pending.put(('UNLISTEN', channel))
+        self._wake()
+
+    def _ensure_listener(self):
+        # Worker processes are forked after the app is created, so the listener
+        # thread is started lazily in whichever process first subscribes.
+        if self._listener is not None and self._listener.is_alive() and self._listener_pid == os.getpid():
+            return
+        if self._listener_pid != os.getpid():
+            self._wakeup_r, self._wakeup_w = os.pipe()
+        self._listener_pid = os.getpid()
+        self._listener = threading.Thread(target=self._listen_forever, name='broker-listener', daemon=True)
+        self._listener.start()
+
+    def _wake(self):
+        if self._wakeup_w is not None:
+            try:
+                os.write(self._wakeup_w, b'x')
+            except OSError:
+                pass
+
+    def _listen_forever(self):
+        conn = None
+        while True:
+            try:
+                if conn is None or conn.closed:
+                    conn = self._connect()
+                    with self._lock:
+                        # Re-establish every channel after a reconnect
+                        channels = list(self._listen_counts)
+                    for channel in channels:
+                        self._execute_listen(conn, 'LISTEN', channel)
+                while not self._pending.empty():
+                    command, channel = self._pending.get_nowait()
+                    self._execute_listen(conn, command, channel)
+                readable, _, _ = select.select([conn, self._wakeup_r], [], [], 5.0)
+                if self._wakeup_r in readable:
+                    os.read(self._wakeup_r, 1024)
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        event = json.loads(notify.payload)
+                    except ValueError:
+                        logging.warning('Dropping malformed notification on %s', notify.channel)
+                        continue
+                    self._local.publish(notify.channel, event)
+            except Exception:
+                logging.exception('Broker listener connection failed, reconnecting')
+                conn = None
+                threading.Event().wait(1.0)
+
+    @staticmethod
+    def _execute_listen(conn, command, channel):
+        with conn.cursor() as cursor:
+            cursor.execute('{} "{}"'.format(command, channel.replace('"', '""')))
+
+def create_broker(app):
+    """
+    Creates the broker selected by the BROKER_BACKEND setting.
+
+    'memory' delivers events within the current process only and suits tests and
+    single-process deployments; 'postgres' delivers them across worker processes
+    through LISTEN/NOTIFY on the application database.
+
+    Args:
+        app (Flask): The application.
+
+    Returns:
+        InProcessBroker or PostgresBroker: The broker.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    backend = app.config.get('BROKER_BACKEND', 'memory')
+    queue_size = app.config.get('BROKER_QUEUE_SIZE', 100)
+    if backend == 'memory':
+        return InProcessBroker(queue_size=queue_size)
+    if backend == 'postgres':
+        dsn = app.config.get('BROKER_DATABASE_URL') or app.config['SQLALCHEMY_DATABASE_URI']
+        # psycopg2 accepts libpq URIs, which do not carry SQLAlchemy's driver suffix
+        dsn = dsn.replace('postgresql+psycopg2://', 'postgresql://', 1)
+        return PostgresBroker(dsn, queue_size=queue_size)
+    raise ValueError(f'Unknown BROKER_BACKEND: {backend}')
+
+def chat_channel(chat_id):
+    """
+    Returns the broker channel carrying events for a chat.
+    """
+    return f'chat:{chat_id}'
+
+def group_channel(group_id):
+    """
+    Returns the broker channel carrying events for a group.
+    """
+    return f'group:{group_id}'
+
+def user_channel(user_id):
+    """
+    Returns the broker channel carrying events for a user.
+    """
+    return f'user:{user_id}'
+
+def get_broker():
+    """
+    Returns the broker configured for the current application.
+    """
+    return current_app.extensions['broker']
+
+def publish(channel, event):
+    """
+    Publishes an event on the current application's broker.
+
+    Publishing is best effort: a failure is logged and never fails the write that
+    triggered it, since subscribers can always catch up from the database.
+
+    Args:
+        channel (str): Channel name.
+        event (dict): JSON-serializable event payload.
+    """
+    try:
+        get_broker().publish(channel, event)
+    except Exception:
+        logging.exception('Failed to publish event on %s', channel)
@@ -0,0 +1,258 @@
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional: br is not offered without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd is not offered without it
+    zstandard = None
+
+# Compressed unless COMPRESSION_MIMETYPES says otherwise; text/* is always included
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+class ZlibCodec:
+    """
+    gzip (wbits=31) or deflate, i.e. zlib-wrapped (wbits=15), content coding.
+    """
+    def __init__(self, level, wbits):
+        self.level = level
+        self.wbits = wbits
+
+    def compress(self, data):
+        encoder = zlib.compressobj(self.level, zlib.DEFLATED, self.wbits)
+        return encoder.compress(data) + encoder.flush()
+
+    def stream(self):
+        return ZlibStream(zlib.compressobj(self.level, zlib.DEFLATED, self.wbits))
+
+class ZlibStream:
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def write(self, data):
+        # Sync-flush so each chunk can be decoded by the client as soon as it arrives
+        return self.encoder.compress(data) + self.encoder.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.encoder.flush()
+
+class BrotliCodec:
+    """
+    br content coding (requires the brotli package).
+    """
+    def __init__(self, quality):
+        self.quality = quality
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.quality)
+
+    def stream(self):
+        return BrotliStream(brotli.Compressor(quality=self.quality))
+
+class BrotliStream:
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def write(self, data):
+        return self.encoder.process(data) + self.encoder.flush()
+
+    def finish(self):
+        return self.encoder.finish()
+
+class ZstdCodec:
+    """
+    zstd content coding (requires the zstandard package).
+    """
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def stream(self):
+        return ZstdStream(self.compressor.compressobj())
+
+class ZstdStream:
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def write(self, data):
+        return self.encoder.compress(data) + self.encoder.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.encoder.flush()
+
+class ResponseCompressor:
+    """
+    Compresses responses with the content coding negotiated from Accept-Encoding.
+
+    zstd and br are offered when their packages are installed, then gzip and
+    deflate; among the codings the client accepts with the highest q-value, the
+    first of that order wins. Only successful responses of compressible types are
+    compressed, and bodies smaller than `min_size` bytes are sent as they are.
+    Streamed responses are compressed chunk by chunk, each chunk flushed so the
+    client still receives every batch as it is produced. Compressed bodies of
+    responses carrying an ETag are cached by content digest, up to
+    `cache_max_bytes`, so repeated documents are compressed once.
+
+    Counters of bytes in and out and of the CPU time spent compressing are kept
+    per coding and returned by metrics().
+    """
+    def __init__(self, min_size=1024, level=6, brotli_quality=4, zstd_level=3,
+                 mimetypes=COMPRESSIBLE_MIMETYPES, cache_max_bytes=16 * 1024 * 1024):
+        self.min_size = min_size
+        self.mimetypes = frozenset(mimetypes)
+        self.cache_max_bytes = cache_max_bytes
+        self.codecs = OrderedDict()
+        if zstandard is not None:
+            self.codecs['zstd'] = ZstdCodec(zstd_level)
+        if brotli is not None:
+            self.codecs['br'] = BrotliCodec(brotli_quality)
+        self.codecs['gzip'] = ZlibCodec(level, 31)
+        self.codecs['deflate'] = ZlibCodec(level, 15)
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._counters = {name: {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0}
+                          for name in self.codecs}
+        self._events = {'skipped_small': 0, 'cache_hits': 0, 'cache_misses': 0}
+        self._lock = threading.Lock()
+
+    def negotiate(self, accept_encodings):
+        """
+        Picks the content coding to use.
+
+        Args:
+            accept_encodings (Accept): The request's parsed Accept-Encoding header.
+
+        Returns:
+            str: A key of `codecs`, or None to send the body uncompressed.
+        """
+        best, best_quality = None, 0
+        for name in self.codecs:
+            quality = accept_encodings.quality(name)
+            if quality > best_quality:
+                best, best_quality = name, quality
+        return best
+
+    def compress_response(self, response):
+        """
+        after_request hook compressing the response if the client accepts it.
+
+        Args:
+            response (Response): The response.
+
+        Returns:
+            Response: The same response, possibly compressed.
+        """
+        if request.method == 'HEAD' or not 200 <= response.status_code < 300 or response.status_code in (204, 206):
+            return response
+        if response.mimetype not in self.mimetypes and not response.mimetype.startswith('text/'):
+            return response
+        response.vary.add('Accept-Encoding')
+        if 'Content-Encoding' in response.headers or response.cache_control.no_transform:
+            return response
+        encoding = self.negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                self._count_event('skipped_small')
+                return response
+            etag, weak = response.get_etag()
+            response.set_data(self._compress_body(body, encoding, cacheable=etag is not None))
+            if etag and not weak:
+                # The coded bytes differ from the identity representation's
+                response.set_etag(etag, weak=True)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def metrics(self):
+        """
+        Returns compression counters since the process started.
+
+        Returns:
+            dict: Per coding, the responses compressed, bytes in and out, bytes
+            saved and CPU seconds spent; plus responses skipped as too small and
+            compressed-body cache hits and misses.
+        """
+        with self._lock:
+            encodings = {name: {**counters, 'bytes_saved': counters['bytes_in'] - counters['bytes_out']}
+                         for name, counters in self._counters.items()}
+            return {
+                'encodings': encodings,
+                'bytes_saved': sum(counters['bytes_saved'] for counters in encodings.values()),
+                'cpu_seconds': sum(counters['cpu_seconds'] for counters in encodings.values()),
+                **self._events,
+                'cache_entries': len(self._cache),
+                'cache_bytes': self._cache_bytes
+            }
+
+    def _compress_body(self, body, encoding, cacheable):
+        key = None
+        if cacheable:
+            key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+            with self._lock:
+                compressed = self._cache.get(key)
+                if compressed is not None:
+                    self._cache.move_to_end(key)
+                    self._events['cache_hits'] += 1
+                    return compressed
+                self._events['cache_misses'] += 1
+        start = time.thread_time()
+        compressed = self.codecs[encoding].compress(body)
+        self._record(encoding, len(body), len(compressed), time.thread_time() - start, response=True)
+        if key is not None and len(compressed) <= self.cache_max_bytes:
+            with self._lock:
+                if key not in self._cache:
+                    self._cache[key] = compressed
+                    self._cache_bytes += len(compressed)
+                while self._cache_bytes > self.cache_max_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(evicted)
+        return compressed
+
+    def _compress_stream(self, chunks, encoding):
+        encoder = self.codecs[encoding].stream()
+        self._record(encoding, 0, 0, 0.0, response=True)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                if not chunk:
+                    continue
+                start = time.thread_time()
+                compressed = encoder.write(chunk)
+                self._record(encoding, len(chunk), len(compressed), time.thread_time() - start)
+                yield compressed
+            tail = encoder.finish()
+            self._record(encoding, 0, len(tail), 0.0)
+            yield tail
+        finally:
+            # Runs the wrapped stream's cleanup, e.g. releasing its database cursor
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    def _record(self, encoding, bytes_in, bytes_out, cpu_seconds, response=False):
+        with self._lock:
+            counters = self._counters[encoding]
+            counters['responses'] += int(response)
+            counters['bytes_in'] += bytes_in
+            counters['bytes_out'] += bytes_out
+            counters['cpu_seconds'] += cpu_seconds
+
+    def _count_event(self, name):
+        with self._lock:
+            self._events[name] += 1
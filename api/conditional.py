@@ -0,0 +1,107 @@
+import hashlib
+from functools import wraps
+from flask import request, current_app, g
+from werkzeug.http import is_resource_modified
+
+def version_etag(version):
+    """
+    Derives the entity tag of the requested representation from a resource version.
+
+    The request path and query string are part of the tag, since parameters such
+    as `fields` or `participants` select different representations.
+
+    Args:
+        version (tuple): Values that change whenever the resource does.
+
+    Returns:
+        str: The entity tag.
+    """
+    key = f'{request.full_path}\n{version!r}'.encode('utf-8')
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+def has_validators():
+    """
+    Tells whether the request is conditional.
+
+    Returns:
+        bool: True if it carries If-None-Match or If-Modified-Since.
+    """
+    return 'If-None-Match' in request.headers or 'If-Modified-Since' in request.headers
+
+def set_version(version, last_modified=None):
+    """
+    Reports the version of the representation a route is returning.
+
+    Routes decorated with `conditional` call this with the version of the rows
+    they loaded, computed the same way as by their lookup, so that requests
+    without validators need no lookup.
+
+    Args:
+        version (tuple): Values that change whenever the resource does.
+        last_modified (datetime, optional): When the resource last changed.
+    """
+    g.conditional_version = (version, last_modified)
+
+def tag(response, found):
+    """
+    Adds the validators of a resource version to a response.
+
+    Args:
+        response (Response): The response.
+        found (tuple): (version, last modified).
+
+    Returns:
+        Response: The same response.
+    """
+    version, last_modified = found
+    response.set_etag(version_etag(version))
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def conditional(lookup, reported=lambda: False):
+    """
+    Decorator answering conditional GETs of a route from a cheap version lookup.
+
+    `lookup` is called with the route's arguments and returns the resource's
+    (version, last modified) pair, read without loading or serializing it. It
+    runs only for requests carrying If-None-Match or If-Modified-Since: when
+    those show the client already has that version, an empty 304 is returned
+    and the route does not run.
+
+    Otherwise the route's successful response gets the ETag and Last-Modified
+    headers, from the version the route reported with set_version. When
+    `reported()` says the route will not report one for the request, `lookup`
+    runs before the route instead. The version is then read before the body, so
+    a concurrent write can only make the tag older than the body. That costs
+    the client one more full response, never a stale one.
+
+    Args:
+        lookup (callable): Returns (version, last modified), the latter possibly
+            None, or None if the resource does not exist, in which case the route
+            runs unchanged.
+        reported (callable, optional): Returns whether the route calls
+            set_version for the current request.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            found = None
+            if has_validators() or not reported():
+                found = lookup(*args, **kwargs)
+                if found is None:
+                    return view(*args, **kwargs)
+                if not is_resource_modified(request.environ, etag=version_etag(found[0]), last_modified=found[1]):
+                    return tag(current_app.response_class(status=304), found)
+            g.pop('conditional_version', None)
+            response = current_app.make_response(view(*args, **kwargs))
+            found = g.pop('conditional_version', found)
+            if response.status_code != 200 or found is None:
+                return response
+            return tag(response, found)
+        return wrapper
+    return decorator
@@ -14,4 +14,4 @@ python init_db.py
 
 # Start the Gunicorn application server
 echo "Starting application..."
-exec gunicorn --bind 0.0.0.0:5000 app:app
+exec gunicorn --config gunicorn.conf.py app:app
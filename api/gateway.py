@@ -0,0 +1,251 @@
+import logging
+import queue
+import threading
+from datetime import datetime
+from simple_websocket import ConnectionClosed
+from werkzeug.exceptions import BadRequest
+from models import db, Chat
+from broker import chat_channel
+from pagination import decode_cursor
+from services import create_message, get_messages_page, latest_message_cursor, message_cursor
+from serializers import dumps, loads, serialize_message
+
+# WebSocket close code for policy violations (RFC 6455)
+CLOSE_POLICY_VIOLATION = 1008
+
+class GatewaySession:
+    """
+    State of one chat WebSocket connection.
+
+    The client joins any number of chats and sends messages on a single socket.
+    Frames are JSON objects with a `type`:
+
+    - `join` (`chat_id`, optional `after` cursor): start receiving `message` frames for a chat.
+    - `leave` (`chat_id`): stop receiving them.
+    - `send` (`ref`, `chat_id`, `profile_id`, `content`): persist a message; answered with an
+      `ack` carrying the message `id`, `created_at` and `cursor`, or an `error` with the same `ref`.
+    - `ping`: answered with `pong`.
+
+    Every outgoing frame goes through a bounded send queue drained by a writer thread.
+    When the client does not read, producers block on that queue, which in turn stops
+    the session from reading further frames; if the queue stays full for longer than
+    `send_timeout` the connection is closed. Broker events only wake a pump thread that
+    re-reads new messages from the database by cursor, so dropping them under load loses
+    nothing and server memory per connection stays bounded.
+    """
+    def __init__(self, ws, app, broker, send_queue_size=256, send_timeout=10.0, max_chats=50, heartbeat=15.0):
+        self.ws = ws
+        self.app = app
+        self.broker = broker
+        self.send_timeout = send_timeout
+        self.max_chats = max_chats
+        self.heartbeat = heartbeat
+        self.batch_size = app.config.get('SSE_BATCH_SIZE', 100)
+        self.closed = threading.Event()
+        self._outbound = queue.Queue(maxsize=send_queue_size)
+        self._events = queue.Queue(maxsize=send_queue_size)
+        self._cursors = {}
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def run(self):
+        """
+        Serves the connection until the client disconnects or is closed by the server.
+        """
+        writer = threading.Thread(target=self._write_loop, name='gateway-writer', daemon=True)
+        pump = threading.Thread(target=self._pump_loop, name='gateway-pump', daemon=True)
+        writer.start()
+        pump.start()
+        try:
+            while not self.closed.is_set():
+                try:
+                    data = self.ws.receive(timeout=self.heartbeat)
+                except ConnectionClosed:
+                    break
+                if data is None:
+                    continue
+                self.handle_frame(data)
+                # Do not keep a database connection checked out between frames
+                db.session.remove()
+        finally:
+            self.close()
+            # Both threads notice the close within one wait interval
+            pump.join(timeout=self.heartbeat + self.send_timeout)
+            writer.join(timeout=self.send_timeout)
+
+    def close(self, reason=None, message=None):
+        """
+        Closes the connection and releases its subscriptions.
+
+        Args:
+            reason (int, optional): WebSocket close code.
+            message (str, optional): Close reason text.
+        """
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        with self._lock:
+            subscriptions = list(self._subscriptions.values())
+            self._subscriptions.clear()
+            self._cursors.clear()
+        for subscription in subscriptions:
+            subscription.close()
+        try:
+            self.ws.close(reason=reason, message=message)
+        except Exception:
+            pass
+
+    def send(self, frame):
+        """
+        Queues a frame for the client, waiting up to send_timeout for room in the send queue.
+
+        Args:
+            frame (dict): The frame to send.
+
+        Returns:
+            bool: False if the connection is closed or was closed because the client is too slow.
+        """
+        if self.closed.is_set():
+            return False
+        try:
+            self._outbound.put(dumps(frame), timeout=self.send_timeout)
+            return True
+        except queue.Full:
+            logging.warning('Closing gateway connection: client is not reading')
+            self.close(CLOSE_POLICY_VIOLATION, 'Client is too slow')
+            return False
+
+    def handle_frame(self, data):
+        """
+        Dispatches one client frame.
+
+        Args:
+            data (str): Raw frame text.
+        """
+        try:
+            frame = loads(data)
+        except ValueError:
+            self.send({'type': 'error', 'message': 'Invalid JSON'})
+            return
+        if not isinstance(frame, dict):
+            self.send({'type': 'error', 'message': 'Invalid frame'})
+            return
+        handler = {
+            'join': self._handle_join,
+            'leave': self._handle_leave,
+            'send': self._handle_send,
+            'ping': self._handle_ping,
+        }.get(frame.get('type'))
+        if handler is None:
+            self.send({'type': 'error', 'ref': frame.get('ref'), 'message': 'Unknown frame type'})
+            return
+        try:
+            handler(frame)
+        except BadRequest as e:
+            db.session.rollback()
+            self.send({'type': 'error', 'ref': frame.get('ref'), 'message': e.description})
+
+    def _handle_join(self, frame):
+        chat_id = frame.get('chat_id')
+        if not isinstance(chat_id, str) or db.session.query(Chat.id).filter_by(id=chat_id).first() is None:
+            raise BadRequest('Chat not found')
+        after = frame.get('after')
+        if after:
+            # A bad cursor would otherwise fail every later read of the chat in the pump
+            decode_cursor(after, datetime, str)
+        with self._lock:
+            if chat_id in self._subscriptions:
+                cursor = self._cursors[chat_id]
+            else:
+                if len(self._subscriptions) >= self.max_chats:
+                    raise BadRequest(f'Cannot join more than {self.max_chats} chats')
+                # Subscribe before reading the cursor so nothing committed in between is missed
+                self._subscriptions[chat_id] = self.broker.subscribe([chat_channel(chat_id)], sink=self._events)
+                cursor = after or latest_message_cursor(chat_id)
+                self._cursors[chat_id] = cursor
+        self.send({'type': 'joined', 'ref': frame.get('ref'), 'chat_id': chat_id, 'cursor': cursor})
+        # Deliver anything after the client's cursor right away
+        self._wake(chat_id)
+
+    def _handle_leave(self, frame):
+        chat_id = frame.get('chat_id')
+        with self._lock:
+            subscription = self._subscriptions.pop(chat_id, None)
+            self._cursors.pop(chat_id, None)
+        if subscription is not None:
+            subscription.close()
+        self.send({'type': 'left', 'ref': frame.get('ref'), 'chat_id': chat_id})
+
+    def _handle_send(self, frame):
+        message = create_message({key: frame.get(key) for key in ('content', 'chat_id', 'profile_id')})
+        self.send({
+            'type': 'ack',
+            'ref': frame.get('ref'),
+            'id': message.id,
+            'created_at': message.created_at.isoformat(),
+            'cursor': message_cursor(message)
+        })
+
+    def _handle_ping(self, frame):
+        self.send({'type': 'pong', 'ref': frame.get('ref')})
+
+    def _wake(self, chat_id):
+        try:
+            self._events.put_nowait((chat_channel(chat_id), {'chat_id': chat_id}))
+        except queue.Full:
+            pass  # the pump is already behind and will re-read every chat
+
+    def _write_loop(self):
+        while not self.closed.is_set():
+            try:
+                data = self._outbound.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.ws.send(data)
+            except ConnectionClosed:
+                self.close()
+            except Exception:
+                logging.exception('Gateway send failed')
+                self.close()
+
+    def _pump_loop(self):
+        with self.app.app_context():
+            while not self.closed.is_set():
+                try:
+                    item = self._events.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    item = None
+                with self._lock:
+                    overflowed = any(s.overflowed for s in self._subscriptions.values())
+                    for subscription in self._subscriptions.values():
+                        subscription.overflowed = False
+                    if item is None or overflowed:
+                        # Periodic or post-overflow resync of every joined chat
+                        chat_ids = list(self._cursors)
+                    else:
+                        chat_ids = [item[1].get('chat_id')]
+                try:
+                    for chat_id in chat_ids:
+                        self._deliver_new_messages(chat_id)
+                except Exception:
+                    logging.exception('Gateway failed to deliver messages')
+                finally:
+                    db.session.remove()
+
+    def _deliver_new_messages(self, chat_id):
+        while not self.closed.is_set():
+            with self._lock:
+                cursor = self._cursors.get(chat_id)
+            if cursor is None:
+                return
+            page = get_messages_page(chat_id, after=cursor, limit=self.batch_size)
+            for message in page['messages']:
+                if not self.send({'type': 'message', 'chat_id': chat_id, 'cursor': message_cursor(message),
+                                  'message': serialize_message(message)}):
+                    return
+            with self._lock:
+                if chat_id in self._cursors:
+                    self._cursors[chat_id] = page['next_cursor']
+            if not page['has_more']:
+                return
@@ -0,0 +1,21 @@
+"""
+Gunicorn configuration.
+
+Workers use gevent so that long-lived connections such as the chat event stream
+wait cooperatively instead of each pinning a sync worker.
+"""
+import os
+
+bind = '0.0.0.0:5000'
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+worker_class = 'gevent'
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+# Streams send heartbeats well within this window; it only bounds stuck requests
+timeout = 60
+
+def post_fork(server, worker):
+    """
+    Makes psycopg2 cooperate with gevent so database waits yield to other greenlets.
+    """
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
@@ -1,13 +1,32 @@
+from flask_migrate import stamp, upgrade
+from sqlalchemy import inspect
 from app import create_app
 from models import db
 
+# Revision matching the schema of databases created with db.create_all()
+# before migrations were introduced
+BASELINE_REVISION = '0001'
+
+def upgrade_database():
+    """
+    Brings the database schema up to date by running pending migrations.
+
+    Databases created by an earlier version of this script with db.create_all()
+    have no migration history; they are first stamped with the baseline revision.
+    Must be called within an application context.
+    """
+    tables = inspect(db.engine).get_table_names()
+    if 'appuser' in tables and 'alembic_version' not in tables:
+        stamp(revision=BASELINE_REVISION)
+    upgrade()
+
 def init_db():
     """
-    Initializes the database by creating all tables.
+    Initializes the database by running all pending migrations.
     """
     app = create_app()
     with app.app_context():
-        db.create_all()
+        upgrade_database()
         print("Database initialized successfully")
 
 if __name__ == '__main__':
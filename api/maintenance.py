@@ -0,0 +1,155 @@
+import argparse
+from flask import current_app
+from sqlalchemy import select, func, update, bindparam, case, or_
+from app import create_app
+from purger import GroupPurger
+from models import db, Chat, Message, GroupDeletion, chat_participants, CHAT_PREVIEW_LENGTH
+
+def backfill_chat_activity(batch_size=500):
+    """
+    Recomputes every chat's activity summary (message_count, last_message_at,
+    last_message_preview) from the message table.
+
+    Chats are processed in batches by id, committing after each batch, so the
+    command can run against a live database without holding long locks.
+
+    Args:
+        batch_size (int): Number of chats updated per transaction.
+
+    Returns:
+        int: Number of chats processed.
+    """
+    chat = Chat.__table__.c
+    message = Message.__table__.c
+    newest = select(message.created_at, message.content).where(message.chat_id == chat.id) \
+        .order_by(message.created_at.desc(), message.id.desc()).limit(1)
+    processed = 0
+    last_id = ''
+    while True:
+        chat_ids = db.session.execute(
+            select(chat.id).where(chat.id > last_id).order_by(chat.id).limit(batch_size)).scalars().all()
+        if not chat_ids:
+            return processed
+        db.session.execute(update(Chat.__table__).where(chat.id.in_(chat_ids)).values(
+            message_count=select(func.count()).where(message.chat_id == chat.id).scalar_subquery(),
+            last_message_at=newest.with_only_columns(message.created_at).scalar_subquery(),
+            last_message_preview=func.substr(newest.with_only_columns(message.content).scalar_subquery(), 1, CHAT_PREVIEW_LENGTH),
+            updated_at=chat.updated_at
+        ))
+        db.session.commit()
+        processed += len(chat_ids)
+        last_id = chat_ids[-1]
+
+def repair_read_counters(batch_size=500):
+    """
+    Checks the counters behind unread counts against the message table and repairs them.
+
+    For every chat, message sequence numbers must run 1..N in (created_at, id)
+    order, the order read cursors follow, and message_count must equal N; a
+    chat with gaps, duplicates or numbers out of cursor order has its messages
+    renumbered in (created_at, id) order, and its counter is reset. Each
+    participant's last_read_seq is then recomputed from the seq of its
+    last_read_message_id. Chat rows are locked while their batch is repaired so
+    concurrent message writes wait instead of interleaving.
+
+    Args:
+        batch_size (int): Number of chats checked per transaction.
+
+    Returns:
+        dict: Number of chats checked, chats renumbered, counters fixed and read markers fixed.
+    """
+    chat = Chat.__table__.c
+    message = Message.__table__.c
+    participant = chat_participants.c
+    report = {'chats': 0, 'renumbered': 0, 'counters': 0, 'read_markers': 0}
+    last_id = ''
+    while True:
+        chat_ids = db.session.execute(
+            select(chat.id).where(chat.id > last_id).order_by(chat.id).limit(batch_size)).scalars().all()
+        if not chat_ids:
+            return report
+        counters = dict(db.session.execute(
+            select(chat.id, chat.message_count).where(chat.id.in_(chat_ids)).order_by(chat.id).with_for_update()).all())
+        position = func.row_number().over(partition_by=message.chat_id, order_by=(message.created_at, message.id))
+        ranked = select(message.chat_id, message.seq, position.label('position')) \
+            .where(message.chat_id.in_(chat_ids)).subquery()
+        misplaced = case((or_(ranked.c.seq.is_(None), ranked.c.seq != ranked.c.position), 1), else_=0)
+        stats = {row.chat_id: row for row in db.session.execute(
+            select(ranked.c.chat_id, func.count().label('total'), func.sum(misplaced).label('misplaced'))
+            .group_by(ranked.c.chat_id))}
+        for chat_id in chat_ids:
+            row = stats.get(chat_id)
+            total = row.total if row else 0
+            if row and row.misplaced:
+                ids = db.session.execute(select(message.id).where(message.chat_id == chat_id)
+                                         .order_by(message.created_at, message.id)).scalars().all()
+                db.session.execute(update(Message.__table__).where(message.id == bindparam('m_id'))
+                                   .values(seq=bindparam('m_seq')),
+                                   [{'m_id': message_id, 'm_seq': seq} for seq, message_id in enumerate(ids, start=1)])
+                report['renumbered'] += 1
+            if counters[chat_id] != total:
+                db.session.execute(update(Chat.__table__).where(chat.id == chat_id)
+                                   .values(message_count=total, updated_at=chat.updated_at))
+                report['counters'] += 1
+        read_seq = func.coalesce(select(message.seq).where(
+            message.id == participant.last_read_message_id, message.chat_id == participant.chat_id).scalar_subquery(), 0)
+        result = db.session.execute(update(chat_participants).where(
+            participant.chat_id.in_(chat_ids), participant.last_read_seq != read_seq).values(last_read_seq=read_seq))
+        report['read_markers'] += result.rowcount
+        db.session.commit()
+        report['chats'] += len(chat_ids)
+        last_id = chat_ids[-1]
+
+def purge_deleted_groups(batch_size=500, retry_failed=False):
+    """
+    Runs every pending group deletion job to completion.
+
+    Deletion jobs are normally run by the application's background purger; this
+    command finishes them without a running application, e.g. after a crash.
+
+    Args:
+        batch_size (int): Maximum number of rows deleted per transaction.
+        retry_failed (bool): Whether to put failed jobs back to pending first,
+            once whatever blocked them has been fixed.
+
+    Returns:
+        int: Number of jobs processed.
+    """
+    if retry_failed:
+        job = GroupDeletion.__table__.c
+        db.session.execute(update(GroupDeletion.__table__).where(job.status == 'failed')
+                           .values(status='pending', attempts=0, finished_at=None))
+        db.session.commit()
+    return GroupPurger(current_app, batch_size=batch_size, pause=0,
+                       max_attempts=current_app.config['GROUP_PURGE_MAX_ATTEMPTS']).run_pending()
+
+def main():
+    """
+    Entry point for database maintenance commands.
+    """
+    parser = argparse.ArgumentParser(description='Database maintenance commands.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    backfill = commands.add_parser('backfill-chat-activity', help='Recompute chat activity summaries from messages')
+    backfill.add_argument('--batch-size', type=int, default=500)
+    repair = commands.add_parser('repair-read-counters', help='Check and repair message sequence numbers and unread counters')
+    repair.add_argument('--batch-size', type=int, default=500)
+    purge = commands.add_parser('purge-deleted-groups', help='Finish purging groups deleted with mode=async')
+    purge.add_argument('--batch-size', type=int, default=500)
+    purge.add_argument('--retry-failed', action='store_true', help='Retry jobs that failed')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.command == 'backfill-chat-activity':
+            count = backfill_chat_activity(batch_size=args.batch_size)
+            print(f"Backfilled activity for {count} chats")
+        elif args.command == 'repair-read-counters':
+            report = repair_read_counters(batch_size=args.batch_size)
+            print(f"Checked {report['chats']} chats: renumbered {report['renumbered']}, "
+                  f"fixed {report['counters']} message counters and {report['read_markers']} read markers")
+        elif args.command == 'purge-deleted-groups':
+            count = purge_deleted_groups(batch_size=args.batch_size, retry_failed=args.retry_failed)
+            print(f"Purged {count} deleted groups")
+
+if __name__ == '__main__':
+    main()
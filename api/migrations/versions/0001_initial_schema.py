@@ -0,0 +1,81 @@
+"""Initial schema
+
+Tables as they were created by db.create_all() before migrations were introduced.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('appuser',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('email', sa.String(length=120), nullable=False),
+        sa.Column('password', sa.String(length=200), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email')
+    )
+    op.create_table('group',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('name', sa.String(length=80), nullable=False),
+        sa.Column('picture', sa.String(length=1024), nullable=False),
+        sa.Column('max_profiles', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('chat',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('name', sa.String(length=80), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('group_id', sa.String(length=36), nullable=False),
+        sa.ForeignKeyConstraint(['group_id'], ['group.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('profile',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('name', sa.String(length=80), nullable=False),
+        sa.Column('picture', sa.String(length=1024), nullable=False),
+        sa.Column('bio', sa.String(length=1024), nullable=False),
+        sa.Column('group_id', sa.String(length=36), nullable=False),
+        sa.Column('user_id', sa.String(length=36), nullable=False),
+        sa.ForeignKeyConstraint(['group_id'], ['group.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['appuser.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('chat_participants',
+        sa.Column('chat_id', sa.String(length=36), nullable=False),
+        sa.Column('profile_id', sa.String(length=36), nullable=False),
+        sa.ForeignKeyConstraint(['chat_id'], ['chat.id']),
+        sa.ForeignKeyConstraint(['profile_id'], ['profile.id']),
+        sa.PrimaryKeyConstraint('chat_id', 'profile_id')
+    )
+    op.create_table('message',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('content', sa.String(length=1024), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('chat_id', sa.String(length=36), nullable=False),
+        sa.Column('profile_id', sa.String(length=36), nullable=False),
+        sa.ForeignKeyConstraint(['chat_id'], ['chat.id']),
+        sa.ForeignKeyConstraint(['profile_id'], ['profile.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('message')
+    op.drop_table('chat_participants')
+    op.drop_table('profile')
+    op.drop_table('chat')
+    op.drop_table('group')
+    op.drop_table('appuser')
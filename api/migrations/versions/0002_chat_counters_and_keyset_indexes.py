@@ -0,0 +1,79 @@
+"""Chat activity counters, read markers and keyset indexes
+
+Adds the chat activity summary, message sequence numbers and read markers, and
+the indexes behind keyset pagination of messages and chats. Databases created
+with db.create_all() after these were added to the models already have some of
+them, so existing columns and indexes are left alone.
+
+Added columns are filled in from the existing messages: messages are numbered
+per chat in (created_at, id) order, chats get their activity summary, and the
+history that existed before read markers is marked read.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def add_column_if_missing(table, column):
+    if column.name in {c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)}:
+        return False
+    op.add_column(table, column)
+    return True
+
+
+def create_index_if_missing(name, table, columns):
+    # The inspector does not report expression indexes on every dialect
+    op.create_index(name, table, columns, if_not_exists=True)
+
+
+def upgrade():
+    added_activity = add_column_if_missing('chat', sa.Column('last_message_at', sa.DateTime(), nullable=True))
+    added_activity |= add_column_if_missing('chat', sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+    added_activity |= add_column_if_missing('chat', sa.Column('last_message_preview', sa.String(length=140), nullable=True))
+    added_seq = add_column_if_missing('message', sa.Column('seq', sa.Integer(), nullable=True))
+    added_reads = add_column_if_missing('chat_participants', sa.Column('last_read_seq', sa.Integer(), server_default='0', nullable=False))
+    added_reads |= add_column_if_missing('chat_participants', sa.Column('last_read_message_id', sa.String(length=36), nullable=True))
+    if added_seq:
+        op.execute('UPDATE message SET seq = ranked.position FROM ('
+                   'SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY created_at, id) AS position FROM message'
+                   ') AS ranked WHERE ranked.id = message.id')
+    if added_activity:
+        op.execute('UPDATE chat SET message_count = stats.total, last_message_at = stats.newest FROM ('
+                   'SELECT chat_id, COUNT(*) AS total, MAX(created_at) AS newest FROM message GROUP BY chat_id'
+                   ') AS stats WHERE stats.chat_id = chat.id')
+        op.execute('UPDATE chat SET last_message_preview = SUBSTR(message.content, 1, 140) FROM message '
+                   'WHERE message.chat_id = chat.id AND message.seq = chat.message_count')
+    if added_reads:
+        op.execute('UPDATE chat_participants SET last_read_seq = message.seq, last_read_message_id = message.id '
+                   'FROM chat, message WHERE chat.id = chat_participants.chat_id '
+                   'AND message.chat_id = chat.id AND message.seq = chat.message_count')
+    create_index_if_missing('ix_message_chat_created_id', 'message', ['chat_id', 'created_at', 'id'])
+    create_index_if_missing('ix_chat_group_created_id', 'chat', ['group_id', 'created_at', 'id'])
+    create_index_if_missing('ix_chat_group_activity', 'chat',
+                            ['group_id', sa.text('coalesce(last_message_at, created_at)'), 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_chat_group_activity', table_name='chat')
+    op.drop_index('ix_chat_group_created_id', table_name='chat')
+    op.drop_index('ix_message_chat_created_id', table_name='message')
+    with op.batch_alter_table('chat_participants') as batch_op:
+        batch_op.drop_column('last_read_message_id')
+        batch_op.drop_column('last_read_seq')
+    with op.batch_alter_table('message') as batch_op:
+        batch_op.drop_column('seq')
+    with op.batch_alter_table('chat') as batch_op:
+        batch_op.drop_column('last_message_preview')
+        batch_op.drop_column('message_count')
+        batch_op.drop_column('last_message_at')
@@ -0,0 +1,46 @@
+"""Access path indexes and profile uniqueness
+
+Indexes for the remaining filtered lookups: profiles by (group_id, user_id),
+(group_id, name) and user_id, and chat memberships by profile_id. The two
+profile rules checked by validate_profile_data become unique indexes; the
+upgrade stops with an error if existing rows break them.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def check_unique(columns):
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT COUNT(*) FROM (SELECT 1 FROM profile GROUP BY {0} HAVING COUNT(*) > 1) AS duplicates'.format(', '.join(columns))
+    )).scalar()
+    if duplicates:
+        raise RuntimeError('{} profile groups share ({}); resolve them before upgrading'.format(duplicates, ', '.join(columns)))
+
+
+def upgrade():
+    check_unique(['group_id', 'user_id'])
+    check_unique(['group_id', 'name'])
+    # Databases created with db.create_all() may already have these indexes
+    op.create_index('uq_profile_group_user', 'profile', ['group_id', 'user_id'], unique=True, if_not_exists=True)
+    op.create_index('uq_profile_group_name', 'profile', ['group_id', 'name'], unique=True, if_not_exists=True)
+    op.create_index('ix_profile_user_group', 'profile', ['user_id', 'group_id'], if_not_exists=True)
+    op.create_index('ix_chat_participants_profile', 'chat_participants', ['profile_id', 'chat_id'], if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_chat_participants_profile', table_name='chat_participants')
+    op.drop_index('ix_profile_user_group', table_name='profile')
+    op.drop_index('uq_profile_group_name', table_name='profile')
+    op.drop_index('uq_profile_group_user', table_name='profile')
@@ -0,0 +1,31 @@
+"""Group profile counter
+
+Adds group.profile_count, maintained when profiles are created so that
+max_profiles can be enforced without counting profile rows, and fills it in
+from the profile table.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('group', sa.Column('profile_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute('UPDATE "group" SET profile_count = '
+               '(SELECT COUNT(*) FROM profile WHERE profile.group_id = "group".id)')
+
+
+def downgrade():
+    with op.batch_alter_table('group') as batch_op:
+        batch_op.drop_column('profile_count')
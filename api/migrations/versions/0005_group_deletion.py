@@ -0,0 +1,47 @@
+"""Asynchronous group deletion
+
+Adds group.deleted_at, set when a group is marked deleted, and the
+group_deletion table of background purge jobs.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('group', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_group_deleted', 'group', ['id'], sqlite_where=sa.text('deleted_at IS NOT NULL'),
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'))
+    op.create_table('group_deletion',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('group_id', sa.String(length=36), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('messages_deleted', sa.Integer(), nullable=False),
+        sa.Column('participants_deleted', sa.Integer(), nullable=False),
+        sa.Column('chats_deleted', sa.Integer(), nullable=False),
+        sa.Column('profiles_deleted', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_group_deletion_status', 'group_deletion', ['status', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_group_deletion_status', table_name='group_deletion')
+    op.drop_table('group_deletion')
+    op.drop_index('ix_group_deleted', table_name='group')
+    with op.batch_alter_table('group') as batch_op:
+        batch_op.drop_column('deleted_at')
@@ -0,0 +1,34 @@
+"""Rate limit buckets
+
+Adds the rate_limit_bucket table used by the shared (database) store of the
+/login and /register rate limits.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_limit_bucket',
+        sa.Column('key', sa.String(length=320), nullable=False),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_rate_limit_bucket_updated', 'rate_limit_bucket', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_rate_limit_bucket_updated', table_name='rate_limit_bucket')
+    op.drop_table('rate_limit_bucket')
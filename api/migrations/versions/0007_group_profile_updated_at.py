@@ -0,0 +1,36 @@
+"""Group and profile modification times
+
+Adds group.updated_at and profile.updated_at, which together with the chat
+counters let read endpoints answer conditional requests without loading rows.
+Existing rows are stamped with the time of the upgrade.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 14:00:00
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    now = datetime.utcnow()
+    for table in ('group', 'profile'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.get_bind().execute(sa.text(f'UPDATE "{table}" SET updated_at = :now'), {'now': now})
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table in ('profile', 'group'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,30 @@
+"""Group deletion errors
+
+Adds group_deletion.attempts and group_deletion.error, so a purge that keeps
+failing is recorded as failed instead of being retried forever.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 15:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('group_deletion', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('group_deletion', sa.Column('error', sa.String(length=1024), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('group_deletion') as batch_op:
+        batch_op.drop_column('error')
+        batch_op.drop_column('attempts')
@@ -1,11 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
 import uuid
+from sqlalchemy import event
 from sqlalchemy.dialects.postgresql import UUID
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.orm import Session, with_loader_criteria
 from datetime import datetime
+from passwords import get_password_hasher
 
 db = SQLAlchemy()
 
+# Number of leading characters of the newest message kept on Chat
+CHAT_PREVIEW_LENGTH = 140
+
 class User(db.Model):
     """
     Represents a user in the application.
@@ -40,19 +45,25 @@ class User(db.Model):
         Args:
             password (str): Plain text password.
         """
-        self.password = generate_password_hash(password)
+        self.password = get_password_hasher().hash(password)
 
     def check_password(self, password):
         """
         Checks if the provided password matches the stored hash.
 
+        If it matches and the stored hash was made with another method or cost
+        than the configured one, the hash is replaced; the caller commits it.
+
         Args:
             password (str): Plain text password.
 
         Returns:
             bool: True if match, False otherwise.
         """
-        return check_password_hash(self.password, password)
+        matches, new_hash = get_password_hasher().verify(self.password, password)
+        if new_hash:
+            self.password = new_hash
+        return matches
 
 class Group(db.Model):
     """
@@ -63,12 +74,23 @@ class Group(db.Model):
         name (str): Name of the group.
         picture (str): URL to the group's picture.
         max_profiles (int): Maximum number of profiles allowed.
+        profile_count (int): Number of profiles in the group, maintained by create_profile.
+        deleted_at (datetime): When the group was marked deleted; its rows are then purged in the background.
+        updated_at (datetime): Timestamp of the last change, including to profile_count.
         profiles (List[Profile]): Associated profiles.
     """
+    __table_args__ = (
+        # Partial index of the groups pending purge, read by every query through hide_deleted_groups
+        db.Index('ix_group_deleted', 'id', sqlite_where=db.text('deleted_at IS NOT NULL'),
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(80), nullable=False)
     picture = db.Column(db.String(1024), nullable=False)
     max_profiles = db.Column(db.Integer, nullable=False)
+    profile_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     profiles = db.relationship('Profile', backref='group', lazy=True)
 
 class Profile(db.Model):
@@ -82,17 +104,33 @@ class Profile(db.Model):
         bio (str): Biography of the profile.
         group_id (str): Foreign key to Group.
         user_id (str): Foreign key to User.
+        updated_at (datetime): Timestamp of the last change.
     """
+    __table_args__ = (
+        # A user has at most one profile per group, and profile names are unique within a group
+        db.Index('uq_profile_group_user', 'group_id', 'user_id', unique=True),
+        db.Index('uq_profile_group_name', 'group_id', 'name', unique=True),
+        # Serves looking up a user's profiles (/users/me)
+        db.Index('ix_profile_user_group', 'user_id', 'group_id'),
+    )
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(80), nullable=False)
     picture = db.Column(db.String(1024), nullable=False)
     bio = db.Column(db.String(1024), nullable=False)
     group_id = db.Column(db.String(36), db.ForeignKey('group.id'), nullable=False)
     user_id = db.Column(db.String(36), db.ForeignKey('appuser.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+# Membership of profiles in chats. Each row also holds the profile's read watermark:
+# the seq of the newest message it has read, so its unread count is
+# Chat.message_count - last_read_seq.
 chat_participants = db.Table('chat_participants',
     db.Column('chat_id', db.String(36), db.ForeignKey('chat.id'), primary_key=True),
-    db.Column('profile_id', db.String(36), db.ForeignKey('profile.id'), primary_key=True)
+    db.Column('profile_id', db.String(36), db.ForeignKey('profile.id'), primary_key=True),
+    db.Column('last_read_seq', db.Integer, nullable=False, default=0, server_default='0'),
+    db.Column('last_read_message_id', db.String(36), nullable=True),
+    # The primary key serves lookups by chat; this one serves lookups by profile
+    db.Index('ix_chat_participants_profile', 'profile_id', 'chat_id')
 )
 
 class Chat(db.Model):
@@ -107,15 +145,29 @@ class Chat(db.Model):
         group_id (str): Foreign key to Group.
         participants (List[Profile]): Profiles participating in the chat.
         messages (List[Message]): Messages within the chat.
+        last_message_at (datetime): Timestamp of the newest message, maintained by the message write path.
+        message_count (int): Number of messages, maintained by the message write path.
+        last_message_preview (str): Beginning of the newest message's content.
     """
+    __table_args__ = (
+        # Serves keyset pagination of a group's chats in creation order
+        db.Index('ix_chat_group_created_id', 'group_id', 'created_at', 'id'),
+    )
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name = db.Column(db.String(80), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     group_id = db.Column(db.String(36), db.ForeignKey('group.id'), nullable=False)
-    participants = db.relationship('Profile', secondary=chat_participants, lazy='subquery',
+    last_message_at = db.Column(db.DateTime, nullable=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_message_preview = db.Column(db.String(CHAT_PREVIEW_LENGTH), nullable=True)
+    participants = db.relationship('Profile', secondary=chat_participants, lazy='select',
         backref=db.backref('chats', lazy=True))
 
+# Recent-activity order of a group's chats; chats without messages rank by creation time
+chat_activity_key = db.func.coalesce(Chat.last_message_at, Chat.created_at)
+db.Index('ix_chat_group_activity', Chat.group_id, chat_activity_key, Chat.id)
+
 class Message(db.Model):
     """
     Represents a message within a chat.
@@ -128,11 +180,94 @@ class Message(db.Model):
         profile_id (str): Foreign key to Profile.
         chat (Chat): Associated chat.
         profile (Profile): Sender's profile.
+        seq (int): Position of the message in its chat, starting at 1, assigned by the message write path.
     """
+    __table_args__ = (
+        # Serves keyset pagination of a chat's history ordered by (created_at, id)
+        db.Index('ix_message_chat_created_id', 'chat_id', 'created_at', 'id'),
+    )
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     content = db.Column(db.String(1024), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     chat_id = db.Column(db.String(36), db.ForeignKey('chat.id'), nullable=False)
     profile_id = db.Column(db.String(36), db.ForeignKey('profile.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=True)
     chat = db.relationship('Chat', backref=db.backref('messages', lazy=True))
     profile = db.relationship('Profile', backref=db.backref('messages', lazy=True))
+
+class GroupDeletion(db.Model):
+    """
+    Background job purging a group marked deleted.
+
+    Attributes:
+        id (str): Primary key UUID.
+        group_id (str): ID of the deleted group (no foreign key: the group row is purged last).
+        status (str): `pending`, `running`, `done` or `failed`.
+        created_at (datetime): When the deletion was requested.
+        updated_at (datetime): When the job last made progress.
+        finished_at (datetime): When the group was fully purged.
+        messages_deleted, participants_deleted, chats_deleted, profiles_deleted (int): Rows purged so far.
+        attempts (int): Consecutive batches that failed.
+        error (str): Error of the last failed batch.
+    """
+    __tablename__ = 'group_deletion'
+    __table_args__ = (
+        db.Index('ix_group_deletion_status', 'status', 'created_at'),
+    )
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    group_id = db.Column(db.String(36), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    messages_deleted = db.Column(db.Integer, nullable=False, default=0)
+    participants_deleted = db.Column(db.Integer, nullable=False, default=0)
+    chats_deleted = db.Column(db.Integer, nullable=False, default=0)
+    profiles_deleted = db.Column(db.Integer, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    error = db.Column(db.String(1024), nullable=True)
+
+class RateLimitBucket(db.Model):
+    """
+    Token bucket of the shared (database) rate limit store.
+
+    Attributes:
+        key (str): Limited action and client, e.g. `login:ip:10.0.0.1`.
+        tokens (float): Tokens left when the bucket was last updated.
+        updated_at (float): Time of the last update, in seconds since the epoch.
+    """
+    __tablename__ = 'rate_limit_bucket'
+    __table_args__ = (
+        db.Index('ix_rate_limit_bucket_updated', 'updated_at'),
+    )
+    key = db.Column(db.String(320), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+# Groups marked deleted and their chats; Core tables, so the criteria below do not apply to them
+deleted_group_ids = db.select(Group.__table__.c.id).where(Group.__table__.c.deleted_at.isnot(None))
+deleted_chat_ids = db.select(Chat.__table__.c.id).where(Chat.__table__.c.group_id.in_(deleted_group_ids))
+
+@event.listens_for(Session, 'do_orm_execute')
+def hide_deleted_groups(execute_state):
+    """
+    Hides groups marked deleted, and their profiles, chats and messages, from ORM reads.
+
+    A deleted group disappears from every route at once, while its rows are purged
+    in the background. The criteria are added to all ORM SELECTs, including
+    relationship loads; refreshes of already loaded objects and statements run
+    with the `include_deleted` execution option are left alone. Statements on
+    Core tables (`Model.__table__`), as used by the purge, are not affected.
+
+    Args:
+        execute_state (ORMExecuteState): The statement being executed.
+    """
+    if not execute_state.is_select or execute_state.is_column_load \
+            or execute_state.execution_options.get('include_deleted', False):
+        return
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(Group, Group.deleted_at.is_(None), include_aliases=True),
+        with_loader_criteria(Profile, Profile.group_id.notin_(deleted_group_ids), include_aliases=True),
+        with_loader_criteria(Chat, Chat.group_id.notin_(deleted_group_ids), include_aliases=True),
+        with_loader_criteria(Message, Message.chat_id.notin_(deleted_chat_ids), include_aliases=True)
+    )
@@ -0,0 +1,119 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from werkzeug.exceptions import BadRequest
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(*values):
+    """
+    Encodes a keyset position into an opaque, URL-safe cursor string.
+
+    Args:
+        *values: Sort key values of the row the cursor points at (e.g. created_at, id).
+
+    Returns:
+        str: The encoded cursor.
+    """
+    payload = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values],
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, *types):
+    """
+    Decodes a cursor produced by encode_cursor.
+
+    Args:
+        cursor (str): The encoded cursor.
+        *types: Expected type of each value (datetime or str).
+
+    Returns:
+        tuple: The decoded sort key values.
+
+    Raises:
+        BadRequest: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError('cursor arity mismatch')
+        return tuple(datetime.fromisoformat(value) if value_type is datetime else value_type(value)
+                     for value, value_type in zip(values, types))
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        raise BadRequest('Invalid cursor')
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """
+    Parses a page size query parameter.
+
+    Args:
+        value (str): Raw query parameter value, or None.
+        default (int): Page size used when no value is given.
+        maximum (int): Largest page size accepted.
+
+    Returns:
+        int: The page size.
+
+    Raises:
+        BadRequest: If the value is not an integer between 1 and maximum.
+    """
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise BadRequest('Invalid limit')
+    if limit <= 0 or limit > maximum:
+        raise BadRequest(f'limit must be between 1 and {maximum}')
+    return limit
+
+def parse_fields(value, allowed, label='field'):
+    """
+    Parses a comma-separated selector query parameter such as `fields` or `include`.
+
+    Args:
+        value (str): Raw query parameter value, or None.
+        allowed (Iterable[str]): Names the resource supports.
+        label (str): What the names are, for error messages.
+
+    Returns:
+        frozenset: The requested names, or None if the parameter was not given.
+
+    Raises:
+        BadRequest: If a name is unknown or none is given.
+    """
+    if value is None:
+        return None
+    fields = frozenset(field.strip() for field in value.split(',') if field.strip())
+    if not fields:
+        raise BadRequest(f'Invalid {label}s')
+    unknown = sorted(fields - set(allowed))
+    if unknown:
+        raise BadRequest(f'Unknown {label}: {unknown[0]}')
+    return fields
+
+def parse_ids(value, maximum=MAX_PAGE_SIZE):
+    """
+    Parses a comma-separated `ids` query parameter.
+
+    Args:
+        value (str): Raw query parameter value, or None.
+        maximum (int): Largest number of ids accepted.
+
+    Returns:
+        List[str]: The distinct ids in the given order, or None if the parameter was not given.
+
+    Raises:
+        BadRequest: If no id or too many ids are given.
+    """
+    if value is None:
+        return None
+    ids = list(dict.fromkeys(item.strip() for item in value.split(',') if item.strip()))
+    if not ids:
+        raise BadRequest('Invalid ids')
+    if len(ids) > maximum:
+        raise BadRequest(f'At most {maximum} ids can be requested at once')
+    return ids
@@ -0,0 +1,175 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app, has_app_context
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+# Method and cost used for new hashes unless PASSWORD_HASH_METHOD says otherwise
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'
+
+# Upper bound on one hash once a pool process has started it
+HASH_TIMEOUT_SECONDS = 30
+
+def normalize_hash_method(method):
+    """
+    Expands a werkzeug hash method to the form stored in hashes.
+
+    Args:
+        method (str): 'scrypt[:n[:r[:p]]]' or 'pbkdf2[:hash[:iterations]]'.
+
+    Returns:
+        str: The method with every cost parameter, e.g. 'scrypt:32768:8:1'.
+
+    Raises:
+        ValueError: If the method is not supported.
+    """
+    name, *params = method.split(':')
+    if name == 'scrypt':
+        defaults = [str(2 ** 15), '8', '1']
+    elif name == 'pbkdf2':
+        defaults = ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        raise ValueError(f'Unsupported password hash method: {method}')
+    if len(params) > len(defaults):
+        raise ValueError(f'Invalid password hash method: {method}')
+    return ':'.join([name] + params + defaults[len(params):])
+
+def needs_rehash(password_hash, method):
+    """
+    Tells whether a stored hash was made with another method or cost.
+
+    Args:
+        password_hash (str): Stored hash ('method$salt$hash').
+        method (str): Normalized configured method.
+
+    Returns:
+        bool: True if the hash should be replaced.
+    """
+    return password_hash.split('$', 1)[0] != method
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+def _verify(password_hash, password, method):
+    if not check_password_hash(password_hash, password):
+        return False, None
+    # Upgrade in the same job so a login costs at most one extra round trip to the pool
+    if needs_rehash(password_hash, method):
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+def _run_before(deadline, func, *args):
+    # Runs in a pool process; jobs that waited past their deadline are dropped unrun
+    if time.time() > deadline:
+        return None
+    return func(*args)
+
+# Pool processes shared by every hasher of the current process, by size
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+def _get_pool(workers):
+    global _pools_pid
+    with _pools_lock:
+        # Gunicorn forks workers after the app is created, so each process starts its own pool
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(workers)
+        if pool is None:
+            # Spawned rather than forked: the parent runs broker and buffer threads
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pools[workers] = pool
+        return pool
+
+def _discard_pool(workers, pool):
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords in a bounded pool of worker processes.
+
+    Key derivation is deliberately CPU-bound. Computed in the request, it pins the
+    web worker for its whole duration (a gevent worker cannot switch greenlets in
+    the middle of it), so during a login storm /health and chat traffic queue
+    behind the logins. Jobs are instead run by a pool of `workers` processes per
+    web worker while the request waits cooperatively. A job that no pool process
+    has started within `queue_deadline` seconds is dropped and the request fails
+    with 503, so a backlog sheds load instead of growing. With workers=0 hashing
+    runs inline.
+    """
+    def __init__(self, method=DEFAULT_HASH_METHOD, workers=2, queue_deadline=2.0):
+        self.method = normalize_hash_method(method)
+        self.workers = workers
+        self.queue_deadline = queue_deadline
+
+    def hash(self, password):
+        """
+        Hashes a password with the configured method.
+
+        Args:
+            password (str): Plain text password.
+
+        Returns:
+            str: The hash.
+
+        Raises:
+            ServiceUnavailable: If the pool did not start the job in time.
+        """
+        return self._call(_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """
+        Checks a password against a stored hash.
+
+        Args:
+            password_hash (str): Stored hash.
+            password (str): Plain text password.
+
+        Returns:
+            tuple: (matches, new_hash); new_hash is a hash with the configured
+            method if the password matches and the stored hash is outdated, else None.
+
+        Raises:
+            ServiceUnavailable: If the pool did not start the job in time.
+        """
+        return self._call(_verify, password_hash, password, self.method)
+
+    def _call(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        pool = _get_pool(self.workers)
+        try:
+            future = pool.submit(_run_before, time.time() + self.queue_deadline, func, *args)
+            result = future.result(timeout=self.queue_deadline + HASH_TIMEOUT_SECONDS)
+        except BrokenProcessPool:
+            # A pool process died; the next call starts a new pool
+            _discard_pool(self.workers, pool)
+            raise ServiceUnavailable('Server is busy, please retry')
+        except FutureTimeoutError:
+            raise ServiceUnavailable('Server is busy, please retry')
+        if result is None:
+            raise ServiceUnavailable('Server is busy, please retry')
+        return result
+
+# Used outside an application, e.g. by scripts building users directly
+_inline_hasher = PasswordHasher(workers=0)
+
+def get_password_hasher():
+    """
+    Returns the password hasher of the current application.
+
+    Returns:
+        PasswordHasher: The application's hasher, or an inline hasher with the
+        default method outside an application context.
+    """
+    if has_app_context() and 'password_hasher' in current_app.extensions:
+        return current_app.extensions['password_hasher']
+    return _inline_hasher
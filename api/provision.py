@@ -0,0 +1,74 @@
+import argparse
+import json
+import sys
+from itertools import islice
+from app import create_app
+from services import provision_groups_and_profiles
+
+def read_items(lines):
+    """
+    Parses NDJSON lines into provisioning items, skipping blank lines.
+
+    Args:
+        lines (Iterable[str]): Lines of the input.
+
+    Yields:
+        tuple: (line number, item), where item is None for a line that is not valid JSON.
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+def provision(lines, batch_size=1000):
+    """
+    Creates the groups and profiles described by NDJSON lines, one transaction per batch.
+
+    Profiles may reference a group by the `ref` it was given on an earlier line,
+    including a line of an earlier batch.
+
+    Args:
+        lines (Iterable[str]): NDJSON lines, as accepted by POST /provision.
+        batch_size (int): Number of lines written per transaction.
+
+    Returns:
+        tuple: (number of items created, list of (line number, error message)).
+    """
+    refs = {}
+    created = 0
+    errors = []
+    items = read_items(lines)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return created, errors
+        results = provision_groups_and_profiles([item for _, item in batch], refs=refs)
+        for (number, _), result in zip(batch, results):
+            if 'error' in result:
+                errors.append((number, result['error']))
+            else:
+                created += 1
+
+def main():
+    """
+    Entry point for bulk provisioning from an NDJSON file.
+    """
+    parser = argparse.ArgumentParser(description='Create groups and profiles from an NDJSON file.')
+    parser.add_argument('file', help="NDJSON file with one group or profile per line, or '-' for stdin")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        with (sys.stdin if args.file == '-' else open(args.file, encoding='utf-8')) as lines:
+            created, errors = provision(lines, batch_size=args.batch_size)
+    for number, message in errors:
+        print(f"line {number}: {message}", file=sys.stderr)
+    print(f"Created {created} groups and profiles, {len(errors)} failed")
+    sys.exit(1 if errors else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+import time
+from models import db
+from services import pending_group_deletions, purge_group_batch
+
+class GroupPurger:
+    """
+    Background worker purging the rows of deleted groups.
+
+    A single thread per process runs the pending GroupDeletion jobs, one bounded
+    batch per transaction with a short pause in between, so a large group is
+    removed without long locks or a burst of load. The application starts the
+    thread on the first request each process handles (GROUP_PURGE_AUTOSTART), so
+    jobs left behind by a restarted process are resumed by its first poll; it
+    then polls every `poll_interval` seconds and is woken by deletion requests.
+    Without autostart, only a deletion request starts the thread, and
+    `python maintenance.py purge-deleted-groups` finishes the jobs left behind.
+    A job whose batches fail `max_attempts` times in a row is marked failed (see
+    purge_group_batch).
+    """
+    def __init__(self, app, batch_size=500, poll_interval=5.0, pause=0.01, max_attempts=5):
+        self.app = app
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.pause = pause
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """
+        Starts the worker if it is not running in this process, looking for pending jobs at once.
+        """
+        if self._ensure_started():
+            self._wakeup.set()
+
+    def wake(self):
+        """
+        Starts the worker if needed and makes it look for pending jobs now.
+        """
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        # Gunicorn forks workers after the app is created, so each process starts its own thread
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return False
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='group-purger', daemon=True)
+            self._thread.start()
+            return True
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.run_pending()
+                except Exception:
+                    db.session.rollback()
+                    logging.exception('Group purge failed, retrying on the next poll')
+                finally:
+                    db.session.remove()
+
+    def run_pending(self):
+        """
+        Runs every pending job to completion. Must be called within an application context.
+
+        Returns:
+            int: Number of jobs processed.
+        """
+        job_ids = pending_group_deletions()
+        for job_id in job_ids:
+            while purge_group_batch(job_id, self.batch_size, self.max_attempts):
+                time.sleep(self.pause)
+        return len(job_ids)
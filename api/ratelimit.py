@@ -0,0 +1,190 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select, update, delete, case
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.exceptions import TooManyRequests
+from models import db, RateLimitBucket
+
+# Limit name -> setting holding it as 'requests/seconds'; a falsy setting disables the limit
+RATE_LIMIT_SETTINGS = {
+    'login:ip': 'LOGIN_RATE_LIMIT_PER_IP',
+    'login:email': 'LOGIN_RATE_LIMIT_PER_EMAIL',
+    'register:ip': 'REGISTER_RATE_LIMIT_PER_IP',
+    'register:email': 'REGISTER_RATE_LIMIT_PER_EMAIL'
+}
+
+def parse_rate_limit(value):
+    """
+    Parses a rate limit setting.
+
+    Args:
+        value (str): 'requests/seconds', e.g. '10/60' for a burst of 10 requests
+            refilled at 10 per minute.
+
+    Returns:
+        tuple: (capacity, tokens refilled per second).
+
+    Raises:
+        ValueError: If the value is malformed.
+    """
+    try:
+        requests, seconds = (float(part) for part in value.split('/'))
+    except (AttributeError, ValueError):
+        raise ValueError(f'Invalid rate limit: {value!r}')
+    if requests < 1 or seconds <= 0:
+        raise ValueError(f'Invalid rate limit: {value!r}')
+    return requests, requests / seconds
+
+class MemoryRateLimitStore:
+    """
+    Token buckets held in the current process.
+
+    Each bucket is a (tokens, updated_at, expires_at) tuple, where expires_at is
+    when it will have refilled completely; an expired bucket is the same as no
+    bucket, so it is dropped. Buckets are kept in least recently used order and
+    evicted from the front once expired, or when there are more than max_entries.
+    """
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate):
+        """
+        Takes a token from a bucket.
+
+        Args:
+            key (str): Bucket key.
+            capacity (float): Maximum number of tokens.
+            rate (float): Tokens refilled per second.
+
+        Returns:
+            float: 0 if a token was taken, else seconds until one is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            retry_after = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            while self._buckets:
+                oldest = next(iter(self._buckets.values()))
+                if oldest[2] > now and len(self._buckets) <= self.max_entries:
+                    break
+                self._buckets.popitem(last=False)
+            return retry_after
+
+class DatabaseRateLimitStore:
+    """
+    Token buckets in the rate_limit_bucket table, shared by every worker process.
+
+    A token is taken with one conditional UPDATE, so concurrent requests on any
+    worker cannot overdraw a bucket. Buckets idle for longer than `ttl` seconds
+    (the longest refill time of the configured limits) are full again and are
+    deleted every `cleanup_interval` seconds.
+    """
+    def __init__(self, ttl, cleanup_interval=60.0):
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self._next_cleanup = 0.0
+
+    def take(self, key, capacity, rate):
+        """
+        Takes a token from a bucket.
+
+        Args:
+            key (str): Bucket key.
+            capacity (float): Maximum number of tokens.
+            rate (float): Tokens refilled per second.
+
+        Returns:
+            float: 0 if a token was taken, else seconds until one is available.
+        """
+        bucket = RateLimitBucket.__table__
+        c = bucket.c
+        now = time.time()
+        refilled = c.tokens + (now - c.updated_at) * rate
+        available = case((refilled > capacity, capacity), else_=refilled)
+        with db.engine.begin() as connection:
+            if now >= self._next_cleanup:
+                self._next_cleanup = now + self.cleanup_interval
+                connection.execute(delete(bucket).where(c.updated_at < now - self.ttl))
+            # A concurrent first request may create the bucket between the UPDATE and the INSERT
+            for _ in range(2):
+                taken = connection.execute(update(bucket).where(c.key == key, available >= 1)
+                                           .values(tokens=available - 1, updated_at=now))
+                if taken.rowcount:
+                    return 0.0
+                tokens = connection.execute(select(available).where(c.key == key)).scalar()
+                if tokens is not None:
+                    return (1 - tokens) / rate
+                dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+                created = connection.execute(dialect.insert(bucket).values(key=key, tokens=capacity - 1, updated_at=now)
+                                             .on_conflict_do_nothing(index_elements=['key']))
+                if created.rowcount:
+                    return 0.0
+        return 0.0
+
+class RateLimiter:
+    """
+    Applies named token-bucket limits to clients.
+
+    A limit of 'requests/seconds' allows a burst of `requests` and refills at
+    requests/seconds tokens per second, so a client that keeps retrying is held
+    to the long-run rate.
+    """
+    def __init__(self, store, limits):
+        self.store = store
+        self.limits = limits
+
+    def check(self, name, subject):
+        """
+        Counts a request against a limit.
+
+        Args:
+            name (str): Limit name, e.g. 'login:ip'. Unconfigured limits are not enforced.
+            subject (str): Client the limit applies to, e.g. an IP address or email.
+
+        Raises:
+            TooManyRequests: If the client is over the limit; carries the seconds to wait.
+        """
+        limit = self.limits.get(name)
+        if limit is None:
+            return
+        retry_after = self.store.take(f'{name}:{subject}', *limit)
+        if retry_after:
+            raise TooManyRequests('Too many attempts, please retry later', retry_after=math.ceil(retry_after))
+
+def create_rate_limiter(app):
+    """
+    Creates the rate limiter configured by the RATE_LIMIT_* settings.
+
+    RATE_LIMIT_BACKEND 'memory' keeps buckets in each process, so with several
+    worker processes a client gets the limit once per worker; 'database' shares
+    them across workers through the application database.
+
+    Args:
+        app (Flask): The application.
+
+    Returns:
+        RateLimiter: The limiter.
+
+    Raises:
+        ValueError: If the backend or a limit is invalid.
+    """
+    limits = {name: parse_rate_limit(app.config[setting])
+              for name, setting in RATE_LIMIT_SETTINGS.items() if app.config.get(setting)}
+    backend = app.config.get('RATE_LIMIT_BACKEND', 'memory')
+    if backend == 'memory':
+        store = MemoryRateLimitStore(max_entries=app.config.get('RATE_LIMIT_MAX_KEYS', 100000))
+    elif backend == 'database':
+        store = DatabaseRateLimitStore(ttl=max((capacity / rate for capacity, rate in limits.values()), default=0))
+    else:
+        raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {backend}')
+    return RateLimiter(store, limits)
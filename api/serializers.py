@@ -0,0 +1,285 @@
+import json
+from operator import attrgetter, itemgetter
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library encoder is used instead
+    orjson = None
+
+def dumps(value):
+    """
+    Encodes a value as compact JSON with the fastest available backend.
+
+    Args:
+        value: A JSON-serializable value.
+
+    Returns:
+        str: The JSON text.
+    """
+    if orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value, separators=(',', ':'))
+
+def loads(data):
+    """
+    Decodes JSON text with the fastest available backend.
+
+    Args:
+        data (str or bytes): The JSON text.
+
+    Returns:
+        The decoded value.
+
+    Raises:
+        ValueError: If the text is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider (behind jsonify and request.get_json) using orjson when installed.
+
+    Output matches the default provider's: keys are sorted and datetimes are
+    rendered by Flask's `default` hook. Calls with arguments orjson cannot honor
+    fall back to the standard library.
+    """
+    def dumps(self, obj, **kwargs):
+        if orjson is None or not set(kwargs) <= {'indent', 'separators'}:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+def isoformat(value):
+    """
+    Renders an optional datetime as ISO 8601.
+
+    Args:
+        value (datetime): The value, or None.
+
+    Returns:
+        str: The ISO 8601 text, or None.
+    """
+    return value.isoformat() if value is not None else None
+
+class Field:
+    """
+    One field of a Schema.
+
+    Args:
+        name (str): Key in the JSON representation.
+        source (str or callable, optional): Attribute or column to read, the name
+            by default, or a function computing the value from the whole object.
+        convert (callable, optional): Converts the value read, e.g. isoformat.
+    """
+    def __init__(self, name, source=None, convert=None):
+        self.name = name
+        self.source = source or name
+        self.convert = convert
+
+class Schema:
+    """
+    Converts instances of one model into their JSON representation.
+
+    Fields are read by name, so a schema accepts ORM objects and rows selected
+    with matching column names (or labels) alike. For many rows of one result,
+    dump_many resolves each column's position once and then reads rows as
+    tuples, skipping the per-row attribute lookups.
+    """
+    def __init__(self, *fields):
+        self.fields = tuple(field if isinstance(field, Field) else Field(field) for field in fields)
+        self.names = tuple(field.name for field in self.fields)
+        self._dumpers = {}
+
+    def dump(self, obj, fields=None):
+        """
+        Serializes one object or row.
+
+        Args:
+            obj: ORM object or row.
+            fields (Iterable[str], optional): Only include these fields.
+
+        Returns:
+            dict: The JSON representation.
+        """
+        key = None if fields is None else frozenset(fields)
+        dump = self._dumpers.get(key)
+        if dump is None:
+            dump = self._dumpers[key] = self._compile(self._selected(fields), None)
+        return dump(obj)
+
+    def dump_many(self, items, fields=None):
+        """
+        Serializes a sequence of objects or rows of the same shape.
+
+        Args:
+            items (Iterable): ORM objects, or rows of one result.
+            fields (Iterable[str], optional): Only include these fields.
+
+        Returns:
+            list: The JSON representations.
+        """
+        items = list(items)
+        if not items:
+            return []
+        dump = self._compile(self._selected(fields), getattr(items[0], '_fields', None))
+        return [dump(item) for item in items]
+
+    def _selected(self, fields):
+        if fields is None:
+            return self.fields
+        return tuple(field for field in self.fields if field.name in fields)
+
+    @staticmethod
+    def _compile(fields, columns):
+        getters = []
+        for field in fields:
+            if callable(field.source):
+                get = field.source
+            elif columns is not None and field.source in columns:
+                get = itemgetter(columns.index(field.source))
+            else:
+                get = attrgetter(field.source)
+            getters.append((field.name, get, field.convert))
+
+        def dump(obj):
+            data = {}
+            for name, get, convert in getters:
+                value = get(obj)
+                data[name] = convert(value) if convert is not None else value
+            return data
+        return dump
+
+USER_SCHEMA = Schema('id', 'email')
+
+GROUP_SCHEMA = Schema('id', 'name', 'picture', 'max_profiles', 'profile_count')
+
+# Groups of the /users/me document, read from profile rows joined with their group
+USER_GROUP_SCHEMA = Schema(*(Field(name, f'group_{name}') for name in GROUP_SCHEMA.names))
+
+PROFILE_SCHEMA = Schema('id', 'name', 'picture', 'bio', 'group_id')
+
+CHAT_SCHEMA = Schema(
+    'id', 'name', Field('created_at', convert=isoformat), Field('updated_at', convert=isoformat), 'group_id',
+    Field('last_message_at', convert=isoformat), 'message_count', 'last_message_preview'
+)
+
+MESSAGE_SCHEMA = Schema('id', 'content', Field('created_at', convert=isoformat), 'chat_id', 'profile_id')
+
+TRANSCRIPT_ENTRY_SCHEMA = Schema(
+    'id', 'seq', Field('created_at', convert=isoformat), 'profile_id', 'profile_name', 'content'
+)
+
+GROUP_DELETION_SCHEMA = Schema(
+    'id', 'group_id', 'status', Field('created_at', convert=isoformat), Field('updated_at', convert=isoformat),
+    Field('finished_at', convert=isoformat), 'attempts', 'error',
+    Field('deleted', lambda job: {
+        'messages': job.messages_deleted,
+        'participants': job.participants_deleted,
+        'chats': job.chats_deleted,
+        'profiles': job.profiles_deleted
+    })
+)
+
+def unread_count(message_count, last_read_seq):
+    """
+    Computes a participant's unread count from the chat counter and its read watermark.
+
+    Args:
+        message_count (int): The chat's message_count.
+        last_read_seq (int): The participant's last_read_seq.
+
+    Returns:
+        int: Number of messages after the watermark.
+    """
+    return max(message_count - last_read_seq, 0)
+
+def serialize_chat(row, participants='ids', fields=None):
+    """
+    Converts a row selected by chat_select into the chat's JSON representation.
+
+    Rows of a listing filtered by profile also carry that profile's unread_count.
+
+    Args:
+        row (Row): The selected row.
+        participants (str): The mode the row was selected with.
+        fields (frozenset, optional): Only include these fields.
+
+    Returns:
+        dict: Chat data.
+    """
+    return serialize_chats([row], participants, fields)[0]
+
+def serialize_chats(rows, participants='ids', fields=None):
+    """
+    Converts rows selected by chat_select into the chats' JSON representations.
+
+    Args:
+        rows (List[Row]): Rows of one result.
+        participants (str): The mode the rows were selected with.
+        fields (frozenset, optional): Only include these fields.
+
+    Returns:
+        list: Chat data, in row order.
+    """
+    chats = CHAT_SCHEMA.dump_many(rows, fields)
+    if not rows:
+        return chats
+    with_ids = participants == 'ids' and (fields is None or 'participant_ids' in fields)
+    with_count = participants == 'count' and (fields is None or 'participant_count' in fields)
+    with_unread = 'last_read_seq' in rows[0]._fields and (fields is None or 'unread_count' in fields)
+    for data, row in zip(chats, rows):
+        if with_ids:
+            data['participant_ids'] = sorted(row.participant_ids.split(',')) if row.participant_ids else []
+        elif with_count:
+            data['participant_count'] = row.participant_count
+        if with_unread:
+            data['unread_count'] = unread_count(row.message_count, row.last_read_seq)
+    return chats
+
+def serialize_message(message):
+    """
+    Converts a message into its JSON representation.
+
+    Args:
+        message (Message or Row): The message.
+
+    Returns:
+        dict: Message data.
+    """
+    return MESSAGE_SCHEMA.dump(message)
+
+def serialize_transcript_entry(row):
+    """
+    Converts a transcript row into its JSON representation.
+
+    Args:
+        row (Row): Row selected by chat_transcript_query.
+
+    Returns:
+        dict: Transcript entry.
+    """
+    return TRANSCRIPT_ENTRY_SCHEMA.dump(row)
+
+def serialize_group_deletion(job):
+    """
+    Converts a group deletion job into its JSON representation.
+
+    Args:
+        job (GroupDeletion): The job.
+
+    Returns:
+        dict: The job's status and progress.
+    """
+    return GROUP_DELETION_SCHEMA.dump(job)
@@ -1,11 +1,20 @@
 import logging
-from models import db, Group, Profile, User, Chat, chat_participants  
-from werkzeug.exceptions import BadRequest
+import uuid
+from datetime import datetime, timedelta
+from models import db, Group, Profile, User, Chat, Message, GroupDeletion, chat_participants, chat_activity_key, CHAT_PREVIEW_LENGTH
+from sqlalchemy import tuple_, insert, update, delete, case, or_, and_, select, bindparam, func, literal
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from werkzeug.exceptions import BadRequest, NotFound
 from uuid import UUID
 from functools import wraps
 from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
-from flask import request, jsonify
+from flask import request, jsonify, current_app
 from werkzeug.exceptions import Unauthorized
+from pagination import encode_cursor, decode_cursor
+from broker import publish, chat_channel, group_channel, user_channel
+from serializers import (
+    GROUP_SCHEMA, PROFILE_SCHEMA, USER_SCHEMA, USER_GROUP_SCHEMA, serialize_chats, unread_count
+)
 
 def authenticate(func):
     """
@@ -50,6 +59,10 @@ def validate_profile_data(data, user_id=None):
     """
     Validates the data for creating or updating a profile.
 
+    Uniqueness of the profile per user and of its name within the group is not
+    checked here: it is enforced by unique indexes when the profile is written
+    (see create_profile).
+
     Args:
         data (dict): The profile data.
         user_id (str, optional): ID of the user creating the profile.
@@ -57,7 +70,7 @@ def validate_profile_data(data, user_id=None):
     Raises:
         BadRequest: If validation fails.
     """
-    if 'name' not in data or not isinstance(data['name'], str):
+    if not isinstance(data, dict) or 'name' not in data or not isinstance(data['name'], str):
         raise BadRequest('Invalid profile name')
     if 'bio' in data and not isinstance(data['bio'], str):
         raise BadRequest('Invalid bio')
@@ -65,13 +78,59 @@ def validate_profile_data(data, user_id=None):
         raise BadRequest('Invalid picture URL')
     if 'group_id' not in data or not isinstance(data['group_id'], str):
         raise BadRequest('Invalid group_id')
-    if user_id:
-        existing_profile = Profile.query.filter_by(group_id=data['group_id'], user_id=user_id).first()
-        if existing_profile:
-            raise BadRequest('User already has a profile in this group')
-    name_exists = Profile.query.filter_by(group_id=data['group_id'], name=data['name']).first()
-    if name_exists:
-        raise BadRequest('Profile name already exists in this group')
+
+def reserve_group_seat(group_id):
+    """
+    Counts a new profile against its group's max_profiles, within the current transaction.
+
+    A single conditional UPDATE increments profile_count only while it is below
+    max_profiles. The row lock it takes serializes concurrent joins to the same
+    group, so no increment is lost and the group never goes over capacity,
+    without counting profile rows.
+
+    Args:
+        group_id (str): ID of the group.
+
+    Raises:
+        BadRequest: If the group does not exist or is full.
+    """
+    group = Group.__table__.c
+    result = db.session.execute(update(Group.__table__)
+                                .where(group.id == group_id, group.deleted_at.is_(None),
+                                       group.profile_count < group.max_profiles)
+                                .values(profile_count=group.profile_count + 1))
+    if result.rowcount == 1:
+        return
+    exists = db.session.execute(select(group.id).where(group.id == group_id, group.deleted_at.is_(None))).first() is not None
+    db.session.rollback()
+    raise BadRequest('Group is full' if exists else 'Group not found')
+
+# Messages for violations of the profile constraints, keyed by constraint name and
+# by the columns the database reports (Postgres' detail, SQLite's column list).
+# SQLite does not say which foreign key failed, hence the last entry.
+PROFILE_CONSTRAINT_MESSAGES = (
+    (('uq_profile_group_user', 'profile.group_id, profile.user_id'), 'User already has a profile in this group'),
+    (('uq_profile_group_name', 'profile.group_id, profile.name'), 'Profile name already exists in this group'),
+    (('profile_group_id_fkey', 'key (group_id)'), 'Group not found'),
+    (('profile_user_id_fkey', 'key (user_id)'), 'User not found'),
+    (('foreign key constraint failed',), 'Group or user not found')
+)
+
+def profile_constraint_error(error):
+    """
+    Maps a constraint violation raised while writing a profile to a client error.
+
+    Args:
+        error (IntegrityError): The database error.
+
+    Returns:
+        BadRequest: The matching client error, or None if the violation is unexpected.
+    """
+    text = str(error.orig).lower()
+    for keys, message in PROFILE_CONSTRAINT_MESSAGES:
+        if any(key in text for key in keys):
+            return BadRequest(message)
+    return None
 
 def is_strong_password(password):
     """
@@ -95,7 +154,7 @@ def is_strong_password(password):
 
 def create_group(data):
     """
-    Creates a new group and its associated general chat.
+    Creates a new group and its associated general chat in a single transaction.
 
     Args:
         data (dict): The group data.
@@ -104,12 +163,10 @@ def create_group(data):
         Group: The created group instance.
     """
     validate_group_data(data)
-    new_group = Group(name=data['name'], picture=data.get('picture'), max_profiles=data['max_profiles'])
-    db.session.add(new_group)
-    db.session.commit()
-    # Create a general chat for the new group
+    new_group = Group(id=str(uuid.uuid4()), name=data['name'], picture=data.get('picture'), max_profiles=data['max_profiles'])
+    # Create a general chat for the new group; the flush inserts the group first
     general_chat = Chat(name='general', group_id=new_group.id)
-    db.session.add(general_chat)
+    db.session.add_all([new_group, general_chat])
     db.session.commit()
     return new_group
 
@@ -129,30 +186,404 @@ def update_group(group, data):
     group.picture = data.get('picture')
     group.max_profiles = data['max_profiles']
     db.session.commit()
+    publish(group_channel(group.id), {'type': 'group.updated', 'group_id': group.id})
     return group
 
+def request_group_deletion(group_id):
+    """
+    Marks a group deleted and queues the purge of its rows.
+
+    From the commit on, the group and its profiles, chats and messages are hidden
+    from every read (see models.hide_deleted_groups); purge_group_batch then
+    deletes them in the background.
+
+    Args:
+        group_id (str): ID of the group.
+
+    Returns:
+        GroupDeletion: The queued job.
+
+    Raises:
+        NotFound: If the group does not exist or is already deleted.
+    """
+    group = Group.__table__.c
+    result = db.session.execute(update(Group.__table__).where(group.id == group_id, group.deleted_at.is_(None))
+                                .values(deleted_at=datetime.utcnow()))
+    if result.rowcount != 1:
+        db.session.rollback()
+        raise NotFound('Group not found')
+    job = GroupDeletion(id=str(uuid.uuid4()), group_id=group_id, status='pending')
+    db.session.add(job)
+    db.session.commit()
+    publish(group_channel(group_id), {'type': 'group.deleted', 'group_id': group_id})
+    return job
+
+def pending_group_deletions():
+    """
+    Lists the purge jobs that still have work to do, oldest first.
+
+    Returns:
+        List[str]: IDs of the jobs.
+    """
+    job = GroupDeletion.__table__.c
+    return db.session.execute(select(job.id).where(job.status.in_(('pending', 'running')))
+                              .order_by(job.status, job.created_at)).scalars().all()
+
+def purge_group_batch(job_id, batch_size=500, max_attempts=5):
+    """
+    Deletes up to batch_size rows of a deleted group, in one transaction.
+
+    The job row is locked (SKIP LOCKED on Postgres) for the duration of the
+    batch, so concurrent workers never process the same job at once. A batch
+    that fails, e.g. on a foreign key from rows outside the group, is rolled
+    back and the failure is recorded on the job; after max_attempts failures in
+    a row the job is marked failed with the error and is no longer picked up.
+
+    Args:
+        job_id (str): ID of the GroupDeletion job.
+        batch_size (int): Maximum number of rows deleted per table and batch.
+        max_attempts (int): Consecutive failed batches before the job fails.
+
+    Returns:
+        bool: True if the job has more work left and can continue right away.
+    """
+    job = db.session.execute(select(GroupDeletion).where(
+        GroupDeletion.id == job_id, GroupDeletion.status.in_(('pending', 'running'))
+    ).with_for_update(skip_locked=True)).scalar_one_or_none()
+    if job is None:
+        db.session.rollback()
+        return False
+    job.status = 'running'
+    try:
+        more = purge_next_rows(job, batch_size)
+        if not more:
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+        job.attempts = 0
+        job.error = None
+        db.session.commit()
+        return more
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        record_purge_failure(job_id, e, max_attempts)
+        return False
+
+def purge_next_rows(job, batch_size):
+    """
+    Deletes the next rows of a job's group, in the current transaction.
+
+    Rows go in foreign key order: messages, chat memberships, chats, profiles
+    and finally the group row. Every call deletes whatever remains of the
+    current kind, so a job interrupted at any point resumes where it stopped.
+
+    Args:
+        job (GroupDeletion): The locked job; its counters are updated.
+        batch_size (int): Maximum number of rows deleted.
+
+    Returns:
+        bool: False once the group row itself was deleted.
+    """
+    chat = Chat.__table__.c
+    message = Message.__table__.c
+    participant = chat_participants.c
+    profile = Profile.__table__.c
+    group_chats = select(chat.id).where(chat.group_id == job.group_id)
+
+    message_ids = db.session.execute(
+        select(message.id).where(message.chat_id.in_(group_chats)).limit(batch_size)).scalars().all()
+    if message_ids:
+        db.session.execute(delete(Message.__table__).where(message.id.in_(message_ids)))
+        job.messages_deleted += len(message_ids)
+        return True
+    memberships = db.session.execute(select(participant.chat_id, participant.profile_id)
+                                     .where(participant.chat_id.in_(group_chats)).limit(batch_size)).all()
+    if memberships:
+        db.session.execute(delete(chat_participants).where(
+            tuple_(participant.chat_id, participant.profile_id).in_([tuple(row) for row in memberships])))
+        job.participants_deleted += len(memberships)
+        return True
+    chat_ids = db.session.execute(group_chats.limit(batch_size)).scalars().all()
+    if chat_ids:
+        db.session.execute(delete(Chat.__table__).where(chat.id.in_(chat_ids)))
+        job.chats_deleted += len(chat_ids)
+        return True
+    profile_ids = db.session.execute(
+        select(profile.id).where(profile.group_id == job.group_id).limit(batch_size)).scalars().all()
+    if profile_ids:
+        db.session.execute(delete(Profile.__table__).where(profile.id.in_(profile_ids)))
+        job.profiles_deleted += len(profile_ids)
+        return True
+    db.session.execute(delete(Group.__table__).where(Group.__table__.c.id == job.group_id))
+    return False
+
+def record_purge_failure(job_id, error, max_attempts):
+    """
+    Counts a failed batch against a group deletion job, failing the job after max_attempts.
+
+    Args:
+        job_id (str): ID of the GroupDeletion job.
+        error (Exception): The database error.
+        max_attempts (int): Consecutive failed batches before the job fails.
+    """
+    job = db.session.execute(select(GroupDeletion).where(GroupDeletion.id == job_id).with_for_update()).scalar_one()
+    job.attempts += 1
+    job.error = str(getattr(error, 'orig', None) or error)[:1024]
+    if job.attempts >= max_attempts:
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+    db.session.commit()
+    logging.warning('Purge of group %s failed (attempt %d of %d): %s',
+                    job.group_id, job.attempts, max_attempts, job.error)
+
 def create_profile(data, user_id):
     """
     Creates a new profile within a group and adds it to the general chat.
 
+    A seat is reserved in the group (see reserve_group_seat), then the profile
+    row and its general chat membership are written, the membership with an
+    INSERT ... SELECT that finds the chat, all in a single transaction. A user
+    who already has a profile in the group or a taken name is reported from the
+    unique index violation, which also holds when two requests race each other;
+    the rollback releases the seat.
+
     Args:
         data (dict): The profile data.
         user_id (str): ID of the user creating the profile.
 
     Returns:
-        Profile: The created profile instance.
+        Profile: The created profile instance (not attached to the session).
+
+    Raises:
+        BadRequest: If the data is invalid or breaks a uniqueness rule.
     """
     validate_profile_data(data, user_id)
-    new_profile = Profile(name=data['name'], picture=data.get('picture'), bio=data.get('bio'), group_id=data['group_id'], user_id=user_id)
-    db.session.add(new_profile)
-    db.session.commit()
-    # Add profile to the general chat
-    general_chat = Chat.query.filter_by(group_id=data['group_id'], name='general').first()
-    if general_chat:
-        general_chat.participants.append(new_profile)
+    reserve_group_seat(data['group_id'])
+    values = {
+        'id': str(uuid.uuid4()),
+        'name': data['name'],
+        'picture': data.get('picture'),
+        'bio': data.get('bio'),
+        'group_id': data['group_id'],
+        'user_id': user_id
+    }
+    chat = Chat.__table__.c
+    general = (chat.group_id == values['group_id'], chat.name == 'general')
+    try:
+        db.session.execute(insert(Profile.__table__).values(**values))
+        db.session.execute(insert(chat_participants).from_select(
+            ['chat_id', 'profile_id'], select(chat.id, literal(values['id'])).where(*general)))
+        # The general chat's participants changed
+        db.session.execute(update(Chat.__table__).where(*general).values(updated_at=datetime.utcnow()))
         db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        error = profile_constraint_error(e)
+        if error is None:
+            raise
+        raise error
+    new_profile = Profile(**values)
+    event = {
+        'type': 'profile.created',
+        'group_id': new_profile.group_id,
+        'profile_id': new_profile.id
+    }
+    publish(group_channel(new_profile.group_id), event)
+    publish(user_channel(user_id), event)
     return new_profile
 
+def provision_groups_and_profiles(items, refs=None):
+    """
+    Creates many groups and profiles in a single transaction with bulk inserts.
+
+    Items are dicts with a `type`:
+
+    - `group`: `name`, `max_profiles`, optional `picture` and `ref`. A general chat
+      is created with every group.
+    - `profile`: `name`, optional `picture` and `bio`, the group as `group_ref` (the
+      `ref` of a group in this or an earlier batch) or `group_id`, and the user as
+      `user_id` or `email`. The profile joins its group's general chat.
+
+    Groups, general chats, profiles and memberships are each written with one
+    executemany. Existing groups and users are looked up with one query each, as
+    are existing profiles that would break a uniqueness rule. A group's profiles
+    are accepted or rejected together: if they do not all fit within
+    max_profiles, each of them is reported as 'Group is full'. Invalid items are
+    reported individually without failing the rest.
+
+    Args:
+        items (List[dict]): Groups and profiles to create, in any order.
+        refs (dict, optional): Group ids by ref from earlier batches; refs of
+            groups created by this batch are added to it.
+
+    Returns:
+        List[dict]: One result per item, in input order, with either `id` or `error`.
+
+    Raises:
+        BadRequest: If a concurrent write broke a uniqueness rule; nothing is stored.
+    """
+    refs = {} if refs is None else refs
+    results = [None] * len(items)
+
+    def fail(index, message):
+        results[index] = {'index': index, 'error': message}
+
+    # Groups
+    group_rows = []
+    batch_refs = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or item.get('type') not in ('group', 'profile'):
+            fail(index, 'Invalid item type')
+            continue
+        if item['type'] != 'group':
+            continue
+        try:
+            validate_group_data(item)
+            ref = item.get('ref')
+            if ref is not None and (not isinstance(ref, str) or ref in refs or ref in batch_refs):
+                raise BadRequest('Invalid or duplicate group ref')
+        except BadRequest as e:
+            fail(index, e.description)
+            continue
+        row = {'id': str(uuid.uuid4()), 'name': item['name'], 'picture': item.get('picture', ''),
+               'max_profiles': item['max_profiles'], 'profile_count': 0}
+        if ref is not None:
+            batch_refs[ref] = row['id']
+        group_rows.append(row)
+        results[index] = {'index': index, 'id': row['id']}
+    new_groups = {row['id']: row for row in group_rows}
+
+    # Profiles: resolve groups and users with one query each
+    profile_items = [(index, item) for index, item in enumerate(items) if results[index] is None]
+    known_refs = {**refs, **batch_refs}
+    earlier_groups = set(refs.values())
+    existing_group_ids = {item['group_id'] for _, item in profile_items
+                          if 'group_ref' not in item and isinstance(item.get('group_id'), str)}
+    existing_group_ids -= set(new_groups) | earlier_groups
+    existing_groups = set(db.session.execute(
+        select(Group.id).where(Group.id.in_(existing_group_ids))).scalars()) if existing_group_ids else set()
+    emails = {item['email'] for _, item in profile_items if isinstance(item.get('email'), str)}
+    user_ids = {item['user_id'] for _, item in profile_items if isinstance(item.get('user_id'), str)}
+    users_by_email = dict(db.session.execute(
+        select(User.email, User.id).where(User.email.in_(emails))).all()) if emails else {}
+    known_users = set(db.session.execute(
+        select(User.id).where(User.id.in_(user_ids))).scalars()) if user_ids else set()
+
+    candidates = []
+    for index, item in profile_items:
+        if 'group_ref' in item:
+            group_id = known_refs.get(item['group_ref']) if isinstance(item['group_ref'], str) else None
+        else:
+            group_id = item.get('group_id')
+            if group_id is not None and not isinstance(group_id, str):
+                fail(index, 'Invalid group_id')
+                continue
+        if group_id not in new_groups and group_id not in existing_groups and group_id not in earlier_groups:
+            fail(index, 'Group not found')
+            continue
+        if isinstance(item.get('email'), str):
+            user_id = users_by_email.get(item['email'])
+        elif item.get('user_id') is not None and not isinstance(item['user_id'], str):
+            fail(index, 'Invalid user_id')
+            continue
+        else:
+            user_id = item.get('user_id') if item.get('user_id') in known_users else None
+        if user_id is None:
+            fail(index, 'User not found')
+            continue
+        data = {**item, 'group_id': group_id}
+        try:
+            validate_profile_data(data, user_id)
+        except BadRequest as e:
+            fail(index, e.description)
+            continue
+        candidates.append((index, data, user_id))
+
+    # Uniqueness within the batch and against stored profiles
+    stored_members = set()
+    stored_names = set()
+    stored_groups = {data['group_id'] for _, data, _ in candidates if data['group_id'] not in new_groups}
+    if stored_groups:
+        pending = [(data['group_id'], user_id, data['name']) for _, data, user_id in candidates if data['group_id'] in stored_groups]
+        stored_members = {tuple(row) for row in db.session.execute(select(Profile.group_id, Profile.user_id).where(
+            tuple_(Profile.group_id, Profile.user_id).in_({(group_id, user_id) for group_id, user_id, _ in pending})))}
+        stored_names = {tuple(row) for row in db.session.execute(select(Profile.group_id, Profile.name).where(
+            tuple_(Profile.group_id, Profile.name).in_({(group_id, name) for group_id, _, name in pending})))}
+    by_group = {}
+    for index, data, user_id in candidates:
+        member, name = (data['group_id'], user_id), (data['group_id'], data['name'])
+        if member in stored_members:
+            fail(index, 'User already has a profile in this group')
+        elif name in stored_names:
+            fail(index, 'Profile name already exists in this group')
+        else:
+            stored_members.add(member)
+            stored_names.add(name)
+            by_group.setdefault(data['group_id'], []).append((index, data, user_id))
+
+    # Capacity: new groups are counted here, existing ones reserve their seats atomically
+    group = Group.__table__.c
+    accepted = []
+    for group_id in sorted(by_group):
+        entries = by_group[group_id]
+        if group_id in new_groups:
+            fits = len(entries) <= new_groups[group_id]['max_profiles']
+            if fits:
+                new_groups[group_id]['profile_count'] = len(entries)
+        else:
+            fits = db.session.execute(update(Group.__table__).where(
+                group.id == group_id, group.deleted_at.is_(None), group.profile_count + len(entries) <= group.max_profiles
+            ).values(profile_count=group.profile_count + len(entries))).rowcount == 1
+        for index, data, user_id in entries:
+            if fits:
+                accepted.append((index, data, user_id))
+            else:
+                fail(index, 'Group is full')
+
+    profile_rows = []
+    for index, data, user_id in accepted:
+        row = {'id': str(uuid.uuid4()), 'name': data['name'], 'picture': data.get('picture', ''),
+               'bio': data.get('bio', ''), 'group_id': data['group_id'], 'user_id': user_id}
+        profile_rows.append(row)
+        results[index] = {'index': index, 'id': row['id']}
+
+    general_chats = {row['id']: str(uuid.uuid4()) for row in group_rows}
+    joined_groups = {row['group_id'] for row in profile_rows} - set(general_chats)
+    if joined_groups:
+        general_chats.update(db.session.execute(select(Chat.group_id, Chat.id).where(
+            Chat.group_id.in_(joined_groups), Chat.name == 'general')).all())
+    now = datetime.utcnow()
+    try:
+        if group_rows:
+            db.session.execute(insert(Group.__table__), group_rows)
+            db.session.execute(insert(Chat.__table__), [
+                {'id': general_chats[row['id']], 'name': 'general', 'group_id': row['id'], 'created_at': now, 'updated_at': now}
+                for row in group_rows])
+        if profile_rows:
+            db.session.execute(insert(Profile.__table__), profile_rows)
+            memberships = [{'chat_id': general_chats[row['group_id']], 'profile_id': row['id']}
+                           for row in profile_rows if row['group_id'] in general_chats]
+            if memberships:
+                db.session.execute(insert(chat_participants), memberships)
+            joined_chats = [general_chats[group_id] for group_id in joined_groups if group_id in general_chats]
+            if joined_chats:
+                db.session.execute(update(Chat.__table__).where(Chat.__table__.c.id.in_(joined_chats))
+                                   .values(updated_at=now))
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        error = profile_constraint_error(e)
+        if error is None:
+            raise
+        raise BadRequest(f'{error.description}; nothing was stored, retry the batch')
+    refs.update(batch_refs)
+
+    # One event per affected group and user is enough for subscribers to re-read
+    for group_id in {row['group_id'] for row in profile_rows} - set(new_groups):
+        publish(group_channel(group_id), {'type': 'profile.created', 'group_id': group_id})
+    for user_id in {row['user_id'] for row in profile_rows}:
+        publish(user_channel(user_id), {'type': 'profile.created', 'user_id': user_id})
+    return results
+
 def validate_chat_data(data, group_id=None):
     """
     Validates the data for creating or updating a chat.
@@ -161,6 +592,9 @@ def validate_chat_data(data, group_id=None):
         data (dict): The chat data.
         group_id (str, optional): ID of the group the chat belongs to.
 
+    Returns:
+        set: The distinct participant IDs, or None if no group_id was given to check them against.
+
     Raises:
         BadRequest: If validation fails.
     """
@@ -169,36 +603,151 @@ def validate_chat_data(data, group_id=None):
     participant_ids = data.get('participant_ids', [])
     if not isinstance(participant_ids, list):
         raise BadRequest('participant_ids must be a list if provided')
-    if group_id and participant_ids:
-        profiles = Profile.query.filter(Profile.id.in_(participant_ids)).all()
-        if len(profiles) != len(participant_ids):
-            raise BadRequest('One or more profiles not found')
-        if not all(profile.group_id == group_id for profile in profiles):
-            raise BadRequest('All participants must belong to the same group')
+    if not group_id:
+        return None
+    return validate_participant_ids(participant_ids, group_id)
 
-def create_chat(data, group_id):
+def validate_participant_ids(profile_ids, group_id):
+    """
+    Checks that profiles exist and belong to a chat's group, with one query.
+
+    Args:
+        profile_ids (list): IDs of the profiles.
+        group_id (str): ID of the chat's group.
+
+    Returns:
+        set: The distinct profile IDs.
+
+    Raises:
+        BadRequest: If an ID is not a string or a profile is missing or in another group.
+    """
+    if not isinstance(profile_ids, list) or not all(isinstance(profile_id, str) for profile_id in profile_ids):
+        raise BadRequest('profile ids must be a list of strings')
+    profile_ids = set(profile_ids)
+    if not profile_ids:
+        return profile_ids
+    groups = db.session.execute(select(Profile.id, Profile.group_id).where(Profile.id.in_(profile_ids))).all()
+    if len(groups) != len(profile_ids):
+        raise BadRequest('One or more profiles not found')
+    if not all(row.group_id == group_id for row in groups):
+        raise BadRequest('All participants must belong to the same group')
+    return profile_ids
+
+def add_chat_participants_statement(chat_id, profile_ids):
+    """
+    Builds an INSERT ... SELECT adding the given profiles that are not yet participants.
+
+    Args:
+        chat_id (str): ID of the chat.
+        profile_ids (set): IDs of the profiles.
+
+    Returns:
+        Insert: The statement.
+    """
+    participant = chat_participants.c
+    missing = select(literal(chat_id), Profile.__table__.c.id).where(
+        Profile.__table__.c.id.in_(profile_ids),
+        ~select(participant.profile_id).where(participant.chat_id == chat_id,
+                                              participant.profile_id == Profile.__table__.c.id).exists())
+    return insert(chat_participants).from_select(['chat_id', 'profile_id'], missing)
+
+def apply_participant_changes(chat_id, add=(), remove=None, keep=None):
+    """
+    Adds and removes chat participants in the current transaction, touching only changed rows.
+
+    Rows of participants that stay are left alone, so their read markers are kept.
+
+    Args:
+        chat_id (str): ID of the chat.
+        add (set): Profiles to add; those already participating are skipped.
+        remove (set, optional): Profiles to remove.
+        keep (set, optional): If given, every participant not in this set is removed.
+
+    Returns:
+        tuple: (number of participants added, number removed).
+
+    Raises:
+        BadRequest: If a concurrent request changed the same participants.
+    """
+    participant = chat_participants.c
+    removed = 0
+    if remove:
+        removed = db.session.execute(delete(chat_participants).where(
+            participant.chat_id == chat_id, participant.profile_id.in_(remove))).rowcount
+    elif keep is not None:
+        removed = db.session.execute(delete(chat_participants).where(
+            participant.chat_id == chat_id, participant.profile_id.notin_(keep))).rowcount
+    added = 0
+    if add:
+        try:
+            added = db.session.execute(add_chat_participants_statement(chat_id, add)).rowcount
+        except IntegrityError:
+            db.session.rollback()
+            raise BadRequest('Participants were changed concurrently, please retry')
+    if added or removed:
+        chat = Chat.__table__.c
+        db.session.execute(update(Chat.__table__).where(chat.id == chat_id).values(updated_at=datetime.utcnow()))
+    return added, removed
+
+def publish_chat_updated(chat_id, group_id):
+    """
+    Notifies the chat's and the group's subscribers that a chat changed.
+
+    Args:
+        chat_id (str): ID of the chat.
+        group_id (str): ID of the chat's group.
+    """
+    event = {'type': 'chat.updated', 'group_id': group_id, 'chat_id': chat_id}
+    publish(chat_channel(chat_id), event)
+    publish(group_channel(group_id), event)
+
+def create_chat(data, group_id, user_id=None):
     """
     Creates a new chat within a group.
 
+    The group row is locked (on Postgres) until the chat is committed, so an
+    asynchronous deletion of the group either waits for the chat, whose rows it
+    then purges, or is seen here and the chat is refused.
+
     Args:
         data (dict): The chat data.
         group_id (str): ID of the group.
+        user_id (str, optional): ID of the creating user, whose profile in the group joins the chat.
 
     Returns:
         Chat: The created chat instance.
+
+    Raises:
+        NotFound: If the group does not exist or is deleted.
     """
-    validate_chat_data(data, group_id)
-    profiles = Profile.query.filter(Profile.id.in_(data.get('participant_ids', []))).all()
+    group = Group.__table__.c
+    if db.session.execute(select(group.id).where(group.id == group_id, group.deleted_at.is_(None))
+                          .with_for_update()).first() is None:
+        db.session.rollback()
+        raise NotFound('Group not found')
+    profile_ids = validate_chat_data(data, group_id)
+    if user_id:
+        creator = db.session.execute(select(Profile.__table__.c.id).where(
+            Profile.__table__.c.user_id == user_id, Profile.__table__.c.group_id == group_id)).scalar()
+        if creator is not None:
+            profile_ids.add(creator)
+    profiles = Profile.query.filter(Profile.id.in_(profile_ids)).all() if profile_ids else []
     new_chat = Chat(name=data['name'], group_id=group_id)
     new_chat.participants = profiles
     db.session.add(new_chat)
     db.session.commit()
+    publish(group_channel(group_id), {'type': 'chat.created', 'group_id': group_id, 'chat_id': new_chat.id})
     return new_chat
 
 def update_chat(chat, data):
     """
     Updates an existing chat's details and participants.
 
+    When `participant_ids` is given, the difference with the current participants
+    is computed in SQL: one DELETE removes the participants not in the list and one
+    INSERT ... SELECT adds the missing ones, so unchanged memberships (and their
+    read markers) are not rewritten. Without it, participants are left unchanged.
+
     Args:
         chat (Chat): The chat to update.
         data (dict): The new chat data.
@@ -206,61 +755,960 @@ def update_chat(chat, data):
     Returns:
         Chat: The updated chat instance.
     """
-    validate_chat_data(data, chat.group_id)
-    profiles = Profile.query.filter(Profile.id.in_(data['participant_ids'])).all()
+    profile_ids = validate_chat_data(data, chat.group_id)
     chat.name = data['name']
-    chat.participants = profiles
+    if 'participant_ids' in data:
+        apply_participant_changes(chat.id, add=profile_ids, keep=profile_ids)
     db.session.commit()
+    publish_chat_updated(chat.id, chat.group_id)
     return chat
 
-def get_user_info(user_id):
+def add_chat_participants(chat_id, profile_ids):
+    """
+    Adds profiles to a chat.
+
+    Args:
+        chat_id (str): ID of the chat.
+        profile_ids (list): IDs of the profiles; current participants are ignored.
+
+    Returns:
+        int: Number of participants added.
+
+    Raises:
+        NotFound: If the chat does not exist.
+        BadRequest: If a profile is missing or belongs to another group.
+    """
+    chat = db.session.execute(select(Chat.group_id).where(Chat.id == chat_id)).first()
+    if chat is None:
+        raise NotFound('Chat not found')
+    profile_ids = validate_participant_ids(profile_ids, chat.group_id)
+    added, _ = apply_participant_changes(chat_id, add=profile_ids)
+    db.session.commit()
+    if added:
+        publish_chat_updated(chat_id, chat.group_id)
+    return added
+
+def remove_chat_participant(chat_id, profile_id):
+    """
+    Removes a profile from a chat.
+
+    Args:
+        chat_id (str): ID of the chat.
+        profile_id (str): ID of the profile.
+
+    Raises:
+        NotFound: If the chat does not exist or the profile is not a participant.
+    """
+    chat = db.session.execute(select(Chat.group_id).where(Chat.id == chat_id)).first()
+    if chat is None:
+        raise NotFound('Chat not found')
+    _, removed = apply_participant_changes(chat_id, remove={profile_id})
+    if not removed:
+        db.session.rollback()
+        raise NotFound('Profile is not a participant of this chat')
+    db.session.commit()
+    publish_chat_updated(chat_id, chat.group_id)
+
+def validate_message_fields(data):
+    """
+    Validates the fields of a message without touching the database.
+
+    Args:
+        data (dict): The message data.
+
+    Raises:
+        BadRequest: If validation fails.
+    """
+    if not isinstance(data, dict):
+        raise BadRequest('Invalid message data')
+    if 'content' not in data or not isinstance(data['content'], str) or not data['content']:
+        raise BadRequest('Invalid message content')
+    if len(data['content']) > 1024:
+        raise BadRequest('Message content is too long')
+    if 'profile_id' not in data or not isinstance(data['profile_id'], str):
+        raise BadRequest('Invalid profile_id')
+
+def validate_message_data(data):
+    """
+    Validates the data for creating a message.
+
+    Args:
+        data (dict): The message data.
+
+    Returns:
+        str: ID of the group the message's chat belongs to.
+
+    Raises:
+        BadRequest: If validation fails.
+    """
+    validate_message_fields(data)
+    if 'chat_id' not in data or not isinstance(data['chat_id'], str):
+        raise BadRequest('Invalid chat_id')
+    chat = db.session.query(Chat.group_id).filter_by(id=data['chat_id']).first()
+    if chat is None:
+        raise BadRequest('Chat not found')
+    profile = db.session.query(Profile.group_id).filter_by(id=data['profile_id']).first()
+    if profile is None:
+        raise BadRequest('Profile not found')
+    if profile.group_id != chat.group_id:
+        # Its messages would keep the profile from being purged with its group
+        raise BadRequest('Profile does not belong to the chat\'s group')
+    return chat.group_id
+
+def insert_messages(rows):
+    """
+    Inserts message rows in bulk in the current transaction and updates the chats' counters.
+
+    Each affected chat's row is first locked and updated by record_chat_activity,
+    which stamps the chat's new rows with their created_at and `seq` in list
+    order. Rows are then sent as one executemany of plain dicts, which
+    SQLAlchemy renders as batched multi-row INSERT statements on Postgres, and
+    each sender's read watermark is moved past its own messages. The caller is
+    responsible for committing.
+
+    Args:
+        rows (List[dict]): Message column values, each with id, content, chat_id and profile_id,
+            in the order to store them.
+    """
+    if not rows:
+        return
+    by_chat = {}
+    for row in rows:
+        by_chat.setdefault(row['chat_id'], []).append(row)
+    # Update chats in a fixed order so concurrent batches cannot deadlock on chat rows
+    for chat_id in sorted(by_chat):
+        record_chat_activity(chat_id, by_chat[chat_id])
+    db.session.execute(insert(Message.__table__), rows)
+    record_sender_reads(rows)
+
+def record_chat_activity(chat_id, rows):
+    """
+    Folds new messages into a chat's activity summary and stamps them in commit order.
+
+    The first UPDATE locks the chat row until the transaction ends, so concurrent
+    writers to the same chat take turns: each one is handed the next sequence
+    numbers and created_at values later than those of every message already
+    stored, and commits before the next one can proceed. Ordering by
+    (created_at, id), by seq and by commit therefore agree, so keyset cursors
+    and read watermarks never pass over a message that commits late.
+
+    Args:
+        chat_id (str): ID of the chat.
+        rows (List[dict]): Column values of the messages, in the order to store them;
+            their created_at and seq are set.
+
+    Returns:
+        int: The chat's new message_count, which is the seq of its newest message.
+    """
+    chat = Chat.__table__.c
+    locked = db.session.execute(update(Chat.__table__).where(chat.id == chat_id).values(
+        message_count=chat.message_count + len(rows),
+        # Message activity is not an edit of the chat itself
+        updated_at=chat.updated_at
+    ).returning(chat.message_count, chat.last_message_at)).one()
+    start = datetime.utcnow()
+    if locked.last_message_at is not None and start <= locked.last_message_at:
+        start = locked.last_message_at + timedelta(microseconds=1)
+    seq = locked.message_count - len(rows)
+    step = timedelta(microseconds=1)
+    for row in rows:
+        seq += 1
+        row['seq'] = seq
+        row['created_at'] = start
+        start += step
+    newest = rows[-1]
+    db.session.execute(update(Chat.__table__).where(chat.id == chat_id).values(
+        last_message_at=newest['created_at'],
+        last_message_preview=newest['content'][:CHAT_PREVIEW_LENGTH],
+        updated_at=chat.updated_at
+    ))
+    return locked.message_count
+
+def record_sender_reads(rows):
+    """
+    Marks newly inserted messages as read by their senders.
+
+    Args:
+        rows (List[dict]): Column values of the inserted messages, including their seq.
+    """
+    newest = {}
+    for row in rows:
+        key = (row['chat_id'], row['profile_id'])
+        if key not in newest or row['seq'] > newest[key]['seq']:
+            newest[key] = row
+    params = [{'p_chat_id': row['chat_id'], 'p_profile_id': row['profile_id'], 'p_seq': row['seq'], 'p_message_id': row['id']}
+              for row in newest.values()]
+    db.session.execute(advance_read_watermark_statement(), params)
+
+def advance_read_watermark_statement():
+    """
+    Builds the UPDATE that moves a participant's read watermark forward.
+
+    The watermark never moves backwards, so an older cursor arriving late (e.g. from
+    a second device) is ignored.
+
+    Returns:
+        Update: Statement with p_chat_id, p_profile_id, p_seq and p_message_id parameters.
+    """
+    participant = chat_participants.c
+    return update(chat_participants).where(
+        participant.chat_id == bindparam('p_chat_id'),
+        participant.profile_id == bindparam('p_profile_id'),
+        participant.last_read_seq < bindparam('p_seq')
+    ).values(last_read_seq=bindparam('p_seq'), last_read_message_id=bindparam('p_message_id'))
+
+def mark_chat_read(chat_id, data):
+    """
+    Moves a profile's read watermark in a chat up to the message a cursor points at.
+
+    Messages are numbered in the same (created_at, id) order cursors follow (see
+    record_chat_activity), so the watermark covers exactly the messages up to the
+    cursor.
+
+    Args:
+        chat_id (str): ID of the chat.
+        data (dict): `profile_id` and `cursor` (a message cursor from the chat's history).
+
+    Returns:
+        dict: The profile's watermark (last_read_message_id, last_read_seq) and unread_count.
+
+    Raises:
+        BadRequest: If the data is invalid, the profile is not a participant or the message is not in the chat.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('profile_id'), str):
+        raise BadRequest('Invalid profile_id')
+    if not isinstance(data.get('cursor'), str):
+        raise BadRequest('Invalid cursor')
+    created_at, message_id = decode_cursor(data['cursor'], datetime, str)
+    participant = chat_participants.c
+    membership = (participant.chat_id == chat_id, participant.profile_id == data['profile_id'])
+    if db.session.query(participant.profile_id).filter(*membership).first() is None:
+        raise BadRequest('Profile is not a participant of this chat')
+    message = db.session.query(Message.id, Message.seq).filter_by(id=message_id, chat_id=chat_id).first()
+    if message is None:
+        raise BadRequest('Message not found')
+    seq = message.seq
+    if seq is None:
+        # Messages stored before sequence numbers existed; repair_read_counters backfills them
+        seq = db.session.query(func.count(Message.id)).filter(
+            Message.chat_id == chat_id, tuple_(Message.created_at, Message.id) <= (created_at, message_id)).scalar()
+    db.session.execute(advance_read_watermark_statement(),
+                       {'p_chat_id': chat_id, 'p_profile_id': data['profile_id'], 'p_seq': seq, 'p_message_id': message.id})
+    db.session.commit()
+    state = db.session.query(participant.last_read_seq, participant.last_read_message_id, Chat.message_count) \
+        .join(Chat, Chat.id == participant.chat_id).filter(*membership).one()
+    return {
+        'chat_id': chat_id,
+        'profile_id': data['profile_id'],
+        'last_read_message_id': state.last_read_message_id,
+        'last_read_seq': state.last_read_seq,
+        'unread_count': unread_count(state.message_count, state.last_read_seq)
+    }
+
+# Fields of group and profile JSON representations that can be selected with `fields=`
+GROUP_FIELDS = GROUP_SCHEMA.names
+PROFILE_FIELDS = PROFILE_SCHEMA.names
+
+def projected_query(model, schema, fields=None, filters=()):
+    """
+    Builds the SELECT behind a projected listing, ordered by primary key.
+
+    Args:
+        model: Mapped class with an `id` primary key.
+        schema (Schema): Schema of the model, whose fields are columns of the model.
+        fields (frozenset, optional): Columns to return; all of the schema's when omitted.
+        filters (Iterable): SQL conditions to apply.
+
+    Returns:
+        tuple: (statement, names of the returned fields).
+    """
+    names = [name for name in schema.names if fields is None or name in fields]
+    # The id is always read since it is the keyset
+    columns = [getattr(model, name) for name in dict.fromkeys(['id'] + names)]
+    return select(*columns).where(*filters).order_by(model.id), names
+
+def list_projected(model, schema, fields=None, filters=(), cursor=None, limit=None):
+    """
+    Lists rows of a model as plain dicts, optionally one keyset page at a time.
+
+    Only the selected columns are read and rows are never turned into ORM objects,
+    so the cost per row does not depend on the model's relationships or the
+    session's identity map. Rows are ordered by primary key, which is also the
+    keyset.
+
+    Args:
+        model: Mapped class with an `id` primary key.
+        schema (Schema): Schema of the model, whose fields are columns of the model.
+        fields (frozenset, optional): Columns to return; all of the schema's when omitted.
+        filters (Iterable): SQL conditions to apply.
+        cursor (str, optional): Cursor returned with the previous page.
+        limit (int, optional): Page size; all matching rows are returned when omitted.
+
+    Returns:
+        dict: The rows as `items`, next_cursor and has_more.
+
+    Raises:
+        BadRequest: If the cursor is malformed.
+    """
+    query, names = projected_query(model, schema, fields, filters)
+    if cursor:
+        query = query.where(model.id > decode_cursor(cursor, str)[0])
+    if limit is None:
+        rows = db.session.execute(query).all()
+        has_more = False
+    else:
+        rows = db.session.execute(query.limit(limit + 1)).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    return {
+        'items': schema.dump_many(rows, names),
+        'next_cursor': encode_cursor(rows[-1].id) if has_more else None,
+        'has_more': has_more
+    }
+
+# How participants are included in chat listings
+PARTICIPANT_MODES = ('ids', 'count', 'none')
+
+# Fields of a chat's JSON representation that can be selected with `fields=`
+CHAT_FIELDS = ('id', 'name', 'created_at', 'updated_at', 'group_id', 'last_message_at', 'message_count',
+               'last_message_preview', 'participant_ids', 'participant_count', 'unread_count')
+
+def participant_mode(participants=None, fields=None):
+    """
+    Decides how participants are selected for a chat response.
+
+    An explicit `participants` mode wins. Otherwise, when fields are selected,
+    participants are only aggregated if participant_ids or participant_count is
+    among them; without either parameter, ids are included as before.
+
+    Args:
+        participants (str, optional): Requested mode, one of PARTICIPANT_MODES.
+        fields (frozenset, optional): Selected fields.
+
+    Returns:
+        str: One of PARTICIPANT_MODES.
+    """
+    if participants is not None:
+        return participants
+    if fields is None or 'participant_ids' in fields:
+        return 'ids'
+    return 'count' if 'participant_count' in fields else 'none'
+
+def chat_select(participants='ids'):
+    """
+    Builds a SELECT of chat columns with participants aggregated in the same statement.
+
+    Participants are read from chat_participants by a correlated subquery per chat
+    (served by its primary key), so no Profile rows are loaded: `ids` aggregates the
+    profile ids into one comma-separated string and `count` only counts them.
+
+    Args:
+        participants (str): One of PARTICIPANT_MODES.
+
+    Returns:
+        Select: Statement over Chat to which filters and ordering can be added.
+
+    Raises:
+        BadRequest: If the participants mode is unknown.
+    """
+    if participants not in PARTICIPANT_MODES:
+        raise BadRequest('Invalid participants')
+    participant = chat_participants.c
+    columns = [Chat.id, Chat.name, Chat.created_at, Chat.updated_at, Chat.group_id,
+               Chat.last_message_at, Chat.message_count, Chat.last_message_preview]
+    if participants == 'ids':
+        columns.append(select(func.aggregate_strings(participant.profile_id, ','))
+                       .where(participant.chat_id == Chat.id).scalar_subquery().label('participant_ids'))
+    elif participants == 'count':
+        columns.append(select(func.count()).where(participant.chat_id == Chat.id)
+                       .scalar_subquery().label('participant_count'))
+    return select(*columns)
+
+def get_chat_participants_page(chat_id, cursor=None, limit=50):
+    """
+    Retrieves a page of a chat's participants ordered by profile id.
+
+    The keyset follows the chat_participants primary key, so each page is an index
+    range scan however many participants the chat has.
+
+    Args:
+        chat_id (str): ID of the chat.
+        cursor (str, optional): Cursor returned with the previous page.
+        limit (int): Maximum number of participants to return.
+
+    Returns:
+        dict: The participants (id, name, picture), next_cursor and has_more.
+
+    Raises:
+        BadRequest: If the cursor is malformed.
+    """
+    participant = chat_participants.c
+    query = select(Profile.id, Profile.name, Profile.picture) \
+        .join(chat_participants, participant.profile_id == Profile.id) \
+        .where(participant.chat_id == chat_id)
+    if cursor:
+        query = query.where(participant.profile_id > decode_cursor(cursor, str)[0])
+    rows = db.session.execute(query.order_by(participant.profile_id).limit(limit + 1)).all()
+    profiles = rows[:limit]
+    has_more = len(rows) > limit
+    return {
+        'participants': [{'id': row.id, 'name': row.name, 'picture': row.picture} for row in profiles],
+        'next_cursor': encode_cursor(profiles[-1].id) if has_more else None,
+        'has_more': has_more
+    }
+
+def group_chats_query(group_id, profile_id=None, sort=None, participants='ids', cursor=None):
+    """
+    Builds the single SELECT listing a group's chats, see list_group_chats.
+
+    Args:
+        group_id (str): ID of the group.
+        profile_id (str, optional): Only chats this profile participates in; rows then carry its last_read_seq.
+        sort (str, optional): None or 'activity'.
+        participants (str): One of PARTICIPANT_MODES.
+        cursor (str, optional): Only chats after this keyset position.
+
+    Returns:
+        Select: The ordered statement.
+
+    Raises:
+        BadRequest: If the sort, participants mode or cursor is invalid.
+    """
+    if sort not in (None, 'activity'):
+        raise BadRequest('Invalid sort')
+    query = chat_select(participants).where(Chat.group_id == group_id)
+    if profile_id:
+        # Aliased so the participants subquery still correlates to the chat only
+        membership = chat_participants.alias('membership')
+        query = query.add_columns(membership.c.last_read_seq).join(
+            membership, and_(membership.c.chat_id == Chat.id, membership.c.profile_id == profile_id))
+    if sort == 'activity':
+        if cursor:
+            query = query.where(tuple_(chat_activity_key, Chat.id) < decode_cursor(cursor, datetime, str))
+        return query.order_by(chat_activity_key.desc(), Chat.id.desc())
+    if cursor:
+        query = query.where(tuple_(Chat.created_at, Chat.id) > decode_cursor(cursor, datetime, str))
+    return query.order_by(Chat.created_at, Chat.id)
+
+def list_group_chats(group_id, profile_id=None, sort=None, participants='ids', cursor=None, limit=None):
+    """
+    Lists a group's chats with a single SELECT, optionally one keyset page at a time.
+
+    Chats are ordered by (created_at, id), or by (recent activity, id) descending
+    when sorting by activity; `cursor` continues after the last chat of the
+    previous page.
+
+    Args:
+        group_id (str): ID of the group.
+        profile_id (str, optional): Only chats this profile participates in; rows then carry its last_read_seq.
+        sort (str, optional): None or 'activity'.
+        participants (str): One of PARTICIPANT_MODES.
+        cursor (str, optional): Cursor returned with the previous page.
+        limit (int, optional): Page size; all chats are returned when omitted.
+
+    Returns:
+        dict: The selected rows, next_cursor, has_more and the listing's version
+        (see chat_listing_version).
+
+    Raises:
+        BadRequest: If the sort, participants mode or cursor is invalid.
+    """
+    query = group_chats_query(group_id, profile_id, sort, participants, cursor)
+    if limit is None:
+        rows = db.session.execute(query).all()
+        return {'chats': rows, 'next_cursor': None, 'has_more': False,
+                'version': chat_listing_version(rows, bool(profile_id))}
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    chats = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = chats[-1]
+        position = (last.last_message_at or last.created_at) if sort == 'activity' else last.created_at
+        next_cursor = encode_cursor(position, last.id)
+    return {'chats': chats, 'next_cursor': next_cursor, 'has_more': len(rows) > limit,
+            'version': chat_listing_version(rows, bool(profile_id))}
+
+def latest(*timestamps):
+    """
+    Picks the most recent of some optional timestamps.
+
+    Args:
+        *timestamps (datetime): Timestamps, any of which may be None.
+
+    Returns:
+        datetime: The most recent one, or None if all are None.
+    """
+    return max((timestamp for timestamp in timestamps if timestamp is not None), default=None)
+
+def group_version(group_id):
+    """
+    Looks up the version of a group's representation.
+
+    Args:
+        group_id (str): ID of the group.
+
+    Returns:
+        tuple: (version, last modified), or None if the group does not exist.
+    """
+    updated_at = db.session.execute(select(Group.updated_at).where(Group.id == group_id)).scalar()
+    return None if updated_at is None else ((updated_at,), updated_at)
+
+def profile_version(profile_id):
+    """
+    Looks up the version of a profile's representation.
+
+    Args:
+        profile_id (str): ID of the profile.
+
+    Returns:
+        tuple: (version, last modified), or None if the profile does not exist.
+    """
+    updated_at = db.session.execute(select(Profile.updated_at).where(Profile.id == profile_id)).scalar()
+    return None if updated_at is None else ((updated_at,), updated_at)
+
+def chat_row_version(row):
+    """
+    Computes the version of a chat's representation from its row.
+
+    Edits and participant changes move updated_at, and messages move the
+    activity counters, so together they change whenever a field of chat_select
+    does.
+
+    Args:
+        row (Row): Row with the chat's updated_at, message_count and last_message_at.
+
+    Returns:
+        tuple: (version, last modified).
+    """
+    return (row.updated_at, row.message_count, row.last_message_at), latest(row.updated_at, row.last_message_at)
+
+def chat_version(chat_id):
+    """
+    Looks up the version of a chat's representation, see chat_row_version.
+
+    Args:
+        chat_id (str): ID of the chat.
+
+    Returns:
+        tuple: (version, last modified), or None if the chat does not exist.
+    """
+    row = db.session.execute(select(Chat.updated_at, Chat.message_count, Chat.last_message_at)
+                             .where(Chat.id == chat_id)).first()
+    return None if row is None else chat_row_version(row)
+
+def chat_history_version(rows):
+    """
+    Computes the version of a chat's whole message history from its rows.
+
+    Equals what chat_messages_version reads from the chat's counters, which are
+    kept in step with the messages by record_chat_activity.
+
+    Args:
+        rows (List[Row]): The chat's messages in chronological order.
+
+    Returns:
+        tuple: (version, last modified).
+    """
+    newest = rows[-1].created_at if rows else None
+    return (len(rows), newest), newest
+
+def chat_messages_version(chat_id):
+    """
+    Looks up the version of a chat's message history from its activity counters.
+
+    Messages are only ever added, and each one moves message_count and
+    last_message_at in the same transaction.
+
+    Args:
+        chat_id (str): ID of the chat.
+
+    Returns:
+        tuple: (version, last modified), or None if the chat does not exist.
+    """
+    row = db.session.execute(select(Chat.message_count, Chat.last_message_at).where(Chat.id == chat_id)).first()
+    if row is None:
+        return None
+    return (row.message_count, row.last_message_at), row.last_message_at
+
+def chat_listing_version(rows, with_reads=False):
+    """
+    Computes the version of a chat listing from the rows it read.
+
+    The row count, the sum of message counts and the latest updated_at and
+    last_message_at change when a listed chat is created, edited, changes
+    participants or receives a message. Listings filtered by profile also
+    carry unread counts, so the profile's read watermarks are summed in; those
+    have no timestamp, so such listings have no last modified time. Empty sums
+    and maxima are None, as in SQL.
+
+    Args:
+        rows (List[Row]): Rows selected by group_chats_query, including the
+            one read past the end of a page.
+        with_reads (bool): Whether the rows carry last_read_seq.
+
+    Returns:
+        tuple: (version, last modified).
+    """
+    def total(values):
+        return sum(values) if rows else None
+
+    def newest(values):
+        return max((value for value in values if value is not None), default=None)
+
+    version = (len(rows), total(row.message_count for row in rows),
+               newest(row.updated_at for row in rows), newest(row.last_message_at for row in rows))
+    if with_reads:
+        return version + (total(row.last_read_seq for row in rows),), None
+    return version, latest(version[2], version[3])
+
+def group_chats_version(group_id, profile_id=None, sort=None, cursor=None, limit=None):
+    """
+    Looks up the version of a chat listing, see list_group_chats and chat_listing_version.
+
+    The same rows are aggregated in SQL, without their participants, so a page
+    costs an index range scan of at most limit + 1 chats.
+
+    Args:
+        group_id (str): ID of the group.
+        profile_id (str, optional): Only chats this profile participates in.
+        sort (str, optional): None or 'activity'.
+        cursor (str, optional): Cursor returned with the previous page.
+        limit (int, optional): Page size; all chats are aggregated when omitted.
+
+    Returns:
+        tuple: (version, last modified).
+
+    Raises:
+        BadRequest: If the sort or cursor is invalid.
+    """
+    query = group_chats_query(group_id, profile_id, sort, 'none', cursor)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    listed = query.subquery()
+    columns = [func.count(), func.sum(listed.c.message_count), func.max(listed.c.updated_at),
+               func.max(listed.c.last_message_at)]
+    if profile_id:
+        columns.append(func.sum(listed.c.last_read_seq))
+    version = tuple(db.session.execute(select(*columns)).one())
+    return version, None if profile_id else latest(version[2], version[3])
+
+def publish_message_created(row, group_id):
+    """
+    Notifies chat and group subscribers that a message was committed.
+
+    Args:
+        row (dict): Column values of the committed message.
+        group_id (str): ID of the group the message's chat belongs to.
+    """
+    event = {
+        'type': 'message.created',
+        'group_id': group_id,
+        'chat_id': row['chat_id'],
+        'id': row['id'],
+        'cursor': encode_cursor(row['created_at'], row['id'])
+    }
+    publish(chat_channel(row['chat_id']), event)
+    publish(group_channel(group_id), event)
+
+def create_message(data):
+    """
+    Creates a new message within a chat and notifies the chat's subscribers.
+
+    When MESSAGE_WRITE_BUFFER is enabled the row is handed to the application's
+    MessageWriteBuffer and committed together with other concurrent messages; the
+    call still returns only once the message is durably stored.
+
+    Args:
+        data (dict): The message data.
+
+    Returns:
+        Message: The created message (not attached to the session).
+    """
+    group_id = validate_message_data(data)
+    row = {
+        'id': str(uuid.uuid4()),
+        'content': data['content'],
+        'chat_id': data['chat_id'],
+        'profile_id': data['profile_id']
+    }
+    if current_app.config.get('MESSAGE_WRITE_BUFFER'):
+        # End the read-only validation transaction so no connection is held while waiting
+        db.session.rollback()
+        current_app.extensions['message_write_buffer'].write(row, group_id)
+    else:
+        insert_messages([row])
+        db.session.commit()
+        publish_message_created(row, group_id)
+    return Message(**row)
+
+def create_messages_batch(chat_id, items):
+    """
+    Validates and stores many messages of one chat in a single transaction.
+
+    Senders must be participants of the chat; membership of every distinct
+    profile_id is checked with one query. Valid items are inserted in bulk and
+    invalid ones are reported individually without failing the rest. Stored
+    messages are numbered in input order, so history order matches it.
+
+    Args:
+        chat_id (str): ID of the chat.
+        items (List[dict]): Message data with content and profile_id.
+
+    Returns:
+        List[dict]: One result per item, in input order, with either `id` or `error`.
+
+    Raises:
+        NotFound: If the chat does not exist.
+    """
+    chat = db.session.query(Chat.group_id).filter_by(id=chat_id).first()
+    if chat is None:
+        raise NotFound('Chat not found')
+
+    results = []
+    candidates = []
+    for index, item in enumerate(items):
+        try:
+            validate_message_fields(item)
+            if item.get('chat_id', chat_id) != chat_id:
+                raise BadRequest('chat_id does not match the URL')
+        except BadRequest as e:
+            results.append({'index': index, 'error': e.description})
+            continue
+        results.append(None)
+        candidates.append((index, item))
+
+    profile_ids = {item['profile_id'] for _, item in candidates}
+    members = set()
+    if profile_ids:
+        members = {row.profile_id for row in db.session.query(chat_participants.c.profile_id).filter(
+            chat_participants.c.chat_id == chat_id, chat_participants.c.profile_id.in_(profile_ids))}
+
+    rows = []
+    for index, item in candidates:
+        if item['profile_id'] not in members:
+            results[index] = {'index': index, 'error': 'Profile is not a participant of this chat'}
+            continue
+        # created_at and seq are stamped under the chat lock by insert_messages
+        row = {
+            'id': str(uuid.uuid4()),
+            'content': item['content'],
+            'chat_id': chat_id,
+            'profile_id': item['profile_id']
+        }
+        rows.append(row)
+        results[index] = {'index': index, 'id': row['id']}
+
+    if rows:
+        insert_messages(rows)
+        db.session.commit()
+        # Subscribers re-read by cursor, so one notification covers the whole batch
+        publish_message_created(rows[-1], chat.group_id)
+    return results
+
+# Sections of the /users/me document that can be selected with `include=`
+USER_SECTIONS = ('profiles', 'groups', 'chats')
+
+# Fields of the profiles section of the /users/me document
+USER_PROFILE_FIELDS = ('id', 'name', 'group_id')
+
+# Fields of the /users/me document that can be selected with `fields=`; section
+# fields are qualified with the section name
+USER_FIELDS = USER_SCHEMA.names \
+    + tuple(f'profiles.{field}' for field in USER_PROFILE_FIELDS) \
+    + tuple(f'groups.{field}' for field in GROUP_FIELDS) \
+    + tuple(f'chats.{field}' for field in CHAT_FIELDS if field != 'unread_count')
+
+def section_fields(fields, section):
+    """
+    Extracts the fields selected for one section of the /users/me document.
+
+    Args:
+        fields (frozenset, optional): Fields parsed from the `fields` parameter.
+        section (str): Section name, or None for the top-level user fields.
+
+    Returns:
+        frozenset: Unqualified field names, or None if the section's fields were not restricted.
+    """
+    if fields is None:
+        return None
+    if section is None:
+        selected = frozenset(field for field in fields if '.' not in field)
+    else:
+        prefix = section + '.'
+        selected = frozenset(field[len(prefix):] for field in fields if field.startswith(prefix))
+    return selected or None
+
+def get_user_info(user_id, include=USER_SECTIONS, fields=None, chats_cursor=None, chats_limit=None):
     """
     Retrieves comprehensive information about a user, including profiles, groups, and chats.
 
+    Runs at most three queries whatever the user's footprint: the user, the user's
+    profiles (joined with their groups when groups are included), and the chats of
+    those groups with participants aggregated (see chat_select). Sections that are
+    not included are not queried, chat participants are only aggregated when their
+    fields are selected, and chats can be read one keyset page at a time in
+    (created_at, id) order.
+
     Args:
         user_id (str): ID of the user.
+        include (Iterable[str]): Sections to include, from USER_SECTIONS.
+        fields (frozenset, optional): Fields to include, from USER_FIELDS; a section
+            without selected fields is returned whole.
+        chats_cursor (str, optional): Cursor returned as chats_next_cursor by the previous page.
+        chats_limit (int, optional): Page size for chats; all chats are returned when omitted.
 
     Returns:
         dict: User information.
 
     Raises:
-        BadRequest: If user is not found.
+        BadRequest: If user is not found or the chats cursor is malformed.
     """
-    user = User.query.get(user_id)
+    user = db.session.execute(select(User.id, User.email).where(User.id == user_id)).first()
     if not user:
         raise BadRequest("User not found")
-    
-    profiles = Profile.query.filter_by(user_id=user_id).all()
-    
-    groups = []
-    group_ids = []
-    for profile in profiles:
-        group = Group.query.get(profile.group_id)
-        if group:
-            groups.append({
-                'id': str(group.id),
-                'name': group.name,
-                'picture': group.picture,
-                'max_profiles': group.max_profiles
-            })
-            group_ids.append(group.id)
-    
-    chats = Chat.query.filter(Chat.group_id.in_(group_ids)).all()
-    chats_data = [{
-        'id': str(chat.id),
-        'name': chat.name,
-        'created_at': chat.created_at.isoformat(),
-        'updated_at': chat.updated_at.isoformat(),
-        'group_id': str(chat.group_id),
-        'participant_ids': [str(profile.id) for profile in chat.participants]
-    } for chat in chats]
-    
-    user_info = {
-        'id': str(user.id),
-        'email': user.email,
-        'profiles': [{'id': str(p.id), 'name': p.name, 'group_id': str(p.group_id)} for p in profiles],
-        'groups': groups,  
-        'chats': chats_data  
-    }
-    
+    user_info = USER_SCHEMA.dump(user, section_fields(fields, None))
+
+    if 'profiles' in include or 'groups' in include:
+        # Ordered by group, which the (user_id, group_id) index returns without sorting
+        query = select(Profile.id, Profile.name, Profile.group_id).where(Profile.user_id == user_id).order_by(Profile.group_id)
+        if 'groups' in include:
+            query = query.add_columns(Group.id.label('group_exists'), Group.name.label('group_name'),
+                                      Group.picture.label('group_picture'), Group.max_profiles.label('group_max_profiles'),
+                                      Group.profile_count.label('group_profile_count')) \
+                .outerjoin(Group, Group.id == Profile.group_id)
+        profiles = db.session.execute(query).all()
+        if 'profiles' in include:
+            selected = section_fields(fields, 'profiles') or USER_PROFILE_FIELDS
+            user_info['profiles'] = PROFILE_SCHEMA.dump_many(profiles, selected)
+        if 'groups' in include:
+            groups = {}
+            for profile in profiles:
+                if profile.group_exists and profile.group_id not in groups:
+                    groups[profile.group_id] = profile
+            user_info['groups'] = USER_GROUP_SCHEMA.dump_many(groups.values(), section_fields(fields, 'groups'))
+
+    if 'chats' in include:
+        selected = section_fields(fields, 'chats')
+        participants = participant_mode(None, selected)
+        user_groups = select(Profile.group_id).where(Profile.user_id == user_id)
+        query = chat_select(participants).where(Chat.group_id.in_(user_groups))
+        if chats_cursor:
+            query = query.where(tuple_(Chat.created_at, Chat.id) > decode_cursor(chats_cursor, datetime, str))
+        query = query.order_by(Chat.created_at, Chat.id)
+        if chats_limit is None:
+            chats = db.session.execute(query).all()
+        else:
+            rows = db.session.execute(query.limit(chats_limit + 1)).all()
+            chats = rows[:chats_limit]
+            has_more = len(rows) > chats_limit
+            user_info['chats_next_cursor'] = encode_cursor(chats[-1].created_at, chats[-1].id) if has_more else None
+            user_info['chats_has_more'] = has_more
+        user_info['chats'] = serialize_chats(chats, participants, selected)
+
     return user_info
+
+def message_cursor(message):
+    """
+    Builds the keyset cursor pointing at a message.
+
+    Args:
+        message (Message): The message.
+
+    Returns:
+        str: Opaque cursor encoding (created_at, id).
+    """
+    return encode_cursor(message.created_at, message.id)
+
+def chat_history_query(chat_id):
+    """
+    Builds the SELECT of a chat's whole history in chronological order, as plain rows.
+
+    Args:
+        chat_id (str): ID of the chat.
+
+    Returns:
+        Select: Statement whose rows can be passed to serialize_message.
+    """
+    return select(Message.id, Message.content, Message.created_at, Message.chat_id, Message.profile_id) \
+        .where(Message.chat_id == chat_id).order_by(Message.created_at, Message.id)
+
+def chat_transcript_query(chat_id):
+    """
+    Builds the SELECT of a chat's transcript: its messages with their senders' names.
+
+    Args:
+        chat_id (str): ID of the chat.
+
+    Returns:
+        Select: Statement whose rows can be passed to serialize_transcript_entry.
+    """
+    return select(Message.id, Message.seq, Message.created_at, Message.profile_id,
+                  Profile.name.label('profile_name'), Message.content) \
+        .outerjoin(Profile, Profile.id == Message.profile_id) \
+        .where(Message.chat_id == chat_id).order_by(Message.created_at, Message.id)
+
+def get_messages_page(chat_id, after=None, before=None, limit=50):
+    """
+    Retrieves a bounded page of a chat's messages using a (created_at, id) keyset.
+
+    With `after`, returns the oldest messages newer than the cursor (used for polling).
+    With `before`, returns the newest messages older than the cursor (used for scrolling back).
+    With neither, returns the most recent messages. Messages are always in chronological order.
+
+    Args:
+        chat_id (str): ID of the chat.
+        after (str, optional): Cursor to read forward from.
+        before (str, optional): Cursor to read backward from.
+        limit (int): Maximum number of messages to return.
+
+    Returns:
+        dict: The messages plus next/prev cursors and a has_more flag.
+
+    Raises:
+        BadRequest: If both cursors are given or a cursor is malformed.
+    """
+    if after and before:
+        raise BadRequest('Use either after or before, not both')
+    key = tuple_(Message.created_at, Message.id)
+    query = Message.query.filter(Message.chat_id == chat_id)
+    if after:
+        query = query.filter(key > decode_cursor(after, datetime, str))
+        rows = query.order_by(Message.created_at, Message.id).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        messages = rows[:limit]
+    else:
+        if before:
+            query = query.filter(key < decode_cursor(before, datetime, str))
+        rows = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        messages = list(reversed(rows[:limit]))
+
+    if messages:
+        next_cursor = message_cursor(messages[-1])
+        prev_cursor = message_cursor(messages[0]) if after or has_more else None
+    else:
+        # Keep the caller's position so an empty poll can be repeated with the same cursor
+        next_cursor = after
+        prev_cursor = None
+    return {
+        'messages': messages,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+        'has_more': has_more
+    }
+
+def latest_message_cursor(chat_id):
+    """
+    Returns the cursor of the newest message in a chat.
+
+    Args:
+        chat_id (str): ID of the chat.
+
+    Returns:
+        str: Cursor of the newest message, or a cursor preceding every message if the chat is empty.
+    """
+    latest = db.session.query(Message.created_at, Message.id).filter(Message.chat_id == chat_id) \
+        .order_by(Message.created_at.desc(), Message.id.desc()).first()
+    if latest is None:
+        return encode_cursor(datetime.min, '')
+    return encode_cursor(latest.created_at, latest.id)
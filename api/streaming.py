@@ -0,0 +1,122 @@
+from flask import Response, request, stream_with_context
+from werkzeug.exceptions import BadRequest
+from models import db
+from serializers import dumps
+
+# Streaming formats selectable with the `stream` query parameter
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson'
+}
+
+def stream_format():
+    """
+    Returns the streaming format requested with the `stream` query parameter.
+
+    Returns:
+        str: 'json' or 'ndjson', or None if the response should not be streamed.
+
+    Raises:
+        BadRequest: If the format is unknown or combined with pagination parameters.
+    """
+    fmt = request.args.get('stream')
+    if fmt is None:
+        return None
+    if fmt not in STREAM_FORMATS:
+        raise BadRequest('Invalid stream format')
+    if any(name in request.args for name in ('limit', 'cursor', 'after', 'before')):
+        raise BadRequest('Streamed listings cannot be paginated')
+    return fmt
+
+def iter_partitions(statement, batch_size):
+    """
+    Executes a statement with a server-side cursor and yields its rows in batches.
+
+    With `yield_per`, SQLAlchemy streams results from the database (a named cursor
+    on Postgres) and buffers at most one batch of rows at a time, without adding
+    them to the session's identity map.
+
+    Args:
+        statement (Select): The statement to run.
+        batch_size (int): Number of rows fetched per round trip.
+
+    Yields:
+        List[Row]: Consecutive batches of rows.
+    """
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+def encode_json_array(partitions, serialize):
+    """
+    Incrementally encodes rows as a JSON array, one chunk per batch.
+
+    Args:
+        partitions (Iterable[List]): Batches of rows.
+        serialize (callable): Converts a row into a JSON-serializable value.
+
+    Yields:
+        str: Chunks of the JSON document.
+    """
+    yield '['
+    separator = ''
+    for rows in partitions:
+        if rows:
+            # One encoder call per batch; the array brackets are dropped to join batches
+            yield separator + dumps([serialize(row) for row in rows])[1:-1]
+            separator = ','
+    yield ']'
+
+def encode_ndjson(partitions, serialize):
+    """
+    Incrementally encodes rows as newline-delimited JSON, one chunk per batch.
+
+    Args:
+        partitions (Iterable[List]): Batches of rows.
+        serialize (callable): Converts a row into a JSON-serializable value.
+
+    Yields:
+        str: Chunks of NDJSON, each ending with a newline.
+    """
+    for rows in partitions:
+        yield ''.join(dumps(serialize(row)) + '\n' for row in rows)
+
+def streaming_response(chunks, fmt, filename=None):
+    """
+    Wraps encoded chunks in a streamed response.
+
+    Args:
+        chunks (Iterable[str]): Encoded body chunks.
+        fmt (str): 'json' or 'ndjson'.
+        filename (str, optional): Serve as a download with this file name.
+
+    Returns:
+        Response: The streamed response.
+    """
+    response = Response(stream_with_context(chunks), mimetype=STREAM_FORMATS[fmt])
+    # Let each batch reach the client instead of being buffered by a proxy
+    response.headers['X-Accel-Buffering'] = 'no'
+    if filename:
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def stream_listing(statement, serialize, fmt, batch_size):
+    """
+    Streams the rows of a listing statement as a JSON array or NDJSON.
+
+    Peak memory is bounded by batch_size rows whatever the size of the listing.
+
+    Args:
+        statement (Select): The listing statement.
+        serialize (callable): Converts a row into a JSON-serializable value.
+        fmt (str): 'json' or 'ndjson'.
+        batch_size (int): Number of rows fetched and encoded at a time.
+
+    Returns:
+        Response: The streamed response.
+    """
+    encode = encode_json_array if fmt == 'json' else encode_ndjson
+    return streaming_response(encode(iter_partitions(statement, batch_size), serialize), fmt)
@@ -1,6 +1,7 @@
+import os
 import pytest
 from app import create_app
-from models import db, User, Group, Profile
+from models import db, User, Group, Profile, Chat, GroupDeletion
 
 @pytest.fixture
 def client():
@@ -61,6 +62,81 @@ def test_login(client):
     assert response.status_code == 200
     assert 'token' in response.get_json()
 
+def test_login_rehashes_outdated_password(tmp_path):
+    """
+    Test that logging in upgrades a hash made with another method or cost, in the hashing pool.
+    """
+    from werkzeug.security import generate_password_hash
+    app = create_file_app(tmp_path, PASSWORD_HASH_METHOD='pbkdf2:sha256:2000', PASSWORD_HASH_WORKERS=1)
+    with app.app_context():
+        user = User(email='test@example.com', password='Password1')
+        user.password = generate_password_hash('Password1', method='pbkdf2:sha256:1000')
+        db.session.add(user)
+        db.session.commit()
+    client = app.test_client()
+    assert client.post('/login', json={'email': 'test@example.com', 'password': 'Wrong1pass'}).status_code == 401
+    with app.app_context():
+        assert User.query.one().password.startswith('pbkdf2:sha256:1000$')
+
+    assert client.post('/login', json={'email': 'test@example.com', 'password': 'Password1'}).status_code == 200
+    with app.app_context():
+        assert User.query.one().password.startswith('pbkdf2:sha256:2000$')
+    assert client.post('/login', json={'email': 'test@example.com', 'password': 'Password1'}).status_code == 200
+
+    client.post('/register', json={'email': 'new@example.com', 'password': 'Password1'})
+    with app.app_context():
+        assert User.query.filter_by(email='new@example.com').one().password.startswith('pbkdf2:sha256:2000$')
+
+def test_password_hashing_sheds_load_past_queue_deadline(tmp_path):
+    """
+    Test that hashing jobs not started within the queue deadline fail with 503 instead of queueing.
+    """
+    app = create_file_app(tmp_path, PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_DEADLINE_SECONDS=0)
+    client = app.test_client()
+    response = client.post('/register', json={'email': 'test@example.com', 'password': 'Password1'})
+    assert response.status_code == 503
+    assert response.get_json() == {'message': 'Server is busy, please retry'}
+    with app.app_context():
+        assert User.query.count() == 0
+
+def test_login_rate_limited_before_lookup(tmp_path):
+    """
+    Test that logins over the per-email limit get a 429 with Retry-After without touching the user table.
+    """
+    app = create_file_app(tmp_path, LOGIN_RATE_LIMIT_PER_EMAIL='2/60')
+    client = app.test_client()
+    client.post('/register', json={'email': 'test@example.com', 'password': 'Password1'})
+    for _ in range(2):
+        assert client.post('/login', json={'email': 'test@example.com', 'password': 'Wrong1pass'}).status_code == 401
+    with QueryCounter(app) as counter:
+        response = client.post('/login', json={'email': ' Test@Example.com', 'password': 'Password1'})
+    assert response.status_code == 429
+    assert response.get_json() == {'message': 'Too many attempts, please retry later'}
+    assert 0 < int(response.headers['Retry-After']) <= 30
+    assert counter.statements == []
+
+    client.post('/register', json={'email': 'other@example.com', 'password': 'Password1'})
+    assert client.post('/login', json={'email': 'other@example.com', 'password': 'Password1'}).status_code == 200
+
+def test_rate_limit_stores(tmp_path):
+    """
+    Test that database buckets are shared by applications on one database and that memory buckets expire.
+    """
+    from ratelimit import MemoryRateLimitStore
+    config = {'RATE_LIMIT_BACKEND': 'database', 'REGISTER_RATE_LIMIT_PER_IP': '3/3600'}
+    first = create_file_app(tmp_path, **config)
+    second = create_file_app(tmp_path, **config)
+    statuses = [app.test_client().post('/register', json={'email': f'user{i}@example.com', 'password': 'Password1'}).status_code
+                for i, app in enumerate([first, second, first, second])]
+    assert statuses == [201, 201, 201, 429]
+
+    store = MemoryRateLimitStore(max_entries=2)
+    assert store.take('a', 1, 1000.0) == 0
+    assert store.take('a', 1, 1000.0) > 0
+    store.take('b', 1, 0.001)
+    store.take('c', 1, 0.001)
+    assert list(store._buckets) == ['b', 'c']
+
 def test_create_group(client):
     """
     Test creating a new group.
@@ -547,3 +623,1493 @@ def test_get_user_info_multiple_profiles(client):
     assert len(data['profiles']) == 2
     assert len(data['groups']) == 2
     assert len(data['chats']) == 4
+
+def setup_chat(client, token, group_name='Test Group', profile_name='Profile 1'):
+    """
+    Creates a group, a profile for the authenticated user and a chat containing that profile.
+
+    Args:
+        client: The test client.
+        token (str): JWT token.
+        group_name (str): Name of the group to create.
+        profile_name (str): Name of the profile to create.
+
+    Returns:
+        tuple: (group_id, profile_id, chat_id)
+    """
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id = client.post('/groups', json={'name': group_name, 'picture': 'http://example.com/pic.jpg', 'max_profiles': 5},
+                           headers=headers).get_json()['id']
+    profile_id = client.post('/profiles', json={'name': profile_name, 'picture': 'http://example.com/pic1.jpg', 'bio': 'Bio 1', 'group_id': group_id},
+                             headers=headers).get_json()['id']
+    chat_id = client.post(f'/groups/{group_id}/chats', json={'name': 'Test Chat', 'participant_ids': [profile_id]},
+                          headers=headers).get_json()['id']
+    return group_id, profile_id, chat_id
+
+def test_get_messages_keyset_pagination(client):
+    """
+    Test paging through a chat's messages with limit, before and after cursors.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for i in range(5):
+        client.post('/messages', json={'content': f'Message {i}', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    full_history = [m['id'] for m in client.get(f'/chats/{chat_id}/messages', headers=headers).get_json()]
+    assert len(full_history) == 5
+
+    latest = client.get(f'/chats/{chat_id}/messages?limit=2', headers=headers).get_json()
+    assert [m['id'] for m in latest['messages']] == full_history[3:]
+    assert latest['has_more'] is True
+
+    older = client.get(f'/chats/{chat_id}/messages?limit=2&before={latest["prev_cursor"]}', headers=headers).get_json()
+    assert [m['id'] for m in older['messages']] == full_history[1:3]
+
+    newer = client.get(f'/chats/{chat_id}/messages?limit=10&after={older["next_cursor"]}', headers=headers).get_json()
+    assert [m['id'] for m in newer['messages']] == full_history[3:]
+    assert newer['has_more'] is False
+
+    # Polling past the end returns nothing and keeps the cursor
+    empty = client.get(f'/chats/{chat_id}/messages?after={newer["next_cursor"]}', headers=headers).get_json()
+    assert empty['messages'] == []
+    assert empty['next_cursor'] == newer['next_cursor']
+
+def test_late_commit_stays_ahead_of_cursor(client):
+    """
+    Test that a message stamped before one already delivered, but committed after it,
+    is stored after the live cursor and numbered in commit order.
+    """
+    import uuid
+    from datetime import datetime, timedelta
+    from models import Message
+    from services import insert_messages
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    client.post('/messages', json={'content': 'First', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    cursor = client.get(f'/chats/{chat_id}/messages?limit=1', headers=headers).get_json()['next_cursor']
+    with client.application.app_context():
+        # Stamped by its request before 'First' was, but only now reaching the database
+        late = {'id': str(uuid.uuid4()), 'content': 'Late', 'created_at': datetime.utcnow() - timedelta(seconds=5),
+                'chat_id': chat_id, 'profile_id': profile_id}
+        insert_messages([late])
+        db.session.commit()
+        assert [(m.content, m.seq) for m in Message.query.order_by(Message.created_at, Message.id)] == [('First', 1), ('Late', 2)]
+    newer = client.get(f'/chats/{chat_id}/messages?after={cursor}', headers=headers).get_json()
+    assert [m['content'] for m in newer['messages']] == ['Late']
+
+def test_serializers_rows_objects_and_backends(client, monkeypatch):
+    """
+    Test that schemas give the same JSON for ORM objects and rows, and that both JSON backends agree.
+    """
+    import json
+    from datetime import datetime
+    from flask.json.provider import DefaultJSONProvider
+    import serializers
+    from models import Message
+    from services import chat_history_query
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    client.post('/messages', json={'content': 'Héllo "world"', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    with client.application.app_context():
+        message = Message.query.one()
+        row = db.session.execute(chat_history_query(chat_id)).one()
+        expected = {'id': message.id, 'content': 'Héllo "world"', 'created_at': message.created_at.isoformat(),
+                    'chat_id': chat_id, 'profile_id': profile_id}
+        assert serializers.MESSAGE_SCHEMA.dump(message) == serializers.MESSAGE_SCHEMA.dump(row) == expected
+        assert serializers.MESSAGE_SCHEMA.dump_many([row]) == serializers.MESSAGE_SCHEMA.dump_many([message]) == [expected]
+        assert serializers.MESSAGE_SCHEMA.dump_many([row], fields={'id', 'content'}) == [{'id': message.id, 'content': 'Héllo "world"'}]
+    assert client.get(f'/chats/{chat_id}/messages', headers=headers).get_json() == [expected]
+
+    document = {'b': [expected, None, 1.5], 'a': datetime(2024, 1, 2, 3, 4, 5)}
+    reference = DefaultJSONProvider(client.application).dumps(document)
+    encoded = {}
+    for backend in (serializers.orjson, None):
+        monkeypatch.setattr(serializers, 'orjson', backend)
+        body = client.application.json.dumps(document)
+        assert body.startswith('{"a":') and json.loads(body) == json.loads(reference)
+        assert client.application.json.loads(body) == json.loads(reference)
+        encoded[backend is None] = serializers.loads(serializers.dumps(expected))
+    assert encoded[False] == encoded[True] == expected
+
+def test_get_messages_invalid_pagination(client):
+    """
+    Test that malformed cursors and limits are rejected.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    assert client.get(f'/chats/{chat_id}/messages?after=not-a-cursor', headers=headers).status_code == 400
+    assert client.get(f'/chats/{chat_id}/messages?limit=0', headers=headers).status_code == 400
+    assert client.get(f'/chats/{chat_id}/messages?limit=abc', headers=headers).status_code == 400
+
+def read_sse_events(response, count, max_chunks=50):
+    """
+    Reads chunks from a streaming SSE response until `count` message events arrived.
+
+    Args:
+        response: Streaming test response.
+        count (int): Number of message events to collect.
+        max_chunks (int): Safety bound on the number of chunks read.
+
+    Returns:
+        list: (event id, data dict) tuples.
+    """
+    import json
+    events = []
+    chunks = iter(response.response)
+    for _ in range(max_chunks):
+        if len(events) >= count:
+            break
+        chunk = next(chunks)
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if 'event: message' in chunk:
+            fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+            events.append((fields['id'], json.loads(fields['data'])))
+    return events
+
+def test_stream_messages_resume_and_live(client):
+    """
+    Test that the SSE stream replays messages after Last-Event-ID and pushes new ones.
+    """
+    client.application.config['SSE_HEARTBEAT_SECONDS'] = 0.05
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    client.post('/messages', json={'content': 'Message 0', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    resume_cursor = client.get(f'/chats/{chat_id}/messages?limit=1', headers=headers).get_json()['next_cursor']
+    ids = [client.post('/messages', json={'content': f'Message {i}', 'chat_id': chat_id, 'profile_id': profile_id},
+                       headers=headers).get_json()['id'] for i in (1, 2)]
+
+    response = client.get(f'/chats/{chat_id}/stream?jwt={token}', headers={'Last-Event-ID': resume_cursor})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    replayed = read_sse_events(response, 2)
+    assert sorted(data['id'] for _, data in replayed) == sorted(ids)
+
+    # The stream keeps its request context pushed on this thread, so send from another one
+    import threading
+    sender = threading.Thread(target=lambda: client.application.test_client().post(
+        '/messages', json={'content': 'Live', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers))
+    sender.start()
+    sender.join()
+    live = read_sse_events(response, 1)
+    assert live[0][1]['content'] == 'Live'
+    response.close()
+
+def test_stream_messages_requires_auth(client):
+    """
+    Test that the SSE stream rejects unauthenticated clients.
+    """
+    response = client.get('/chats/some-chat/stream')
+    assert response.status_code == 401
+
+def test_broker_publishes_group_and_chat_events(client):
+    """
+    Test that chat, profile and message writes publish events on the group and chat channels.
+    """
+    from broker import group_channel, chat_channel
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id = client.post('/groups', json={'name': 'Test Group', 'picture': 'http://example.com/pic.jpg', 'max_profiles': 5},
+                           headers=headers).get_json()['id']
+    broker = client.application.extensions['broker']
+    group_events = broker.subscribe([group_channel(group_id)])
+
+    profile_id = client.post('/profiles', json={'name': 'Profile 1', 'picture': 'http://example.com/pic1.jpg', 'bio': 'Bio 1', 'group_id': group_id},
+                             headers=headers).get_json()['id']
+    chat_id = client.post(f'/groups/{group_id}/chats', json={'name': 'Test Chat', 'participant_ids': [profile_id]},
+                          headers=headers).get_json()['id']
+    chat_events = broker.subscribe([chat_channel(chat_id)])
+    client.put(f'/chats/{chat_id}', json={'name': 'Renamed', 'participant_ids': [profile_id]}, headers=headers)
+    client.post('/messages', json={'content': 'Hello', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+
+    received = [group_events.get(timeout=1)[1]['type'] for _ in range(4)]
+    assert received == ['profile.created', 'chat.created', 'chat.updated', 'message.created']
+    assert [chat_events.get(timeout=1)[1]['type'] for _ in range(2)] == ['chat.updated', 'message.created']
+    assert group_events.get(timeout=0.01) is None
+    group_events.close()
+    chat_events.close()
+
+def test_in_process_broker_bounded_queue():
+    """
+    Test that a slow subscriber overflows instead of growing without bound.
+    """
+    from broker import InProcessBroker
+    broker = InProcessBroker(queue_size=2)
+    subscription = broker.subscribe(['chat:1'])
+    for i in range(5):
+        broker.publish('chat:1', {'n': i})
+    broker.publish('chat:2', {'n': 'other'})
+    assert subscription.overflowed
+    assert [subscription.get(timeout=0)[1]['n'] for _ in range(2)] == [0, 1]
+    assert subscription.get(timeout=0) is None
+    subscription.close()
+    broker.publish('chat:1', {'n': 'after close'})
+    assert subscription.get(timeout=0) is None
+
+@pytest.mark.skipif(not os.getenv('TEST_POSTGRES_URL'), reason='TEST_POSTGRES_URL not set')
+def test_postgres_broker_delivers_across_brokers():
+    """
+    Test that LISTEN/NOTIFY delivers events between two independent broker instances.
+    """
+    from broker import PostgresBroker
+    publisher = PostgresBroker(os.getenv('TEST_POSTGRES_URL'))
+    listener = PostgresBroker(os.getenv('TEST_POSTGRES_URL'))
+    subscription = listener.subscribe(['chat:pg-test'])
+    event = None
+    # LISTEN is issued asynchronously by the listener thread; publish until it is in place
+    for _ in range(50):
+        publisher.publish('chat:pg-test', {'type': 'ping'})
+        event = subscription.get(timeout=0.1)
+        if event:
+            break
+    assert event == ('chat:pg-test', {'type': 'ping'})
+    subscription.close()
+
+class FakeWebSocket:
+    """
+    In-memory stand-in for a server WebSocket connection.
+    """
+    def __init__(self):
+        import queue
+        self.inbox = queue.Queue()
+        self.outbox = queue.Queue()
+        self.close_reason = None
+
+    def receive(self, timeout=None):
+        import queue
+        from simple_websocket import ConnectionClosed
+        try:
+            data = self.inbox.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if data is None:
+            raise ConnectionClosed()
+        return data
+
+    def send(self, data):
+        import json
+        self.outbox.put(json.loads(data))
+
+    def close(self, reason=None, message=None):
+        self.close_reason = reason
+
+    def frames_until(self, frame_type, timeout=2):
+        frames = []
+        while True:
+            frame = self.outbox.get(timeout=timeout)
+            frames.append(frame)
+            if frame['type'] == frame_type:
+                return frames
+
+def test_gateway_join_send_and_receive(tmp_path):
+    """
+    Test that a gateway session acks sends with the persisted message and pushes messages of joined chats.
+    """
+    import json
+    import threading
+    from gateway import GatewaySession
+    app = create_file_app(tmp_path)
+    client = app.test_client()
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    ws = FakeWebSocket()
+
+    def serve():
+        with app.app_context():
+            GatewaySession(ws, app, app.extensions['broker'], heartbeat=0.05).run()
+    session_thread = threading.Thread(target=serve)
+    session_thread.start()
+
+    ws.inbox.put(json.dumps({'type': 'join', 'chat_id': chat_id, 'after': 'not-a-cursor', 'ref': 'j0'}))
+    error = ws.frames_until('error')[-1]
+    assert (error['ref'], error['message']) == ('j0', 'Invalid cursor')
+    ws.inbox.put(json.dumps({'type': 'join', 'chat_id': chat_id, 'ref': 'j1'}))
+    joined = ws.frames_until('joined')[-1]
+    # The rejected join did not subscribe, so this one starts from the latest message
+    assert (joined['chat_id'], joined['cursor']) == (chat_id, None)
+    ws.inbox.put(json.dumps({'type': 'send', 'ref': 's1', 'chat_id': chat_id, 'profile_id': profile_id, 'content': 'Over the socket'}))
+    frames = ws.frames_until('ack')
+    ack = frames[-1]
+    assert ack['ref'] == 's1'
+    stored = app.test_client().get(f'/chats/{chat_id}/messages', headers=headers).get_json()
+    assert [m['id'] for m in stored] == [ack['id']]
+    assert stored[0]['created_at'] == ack['created_at']
+
+    # Joined chats receive messages sent by anyone, including the socket's own sends
+    pushed = [f for f in frames + ws.frames_until('message') if f['type'] == 'message']
+    assert pushed[0]['message']['content'] == 'Over the socket'
+
+    ws.inbox.put(json.dumps({'type': 'send', 'ref': 's2', 'chat_id': chat_id, 'profile_id': profile_id, 'content': ''}))
+    error = ws.frames_until('error')[-1]
+    assert error['ref'] == 's2'
+    assert error['message'] == 'Invalid message content'
+
+    ws.inbox.put(None)
+    session_thread.join(timeout=5)
+    assert not session_thread.is_alive()
+
+def test_gateway_closes_slow_consumer(client):
+    """
+    Test that a client that stops reading is disconnected instead of growing the send queue.
+    """
+    from gateway import GatewaySession, CLOSE_POLICY_VIOLATION
+    ws = FakeWebSocket()
+    session = GatewaySession(ws, client.application, client.application.extensions['broker'],
+                             send_queue_size=2, send_timeout=0.01)
+    # No writer thread is running, so the queue is never drained
+    assert session.send({'type': 'pong'})
+    assert session.send({'type': 'pong'})
+    assert not session.send({'type': 'pong'})
+    assert session.closed.is_set()
+    assert ws.close_reason == CLOSE_POLICY_VIOLATION
+
+def create_file_app(tmp_path, **config):
+    """
+    Creates an application backed by a SQLite file, for tests where several threads
+    use the database at once (the in-memory database shares one connection).
+
+    Args:
+        tmp_path: Pytest temporary directory.
+        **config: Extra configuration values.
+
+    Returns:
+        Flask: The application, with tables created.
+    """
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "test.db"}',
+        'JWT_SECRET_KEY': 'test_jwt_secret_key',
+        **config
+    })
+    with app.app_context():
+        db.create_all()
+    return app
+
+def test_write_buffer_group_commits_concurrent_messages(tmp_path):
+    """
+    Test that buffered messages are acked with their ids and committed in shared transactions.
+    """
+    import threading
+    app = create_file_app(tmp_path, MESSAGE_WRITE_BUFFER=True, MESSAGE_BUFFER_MAX_DELAY_MS=50, MESSAGE_BUFFER_MAX_ROWS=8)
+    client = app.test_client()
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+
+    write_buffer = app.extensions['message_write_buffer']
+    batch_sizes = []
+    flush = write_buffer.flush
+    write_buffer.flush = lambda batch: (batch_sizes.append(len(batch)), flush(batch))
+
+    acked = []
+    def send(i):
+        response = app.test_client().post('/messages', json={'content': f'Message {i}', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+        assert response.status_code == 201
+        acked.append(response.get_json()['id'])
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stored = client.get(f'/chats/{chat_id}/messages', headers=headers).get_json()
+    assert sorted(m['id'] for m in stored) == sorted(acked)
+    assert sum(batch_sizes) == 16
+    assert max(batch_sizes) <= 8
+    assert len(batch_sizes) < 16
+
+def test_write_buffer_isolates_failing_rows(client):
+    """
+    Test that a row failing inside a group commit only fails its own write.
+    """
+    import datetime
+    import uuid
+    from concurrent.futures import Future
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    app = client.application
+    good = {'id': str(uuid.uuid4()), 'content': 'ok', 'created_at': datetime.datetime.utcnow(), 'chat_id': chat_id, 'profile_id': profile_id}
+    bad = dict(good, id=str(uuid.uuid4()), content=None)
+    good_future, bad_future = Future(), Future()
+    with app.app_context():
+        app.extensions['message_write_buffer'].flush([(good, group_id, good_future), (bad, group_id, bad_future)])
+    assert good_future.result(timeout=0) == good['id']
+    assert bad_future.exception(timeout=0) is not None
+
+def test_write_buffer_timeout_withdraws_row(client):
+    """
+    Test that a write acked with a 503 is never stored once the flusher catches up.
+    """
+    import datetime
+    import uuid
+    from werkzeug.exceptions import ServiceUnavailable
+    from models import Message
+    from write_buffer import MessageWriteBuffer
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    app = client.application
+    write_buffer = MessageWriteBuffer(app, max_delay=0, ack_timeout=0.05)
+    start = write_buffer._ensure_started
+    write_buffer._ensure_started = lambda: None  # the flusher is stalled
+    row = {'id': str(uuid.uuid4()), 'content': 'late', 'created_at': datetime.datetime.utcnow(), 'chat_id': chat_id, 'profile_id': profile_id}
+    with pytest.raises(ServiceUnavailable):
+        write_buffer.write(row, group_id)
+
+    write_buffer._ensure_started = start
+    write_buffer.write(dict(row, id=str(uuid.uuid4()), content='retried'), group_id)
+    with app.app_context():
+        assert [m.content for m in Message.query.all()] == ['retried']
+
+def test_create_messages_batch(client):
+    """
+    Test bulk message creation with per-item errors and input-order ids.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    token2 = authenticate_client(client, 'user2@example.com', 'Password2')
+    outsider_id = client.post('/profiles', json={'name': 'Outsider', 'picture': 'http://example.com/pic2.jpg', 'bio': 'Bio 2', 'group_id': group_id},
+                              headers={'Authorization': f'Bearer {token2}'}).get_json()['id']
+    batch = [
+        {'content': 'First', 'profile_id': profile_id},
+        {'content': '', 'profile_id': profile_id},
+        {'content': 'Not a participant', 'profile_id': outsider_id},
+        {'content': 'Second', 'profile_id': profile_id},
+        'not an object'
+    ]
+    response = client.post(f'/chats/{chat_id}/messages:batch', json=batch, headers=headers)
+    assert response.status_code == 207
+    data = response.get_json()
+    assert data['created'] == 2
+    assert data['failed'] == 3
+    results = data['results']
+    assert [r['index'] for r in results] == [0, 1, 2, 3, 4]
+    assert 'id' in results[0] and 'id' in results[3]
+    assert results[1]['error'] == 'Invalid message content'
+    assert results[2]['error'] == 'Profile is not a participant of this chat'
+    assert results[4]['error'] == 'Invalid message data'
+    stored = client.get(f'/chats/{chat_id}/messages', headers=headers).get_json()
+    assert [m['id'] for m in stored] == [results[0]['id'], results[3]['id']]
+
+def test_create_messages_batch_ndjson(client):
+    """
+    Test bulk message creation from an NDJSON body.
+    """
+    import json
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/x-ndjson'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    body = '\n'.join(json.dumps({'content': f'Line {i}', 'profile_id': profile_id}) for i in range(50)) + '\n'
+    response = client.post(f'/chats/{chat_id}/messages:batch', data=body, headers=headers)
+    assert response.status_code == 201
+    ids = [r['id'] for r in response.get_json()['results']]
+    stored = client.get(f'/chats/{chat_id}/messages', headers={'Authorization': f'Bearer {token}'}).get_json()
+    assert [m['id'] for m in stored] == ids
+    assert client.post(f'/chats/{chat_id}/messages:batch', json=[], headers={'Authorization': f'Bearer {token}'}).status_code == 400
+
+def test_chat_activity_summary_and_sort(client):
+    """
+    Test that message writes maintain chat activity fields and that chats can be sorted by activity.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    quiet_chat_id = client.post(f'/groups/{group_id}/chats', json={'name': 'Quiet Chat', 'participant_ids': [profile_id]},
+                                headers=headers).get_json()['id']
+    client.post('/messages', json={'content': 'First', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    client.post(f'/chats/{chat_id}/messages:batch', json=[{'content': 'x' * 300, 'profile_id': profile_id}], headers=headers)
+
+    chat = client.get(f'/chats/{chat_id}', headers=headers).get_json()
+    assert chat['message_count'] == 2
+    assert chat['last_message_preview'] == 'x' * 140
+    assert chat['last_message_at'] is not None
+
+    chats = client.get(f'/groups/{group_id}/chats?sort=activity', headers=headers).get_json()
+    assert chats[0]['id'] == chat_id
+    assert chats[1]['id'] == quiet_chat_id
+    assert chats[1]['message_count'] == 0
+    assert chats[1]['last_message_at'] is None
+    assert client.get(f'/groups/{group_id}/chats?sort=bogus', headers=headers).status_code == 400
+
+    me = client.get('/users/me', headers=headers).get_json()
+    assert next(c for c in me['chats'] if c['id'] == chat_id)['message_count'] == 2
+
+def test_backfill_chat_activity(client):
+    """
+    Test that the backfill command rebuilds activity summaries from messages.
+    """
+    from maintenance import backfill_chat_activity
+    from models import Chat
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for content in ('One', 'Two', 'Three'):
+        client.post('/messages', json={'content': content, 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    with client.application.app_context():
+        chat = db.session.get(Chat, chat_id)
+        chat.message_count, chat.last_message_at, chat.last_message_preview = 0, None, None
+        db.session.commit()
+        assert backfill_chat_activity(batch_size=1) == 2  # general and Test Chat
+    chat = client.get(f'/chats/{chat_id}', headers=headers).get_json()
+    assert chat['message_count'] == 3
+    assert chat['last_message_preview'] == 'Three'
+
+def test_read_markers_and_unread_counts(client):
+    """
+    Test that read markers move forward only and drive per-profile unread counts.
+    """
+    token1 = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers1 = {'Authorization': f'Bearer {token1}'}
+    group_id, profile1_id, chat_id = setup_chat(client, token1)
+    token2 = authenticate_client(client, 'user2@example.com', 'Password2')
+    headers2 = {'Authorization': f'Bearer {token2}'}
+    profile2_id = client.post('/profiles', json={'name': 'Profile 2', 'picture': 'http://example.com/pic2.jpg', 'bio': 'Bio 2', 'group_id': group_id},
+                              headers=headers2).get_json()['id']
+    client.put(f'/chats/{chat_id}', json={'name': 'Test Chat', 'participant_ids': [profile1_id, profile2_id]}, headers=headers1)
+    for content in ('One', 'Two', 'Three'):
+        client.post('/messages', json={'content': content, 'chat_id': chat_id, 'profile_id': profile1_id}, headers=headers1)
+        if content == 'One':
+            first_cursor = client.get(f'/chats/{chat_id}/messages?limit=1', headers=headers2).get_json()['next_cursor']
+
+    def unread(profile_id):
+        chats = client.get(f'/groups/{group_id}/chats?profile_id={profile_id}', headers=headers1).get_json()
+        return {chat['name']: chat['unread_count'] for chat in chats}['Test Chat']
+
+    assert unread(profile1_id) == 0  # senders have read their own messages
+    assert unread(profile2_id) == 3
+
+    response = client.put(f'/chats/{chat_id}/read', json={'profile_id': profile2_id, 'cursor': first_cursor}, headers=headers2)
+    assert response.status_code == 200
+    assert response.get_json()['unread_count'] == 2
+    page = client.get(f'/chats/{chat_id}/messages?limit=3', headers=headers2).get_json()
+    response = client.put(f'/chats/{chat_id}/read', json={'profile_id': profile2_id, 'cursor': page['next_cursor']}, headers=headers2)
+    assert response.status_code == 200
+    assert response.get_json()['unread_count'] == 0
+    assert response.get_json()['last_read_message_id'] == page['messages'][-1]['id']
+    # An older cursor does not move the marker back
+    response = client.put(f'/chats/{chat_id}/read', json={'profile_id': profile2_id, 'cursor': first_cursor}, headers=headers2)
+    assert response.get_json()['unread_count'] == 0
+    client.post('/messages', json={'content': 'Four', 'chat_id': chat_id, 'profile_id': profile1_id}, headers=headers1)
+    assert unread(profile2_id) == 1
+
+    response = client.put(f'/chats/{chat_id}/read', json={'profile_id': profile2_id, 'cursor': 'garbage'}, headers=headers2)
+    assert response.status_code == 400
+    response = client.put(f'/chats/{chat_id}/read', json={'profile_id': 'missing', 'cursor': page['next_cursor']}, headers=headers2)
+    assert response.get_json()['message'] == 'Profile is not a participant of this chat'
+
+def test_repair_read_counters(client):
+    """
+    Test that the repair command renumbers messages and recomputes counters and read markers.
+    """
+    from maintenance import repair_read_counters
+    from models import Chat, Message, chat_participants
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for content in ('One', 'Two', 'Three'):
+        client.post('/messages', json={'content': content, 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    with client.application.app_context():
+        assert repair_read_counters() == {'chats': 2, 'renumbered': 0, 'counters': 0, 'read_markers': 0}
+        db.session.execute(Message.__table__.update().values(seq=None))
+        db.session.execute(Chat.__table__.update().where(Chat.id == chat_id).values(message_count=7))
+        db.session.execute(chat_participants.update().values(last_read_seq=5))
+        db.session.commit()
+        report = repair_read_counters(batch_size=1)
+        assert report == {'chats': 2, 'renumbered': 1, 'counters': 1, 'read_markers': 2}
+        assert [m.seq for m in Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at)] == [1, 2, 3]
+
+        # Numbers without gaps but out of cursor order are renumbered too
+        first, _, last = Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at).all()
+        first.seq, last.seq = 3, 1
+        db.session.commit()
+        assert repair_read_counters()['renumbered'] == 1
+        assert [m.seq for m in Message.query.filter_by(chat_id=chat_id).order_by(Message.created_at)] == [1, 2, 3]
+    chats = client.get(f'/groups/{group_id}/chats?profile_id={profile_id}', headers=headers).get_json()
+    chat = next(chat for chat in chats if chat['id'] == chat_id)
+    assert chat['message_count'] == 3
+    assert chat['unread_count'] == 0
+
+class QueryCounter:
+    """
+    Records the SQL statements an application executes while active.
+    """
+    def __init__(self, app):
+        with app.app_context():
+            self.engine = db.engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+def test_list_chats_constant_queries(client):
+    """
+    Test that listing chats takes one statement whatever the number of chats and participants,
+    including the version behind the ETag when the request has no validators.
+    """
+    token1 = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token1}'}
+    group_id, profile1_id, chat_id = setup_chat(client, token1)
+    token2 = authenticate_client(client, 'user2@example.com', 'Password2')
+    profile2_id = client.post('/profiles', json={'name': 'Profile 2', 'picture': 'http://example.com/pic2.jpg', 'bio': 'Bio 2', 'group_id': group_id},
+                              headers={'Authorization': f'Bearer {token2}'}).get_json()['id']
+    urls = [f'/groups/{group_id}/chats', f'/groups/{group_id}/chats?participants=count',
+            f'/groups/{group_id}/chats?profile_id={profile1_id}&sort=activity&limit=2', f'/chats/{chat_id}']
+    counts = []
+    for chats in (1, 6):
+        while len(client.get(f'/groups/{group_id}/chats', headers=headers).get_json()) < chats + 1:
+            client.post(f'/groups/{group_id}/chats', json={'name': 'Extra', 'participant_ids': [profile1_id, profile2_id]}, headers=headers)
+        with QueryCounter(client.application) as counter:
+            for url in urls:
+                assert client.get(url, headers=headers).status_code == 200
+        counts.append(len(counter.statements))
+    assert counts == [len(urls), len(urls)]
+
+    chats = client.get(f'/groups/{group_id}/chats?participants=count', headers=headers).get_json()
+    assert {chat['participant_count'] for chat in chats if chat['name'] == 'Extra'} == {2}
+    assert all('participant_ids' not in chat for chat in chats)
+    chat = client.get(f'/chats/{chat_id}', headers=headers).get_json()
+    assert chat['participant_ids'] == [profile1_id]
+
+def test_list_chats_keyset_pagination(client):
+    """
+    Test that chat pages cover every chat once in both sort orders.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for i in range(3):
+        client.post(f'/groups/{group_id}/chats', json={'name': f'Chat {i}', 'participant_ids': [profile_id]}, headers=headers)
+    client.post('/messages', json={'content': 'Hi', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    all_chats = client.get(f'/groups/{group_id}/chats', headers=headers).get_json()
+    for sort in ('', '&sort=activity'):
+        seen = []
+        url = f'/groups/{group_id}/chats?limit=2{sort}'
+        while True:
+            page = client.get(url, headers=headers).get_json()
+            seen.extend(chat['id'] for chat in page['chats'])
+            if not page['has_more']:
+                break
+            url = f"/groups/{group_id}/chats?limit=2&cursor={page['next_cursor']}{sort}"
+        assert sorted(seen) == sorted(chat['id'] for chat in all_chats)
+        assert len(seen) == len(all_chats)
+        if sort:
+            assert seen[0] == chat_id
+    assert client.get(f'/groups/{group_id}/chats?participants=all', headers=headers).status_code == 400
+
+def test_chat_participants_endpoint_and_count_payloads(client):
+    """
+    Test paging through the general chat's participants and count-only chat payloads.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    profile_ids = {profile_id}
+    for i in range(2, 5):
+        other = authenticate_client(client, f'user{i}@example.com', f'Password{i}')
+        response = client.post('/profiles', json={'name': f'Profile {i}', 'picture': 'http://example.com/pic.jpg', 'bio': 'Bio', 'group_id': group_id},
+                               headers={'Authorization': f'Bearer {other}'})
+        profile_ids.add(response.get_json()['id'])
+    general_id = next(chat['id'] for chat in client.get(f'/groups/{group_id}/chats', headers=headers).get_json()
+                      if chat['name'] == 'general')
+
+    seen = []
+    url = f'/chats/{general_id}/participants?limit=3'
+    while url:
+        page = client.get(url, headers=headers).get_json()
+        seen.extend(participant['id'] for participant in page['participants'])
+        url = f"/chats/{general_id}/participants?limit=3&cursor={page['next_cursor']}" if page['has_more'] else None
+    assert seen == sorted(profile_ids)
+    assert client.get('/chats/missing/participants', headers=headers).status_code == 404
+
+    chat = client.get(f'/chats/{general_id}?participants=count', headers=headers).get_json()
+    assert chat['participant_count'] == 4
+    assert 'participant_ids' not in chat
+    chat = client.get(f'/chats/{general_id}?fields=id,name,participant_count', headers=headers).get_json()
+    assert chat == {'id': general_id, 'name': 'general', 'participant_count': 4}
+    chats = client.get(f'/groups/{group_id}/chats?fields=id,unread_count&profile_id={profile_id}', headers=headers).get_json()
+    assert all(set(chat) == {'id', 'unread_count'} for chat in chats)
+    assert client.get(f'/chats/{general_id}?fields=id,secret', headers=headers).status_code == 400
+
+def test_get_user_info_fixed_queries_and_etag(client):
+    """
+    Test that /users/me runs a fixed number of queries, is cached with an ETag and
+    is invalidated when the user's groups or chats change.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_ids = []
+    for i in range(3):
+        group_id, profile_id, chat_id = setup_chat(client, token, group_name=f'Group {i}', profile_name=f'Profile {i}')
+        group_ids.append(group_id)
+        with QueryCounter(client.application) as counter:
+            response = client.get('/users/me', headers=headers)
+        assert response.status_code == 200
+        assert len(counter.statements) == 3
+        assert len(response.get_json()['groups']) == i + 1
+
+    etag = response.headers['ETag']
+    with QueryCounter(client.application) as counter:
+        response = client.get('/users/me', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert counter.statements == []
+
+    client.post(f'/groups/{group_ids[0]}/chats', json={'name': 'New Chat', 'participant_ids': []}, headers=headers)
+    response = client.get('/users/me', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'New Chat' in [chat['name'] for chat in response.get_json()['chats']]
+    client.put(f'/groups/{group_ids[1]}', json={'name': 'Renamed', 'picture': 'http://example.com/pic.jpg', 'max_profiles': 5}, headers=headers)
+    assert 'Renamed' in [group['name'] for group in client.get('/users/me', headers=headers).get_json()['groups']]
+    client.post('/messages', json={'content': 'Hi', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    chats = client.get('/users/me', headers=headers).get_json()['chats']
+    assert next(chat for chat in chats if chat['id'] == chat_id)['message_count'] == 1
+
+def test_conditional_get_read_endpoints(client):
+    """
+    Test that read endpoints answer a matching If-None-Match or If-Modified-Since with
+    a 304 after one version lookup, and send a new ETag once the resource changes.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    chats_url = f'/groups/{group_id}/chats'
+    general_id = next(chat['id'] for chat in client.get(chats_url, headers=headers).get_json() if chat['name'] == 'general')
+    messages_url = f'/chats/{chat_id}/messages'
+    urls = [f'/groups/{group_id}', f'/profiles/{profile_id}', f'/chats/{chat_id}', f'/chats/{general_id}',
+            messages_url, f'{messages_url}?limit=1', chats_url, f'{chats_url}?limit=1', f'{chats_url}?profile_id={profile_id}']
+    etags = {}
+    for url in urls:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        # Neither a profile's read watermarks nor an empty history have a modification time
+        assert ('Last-Modified' in response.headers) == ('profile_id' not in url and not url.startswith(messages_url))
+        etags[url] = response.headers['ETag']
+        with QueryCounter(client.application) as counter:
+            response = client.get(url, headers={**headers, 'If-None-Match': etags[url]})
+        assert (response.status_code, response.data) == (304, b'')
+        assert response.headers['ETag'] == etags[url]
+        assert len(counter.statements) == 1
+    assert len(set(etags.values())) == len(urls)
+    assert client.get(f'/chats/{chat_id}?participants=count', headers={**headers, 'If-None-Match': etags[f'/chats/{chat_id}']}).status_code == 200
+    last_modified = client.get(f'/groups/{group_id}', headers=headers).headers['Last-Modified']
+    assert client.get(f'/groups/{group_id}', headers={**headers, 'If-Modified-Since': last_modified}).status_code == 304
+
+    def changed():
+        return {url for url in urls if client.get(url, headers={**headers, 'If-None-Match': etags[url]}).status_code == 200}
+
+    client.post('/messages', json={'content': 'Hello', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    assert changed() == {f'/chats/{chat_id}', messages_url, f'{messages_url}?limit=1', chats_url, f'{chats_url}?limit=1',
+                         f'{chats_url}?profile_id={profile_id}'}
+    assert 'Last-Modified' in client.get(messages_url, headers=headers).headers
+    etags.update({url: client.get(url, headers=headers).headers['ETag'] for url in urls})
+
+    other = authenticate_client(client, 'user2@example.com', 'Password1')
+    client.post('/profiles', json={'name': 'Profile 2', 'picture': 'http://example.com/pic.jpg', 'bio': 'Bio', 'group_id': group_id},
+                headers={'Authorization': f'Bearer {other}'})
+    assert changed() == {f'/groups/{group_id}', f'/chats/{general_id}', chats_url, f'{chats_url}?limit=1',
+                         f'{chats_url}?profile_id={profile_id}'}
+    etags.update({url: client.get(url, headers=headers).headers['ETag'] for url in urls})
+
+    client.put(f'/groups/{group_id}', json={'name': 'Renamed', 'picture': 'http://example.com/pic.jpg', 'max_profiles': 5}, headers=headers)
+    client.put(f'/chats/{chat_id}', json={'name': 'Renamed Chat', 'participant_ids': [profile_id]}, headers=headers)
+    assert changed() == {f'/groups/{group_id}', f'/chats/{chat_id}', chats_url, f'{chats_url}?limit=1',
+                         f'{chats_url}?profile_id={profile_id}'}
+
+    response = client.get('/chats/missing', headers={**headers, 'If-None-Match': etags[f'/chats/{chat_id}']})
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
+
+def test_get_user_info_include_fields_and_chat_cursor(client):
+    """
+    Test that /users/me returns only the requested sections and fields and pages through chats.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    for i in range(2):
+        setup_chat(client, token, group_name=f'Group {i}', profile_name=f'Profile {i}')
+    full = client.get('/users/me', headers=headers).get_json()
+    assert len(full['chats']) == 4  # general and Test Chat in each group
+
+    with QueryCounter(client.application) as counter:
+        response = client.get('/users/me?include=groups&fields=id,groups.name', headers=headers)
+    assert response.get_json() == {'id': full['id'], 'groups': [{'name': group['name']} for group in full['groups']]}
+    assert [group['id'] for group in full['groups']] == sorted(group['id'] for group in full['groups'])
+    assert len(counter.statements) == 2
+    assert 'ETag' in response.headers
+
+    seen = []
+    url = '/users/me?include=chats&fields=chats.id,chats.participant_count&chats_limit=3'
+    while url:
+        page = client.get(url, headers=headers).get_json()
+        assert all(set(chat) == {'id', 'participant_count'} for chat in page['chats'])
+        seen.extend(chat['id'] for chat in page['chats'])
+        url = None
+        if page['chats_has_more']:
+            url = f"/users/me?include=chats&fields=chats.id,chats.participant_count&chats_limit=3&chats_cursor={page['chats_next_cursor']}"
+    assert sorted(seen) == sorted(chat['id'] for chat in full['chats'])
+    assert client.get('/users/me?include=secrets', headers=headers).status_code == 400
+    assert client.get('/users/me?fields=chats.bogus', headers=headers).status_code == 400
+
+def test_list_groups_and_profiles_filters_and_pages(client):
+    """
+    Test keyset pages, filters and field projections of the group and profile listings.
+    """
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_ids = [setup_chat(client, token, group_name=f'Group {i}', profile_name=f'Profile {i}')[0] for i in range(3)]
+
+    seen = []
+    url = '/groups?limit=2&fields=id,name'
+    while url:
+        page = client.get(url, headers=headers).get_json()
+        assert all(set(group) == {'id', 'name'} for group in page['groups'])
+        seen.extend(group['id'] for group in page['groups'])
+        url = f"/groups?limit=2&fields=id,name&cursor={page['next_cursor']}" if page['has_more'] else None
+    assert seen == sorted(group_ids)
+
+    groups = client.get(f'/groups?ids={group_ids[0]},{group_ids[2]}&fields=name', headers=headers).get_json()
+    assert sorted(group['name'] for group in groups) == ['Group 0', 'Group 2']
+    profiles = client.get(f'/profiles?group_id={group_ids[1]}', headers=headers).get_json()
+    assert [(profile['name'], profile['group_id']) for profile in profiles] == [('Profile 1', group_ids[1])]
+    page = client.get(f'/profiles?group_id={group_ids[1]}&limit=1&fields=name', headers=headers).get_json()
+    assert page == {'profiles': [{'name': 'Profile 1'}], 'next_cursor': None, 'has_more': False}
+    assert client.get('/profiles?fields=password', headers=headers).status_code == 400
+    assert client.get('/groups?ids=' + ','.join(str(i) for i in range(201)), headers=headers).status_code == 400
+
+def test_streamed_listings_match_buffered_ones(client):
+    """
+    Test that streamed JSON and NDJSON listings contain the same items as the plain ones.
+    """
+    import json
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for i in range(5):
+        client.post('/messages', json={'content': f'Message {i}', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    for url in ('/groups', '/profiles?fields=id,name', f'/groups/{group_id}/chats?sort=activity', f'/chats/{chat_id}/messages'):
+        expected = client.get(url, headers=headers).get_json()
+        separator = '&' if '?' in url else '?'
+        assert client.get(url + separator + 'stream=json', headers=headers).get_json() == expected
+        response = client.get(url + separator + 'stream=ndjson', headers=headers)
+        assert response.mimetype == 'application/x-ndjson'
+        assert [json.loads(line) for line in response.get_data(as_text=True).splitlines()] == expected
+    assert client.get('/groups?stream=csv', headers=headers).status_code == 400
+    assert client.get('/groups?stream=json&limit=2', headers=headers).status_code == 400
+
+def test_export_chat_transcript_in_batches(client):
+    """
+    Test that a transcript export streams one chunk per batch of messages in both formats.
+    """
+    import json
+    client.application.config['STREAM_BATCH_SIZE'] = 2
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for i in range(5):
+        client.post('/messages', json={'content': f'Message {i}', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+
+    response = client.get(f'/chats/{chat_id}/export', headers=headers, buffered=False)
+    assert response.headers['Content-Disposition'] == f'attachment; filename="chat-{chat_id}.ndjson"'
+    chunks = [chunk for chunk in response.response if chunk]
+    assert len(chunks) == 3
+    entries = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+    assert [(entry['seq'], entry['profile_name'], entry['content']) for entry in entries] == \
+        [(i + 1, 'Profile 1', f'Message {i}') for i in range(5)]
+    response.close()
+
+    document = client.get(f'/chats/{chat_id}/export?format=json', headers=headers).get_json()
+    assert document['chat']['id'] == chat_id
+    assert document['chat']['participant_count'] == 1
+    assert [entry['content'] for entry in document['messages']] == [f'Message {i}' for i in range(5)]
+    assert client.get('/chats/missing/export', headers=headers).status_code == 404
+
+def test_response_compression_negotiated_and_cached(client):
+    """
+    Test that large responses are compressed with the negotiated coding, small ones are not,
+    and compressed documents with an ETag are cached and still revalidate.
+    """
+    import gzip
+    import json
+    import zlib
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for i in range(40):
+        client.post('/messages', json={'content': f'Message {i} ' + 'x' * 40, 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    expected = client.get(f'/chats/{chat_id}/messages', headers=headers).get_json()
+
+    response = client.get(f'/chats/{chat_id}/messages', headers={**headers, 'Accept-Encoding': 'gzip, deflate'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert json.loads(gzip.decompress(response.data)) == expected
+    response = client.get(f'/chats/{chat_id}/messages', headers={**headers, 'Accept-Encoding': 'gzip;q=0.5, deflate'})
+    assert response.headers['Content-Encoding'] == 'deflate'
+    assert json.loads(zlib.decompress(response.data)) == expected
+    assert 'Content-Encoding' not in client.get(f'/chats/{chat_id}/messages', headers={**headers, 'Accept-Encoding': 'br;q=1, gzip;q=0'}).headers
+    small = client.get(f'/groups/{group_id}', headers={**headers, 'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers and small.get_json()['id'] == group_id
+
+    compressed = [client.get('/users/me', headers={**headers, 'Accept-Encoding': 'gzip'}) for _ in range(2)]
+    assert compressed[0].data == compressed[1].data
+    etag = compressed[0].headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/users/me', headers={**headers, 'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+    metrics = client.get('/metrics/compression').get_json()
+    assert metrics['encodings']['gzip']['responses'] == 2
+    assert metrics['encodings']['gzip']['bytes_saved'] > 0
+    assert metrics['encodings']['deflate']['responses'] == 1
+    assert metrics['cache_hits'] == 1 and metrics['skipped_small'] >= 1
+
+def test_streamed_response_compressed_incrementally(client):
+    """
+    Test that a streamed export is compressed chunk by chunk, each chunk decodable on arrival.
+    """
+    import zlib
+    client.application.config['STREAM_BATCH_SIZE'] = 2
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for i in range(5):
+        client.post('/messages', json={'content': f'Message {i}', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    expected = client.get(f'/chats/{chat_id}/export', headers=headers).data
+
+    response = client.get(f'/chats/{chat_id}/export', headers={**headers, 'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    decoder = zlib.decompressobj(31)
+    decoded = [decoder.decompress(chunk) for chunk in response.response]
+    response.close()
+    assert [chunk.count(b'\n') for chunk in decoded[:3]] == [2, 2, 1]
+    assert decoder.eof and b''.join(decoded) == expected
+
+def create_migrated_app(tmp_path):
+    """
+    Creates an application backed by a SQLite file whose schema was built by the migrations.
+
+    Args:
+        tmp_path: Pytest temporary directory.
+
+    Returns:
+        Flask: The application, with the database upgraded to the latest revision.
+    """
+    from init_db import upgrade_database
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "migrated.db"}',
+        'JWT_SECRET_KEY': 'test_jwt_secret_key'
+    })
+    with app.app_context():
+        upgrade_database()
+    return app
+
+def schema_differences(app):
+    """
+    Compares an application's database schema with the models.
+
+    Args:
+        app: The application.
+
+    Returns:
+        list: Differences reported by Alembic autogenerate; empty if the schema matches.
+    """
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    with app.app_context(), db.engine.connect() as connection:
+        return compare_metadata(MigrationContext.configure(connection), db.metadata)
+
+@pytest.mark.filterwarnings('ignore::UserWarning', 'ignore:Skipped unsupported reflection')
+def test_migrations_match_models(tmp_path):
+    """
+    Test that the migrations build the schema declared by the models, and that a database
+    created with db.create_all() before migrations existed is upgraded in place.
+    """
+    app = create_migrated_app(tmp_path)
+    assert schema_differences(app) == []
+
+    # The last schema db.create_all() built is that of revision 0003, without migration history
+    from alembic.script import ScriptDirectory
+    from flask_migrate import upgrade
+    from app import MIGRATIONS_DIRECTORY
+    from init_db import upgrade_database
+    legacy = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "legacy.db"}',
+                         'JWT_SECRET_KEY': 'test_jwt_secret_key'})
+    with legacy.app_context():
+        upgrade(revision='0003')
+        db.session.execute(db.text('DROP TABLE alembic_version'))
+        db.session.commit()
+        upgrade_database()
+        head = ScriptDirectory(MIGRATIONS_DIRECTORY).get_current_head()
+        assert db.session.execute(db.text('SELECT version_num FROM alembic_version')).scalar() == head
+    assert schema_differences(legacy) == []
+
+@pytest.mark.filterwarnings('ignore::UserWarning', 'ignore:Skipped unsupported reflection')
+def test_migrations_backfill_chat_counters(tmp_path):
+    """
+    Test that upgrading a database with existing messages numbers them and fills in
+    the chat counters, with the old history marked read.
+    """
+    from flask_migrate import upgrade
+    from models import Message
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "old.db"}',
+                      'JWT_SECRET_KEY': 'test_jwt_secret_key'})
+    with app.app_context():
+        upgrade(revision='0001')
+        for statement in (
+            "INSERT INTO appuser VALUES ('u1', 'user1@example.com', 'unused')",
+            "INSERT INTO \"group\" VALUES ('g1', 'Group', '', 5)",
+            "INSERT INTO chat VALUES ('c1', 'general', '2026-01-01 00:00:00', '2026-01-01 00:00:00', 'g1')",
+            "INSERT INTO chat VALUES ('c2', 'empty', '2026-01-01 00:00:00', '2026-01-01 00:00:00', 'g1')",
+            "INSERT INTO profile VALUES ('p1', 'Profile', '', '', 'g1', 'u1')",
+            "INSERT INTO chat_participants VALUES ('c1', 'p1')",
+            "INSERT INTO chat_participants VALUES ('c2', 'p1')",
+            "INSERT INTO message VALUES ('m2', 'Second', '2026-01-01 00:00:02', 'c1', 'p1')",
+            "INSERT INTO message VALUES ('m1', 'First', '2026-01-01 00:00:01', 'c1', 'p1')",
+            "INSERT INTO message VALUES ('m3', 'Third', '2026-01-01 00:00:03', 'c1', 'p1')",
+        ):
+            db.session.execute(db.text(statement))
+        db.session.commit()
+        upgrade()
+        assert [(m.id, m.seq) for m in Message.query.order_by(Message.created_at)] == [('m1', 1), ('m2', 2), ('m3', 3)]
+        chats = {chat.id: (chat.message_count, chat.last_message_at.second if chat.last_message_at else None, chat.last_message_preview)
+                 for chat in Chat.query}
+        assert chats == {'c1': (3, 3, 'Third'), 'c2': (0, None, None)}
+        markers = db.session.execute(db.text(
+            'SELECT chat_id, last_read_seq, last_read_message_id FROM chat_participants ORDER BY chat_id')).all()
+        assert [tuple(row) for row in markers] == [('c1', 3, 'm3'), ('c2', 0, None)]
+
+def test_unique_profile_indexes(tmp_path):
+    """
+    Test that the database rejects a second profile per user or a duplicate name in a group.
+    """
+    from sqlalchemy.exc import IntegrityError
+    app = create_migrated_app(tmp_path)
+    with app.app_context():
+        user = User(email='user1@example.com', password='Password1')
+        other = User(email='user2@example.com', password='Password2')
+        group = Group(name='Group', picture='', max_profiles=5)
+        db.session.add_all([user, other, group])
+        db.session.flush()
+        db.session.add(Profile(name='Profile 1', picture='', bio='', group_id=group.id, user_id=user.id))
+        db.session.commit()
+        for name, user_id in (('Profile 2', user.id), ('Profile 1', other.id)):
+            db.session.add(Profile(name=name, picture='', bio='', group_id=group.id, user_id=user_id))
+            with pytest.raises(IntegrityError):
+                db.session.commit()
+            db.session.rollback()
+
+def test_profile_constraint_errors():
+    """
+    Test that constraint violations on profiles map to the error of the violated constraint.
+    """
+    from sqlalchemy.exc import IntegrityError
+    from services import profile_constraint_error
+    errors = {
+        'UNIQUE constraint failed: profile.group_id, profile.user_id': 'User already has a profile in this group',
+        'duplicate key value violates unique constraint "uq_profile_group_name"': 'Profile name already exists in this group',
+        'insert or update on table "profile" violates foreign key constraint "profile_group_id_fkey"\n'
+        'DETAIL:  Key (group_id)=(g1) is not present in table "group".': 'Group not found',
+        'insert or update on table "profile" violates foreign key constraint "profile_user_id_fkey"\n'
+        'DETAIL:  Key (user_id)=(u1) is not present in table "appuser".': 'User not found',
+        'FOREIGN KEY constraint failed': 'Group or user not found'
+    }
+    for text, message in errors.items():
+        assert profile_constraint_error(IntegrityError('INSERT', {}, Exception(text))).description == message
+    assert profile_constraint_error(IntegrityError('INSERT', {}, Exception('NOT NULL constraint failed: profile.name'))) is None
+
+def test_route_queries_use_indexes(tmp_path):
+    """
+    Test that no filtered statement issued by the routes scans a whole table (EXPLAIN QUERY PLAN).
+    """
+    from sqlalchemy import event
+    app = create_migrated_app(tmp_path)
+    client = app.test_client()
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for i in range(3):
+        client.post('/messages', json={'content': f'Message {i}', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+
+    executed = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.split(None, 1)[0] in ('SELECT', 'UPDATE', 'DELETE'):
+            executed.append((statement, parameters))
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        for url in (f'/groups/{group_id}', f'/groups?ids={group_id}', f'/profiles?group_id={group_id}',
+                    f'/profiles/{profile_id}', f'/groups/{group_id}/chats',
+                    f'/groups/{group_id}/chats?profile_id={profile_id}&sort=activity&limit=1',
+                    f'/chats/{chat_id}', f'/chats/{chat_id}/participants', f'/chats/{chat_id}/messages?limit=2',
+                    f'/chats/{chat_id}/export', '/users/me'):
+            assert client.get(url, headers=headers).status_code == 200
+        cursor = client.get(f'/chats/{chat_id}/messages?limit=3', headers=headers).get_json()['next_cursor']
+        assert client.put(f'/chats/{chat_id}/read', json={'profile_id': profile_id, 'cursor': cursor}, headers=headers).status_code == 200
+        assert client.put(f'/chats/{chat_id}', json={'name': 'Renamed', 'participant_ids': [profile_id]},
+                          headers=headers).status_code == 200
+        token2 = authenticate_client(client, 'user2@example.com', 'Password2')
+        assert client.post('/profiles', json={'name': 'Profile 2', 'picture': 'http://example.com/pic2.jpg', 'bio': 'Bio 2', 'group_id': group_id},
+                           headers={'Authorization': f'Bearer {token2}'}).status_code == 201
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert executed
+    with engine.connect() as connection:
+        for statement, parameters in executed:
+            plan = [row[3] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+            scans = [step for step in plan if step.startswith('SCAN') and 'INDEX' not in step]
+            assert not scans, (statement, plan)
+
+def test_create_profile_concurrently(tmp_path):
+    """
+    Test that racing profile creations leave one profile per user and per name in a group,
+    and that the losers get the usual 400 messages.
+    """
+    import threading
+    app = create_file_app(tmp_path)
+    client = app.test_client()
+    tokens = [authenticate_client(client, f'user{i}@example.com', f'Password{i}') for i in range(6)]
+    group_id = client.post('/groups', json={'name': 'Test Group', 'picture': 'http://example.com/pic.jpg', 'max_profiles': 10},
+                           headers={'Authorization': f'Bearer {tokens[0]}'}).get_json()['id']
+
+    def race(requests):
+        responses = [None] * len(requests)
+        barrier = threading.Barrier(len(requests))
+        def create(index, token, name):
+            barrier.wait()
+            responses[index] = app.test_client().post('/profiles', json={'name': name, 'picture': 'http://example.com/pic.jpg', 'bio': 'Bio', 'group_id': group_id},
+                                                      headers={'Authorization': f'Bearer {token}'})
+        threads = [threading.Thread(target=create, args=(i, token, name)) for i, (token, name) in enumerate(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted((response.status_code, response.get_json().get('message', '').split(': ')[-1]) for response in responses)
+
+    assert race([(tokens[0], f'Profile {i}') for i in range(3)]) == \
+        [(201, '')] + [(400, 'User already has a profile in this group')] * 2
+    assert race([(token, 'Taken') for token in tokens[1:4]]) == \
+        [(201, '')] + [(400, 'Profile name already exists in this group')] * 2
+
+    with app.app_context():
+        assert Profile.query.filter_by(group_id=group_id).count() == 2
+        general = Chat.query.filter_by(group_id=group_id, name='general').one()
+        assert len(general.participants) == 2
+        assert db.session.get(Group, group_id).profile_count == 2
+
+def test_group_capacity_enforced_atomically(tmp_path):
+    """
+    Test that concurrent joins never take a group past max_profiles and that occupancy is reported.
+    """
+    import threading
+    app = create_file_app(tmp_path)
+    client = app.test_client()
+    tokens = [authenticate_client(client, f'user{i}@example.com', f'Password{i}') for i in range(5)]
+    headers = {'Authorization': f'Bearer {tokens[0]}'}
+    group_id = client.post('/groups', json={'name': 'Small Group', 'picture': 'http://example.com/pic.jpg', 'max_profiles': 2},
+                           headers=headers).get_json()['id']
+
+    responses = [None] * len(tokens)
+    barrier = threading.Barrier(len(tokens))
+    def join(index):
+        barrier.wait()
+        responses[index] = app.test_client().post('/profiles', json={'name': f'Profile {index}', 'picture': 'http://example.com/pic.jpg', 'bio': 'Bio', 'group_id': group_id},
+                                                  headers={'Authorization': f'Bearer {tokens[index]}'})
+    threads = [threading.Thread(target=join, args=(i,)) for i in range(len(tokens))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(response.status_code for response in responses) == [201, 201, 400, 400, 400]
+    assert all(response.get_json()['message'].endswith('Group is full') for response in responses if response.status_code == 400)
+
+    group = client.get(f'/groups/{group_id}', headers=headers).get_json()
+    assert (group['max_profiles'], group['profile_count']) == (2, 2)
+    assert client.get(f'/groups?ids={group_id}&fields=profile_count', headers=headers).get_json() == [{'profile_count': 2}]
+    with app.app_context():
+        assert Profile.query.filter_by(group_id=group_id).count() == 2
+
+def test_create_group_single_transaction(client):
+    """
+    Test that a group and its general chat are created with one commit.
+    """
+    from sqlalchemy import event
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    commits = []
+    def record(conn):
+        commits.append(conn)
+    with client.application.app_context():
+        engine = db.engine
+    event.listen(engine, 'commit', record)
+    try:
+        group_id = client.post('/groups', json={'name': 'Test Group', 'picture': 'http://example.com/pic.jpg', 'max_profiles': 5},
+                               headers=headers).get_json()['id']
+    finally:
+        event.remove(engine, 'commit', record)
+    assert len(commits) == 1
+    assert [chat['name'] for chat in client.get(f'/groups/{group_id}/chats', headers=headers).get_json()] == ['general']
+
+def test_provision_groups_and_profiles(client):
+    """
+    Test bulk provisioning from NDJSON: refs, per-item errors, capacity, general chats and bulk inserts.
+    """
+    import json
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    for i in range(2, 5):
+        authenticate_client(client, f'user{i}@example.com', f'Password{i}')
+    with client.application.app_context():
+        user_ids = {user.email: user.id for user in User.query.all()}
+    existing_id = client.post('/groups', json={'name': 'Existing', 'picture': 'http://example.com/pic.jpg', 'max_profiles': 1},
+                              headers=headers).get_json()['id']
+    items = [
+        {'type': 'group', 'ref': 'eng', 'name': 'Engineering', 'max_profiles': 3},
+        {'type': 'group', 'ref': 'ops', 'name': 'Operations', 'max_profiles': 1},
+        {'type': 'profile', 'group_ref': 'eng', 'email': 'user1@example.com', 'name': 'Ada'},
+        {'type': 'profile', 'group_ref': 'eng', 'user_id': user_ids['user2@example.com'], 'name': 'Grace'},
+        {'type': 'profile', 'group_ref': 'eng', 'email': 'user3@example.com', 'name': 'Ada'},
+        {'type': 'profile', 'group_ref': 'eng', 'email': 'user1@example.com', 'name': 'Ada again'},
+        {'type': 'profile', 'group_ref': 'ops', 'email': 'user1@example.com', 'name': 'Ada'},
+        {'type': 'profile', 'group_ref': 'ops', 'email': 'user2@example.com', 'name': 'Grace'},
+        {'type': 'profile', 'group_id': existing_id, 'email': 'user4@example.com', 'name': 'Linus'},
+        {'type': 'profile', 'group_ref': 'missing', 'email': 'user1@example.com', 'name': 'Nobody'},
+        {'type': 'profile', 'group_ref': 'eng', 'email': 'nobody@example.com', 'name': 'Nobody'},
+        {'type': 'profile', 'group_id': [existing_id], 'email': 'user1@example.com', 'name': 'Listed'},
+        {'type': 'profile', 'group_ref': 'eng', 'user_id': {'id': 'user1'}, 'name': 'Nested'},
+        {'type': 'group', 'name': 'No capacity', 'max_profiles': 0},
+    ]
+    body = '\n'.join(json.dumps(item) for item in items) + '\nnot json\n'
+    with QueryCounter(client.application) as counter:
+        response = client.post('/provision', data=body, content_type='application/x-ndjson', headers=headers)
+    assert response.status_code == 207
+    results = response.get_json()['results']
+    assert [result.get('error') for result in results] == [
+        None, None, None, None,
+        'Profile name already exists in this group', 'User already has a profile in this group',
+        'Group is full', 'Group is full', None, 'Group not found', 'User not found',
+        'Invalid group_id', 'Invalid user_id', 'Invalid max_profiles', 'Invalid item type'
+    ]
+    assert response.get_json()['created'] == 5
+    assert sum(statement.startswith('INSERT') for statement in counter.statements) == 4
+
+    eng_id = results[0]['id']
+    group = client.get(f'/groups/{eng_id}', headers=headers).get_json()
+    assert (group['name'], group['profile_count']) == ('Engineering', 2)
+    assert client.get(f'/groups/{results[1]["id"]}', headers=headers).get_json()['profile_count'] == 0
+    assert client.get(f'/groups/{existing_id}', headers=headers).get_json()['profile_count'] == 1
+    general = client.get(f'/groups/{eng_id}/chats', headers=headers).get_json()
+    assert [chat['name'] for chat in general] == ['general']
+    assert sorted(general[0]['participant_ids']) == sorted([results[2]['id'], results[3]['id']])
+    general = client.get(f'/groups/{existing_id}/chats', headers=headers).get_json()
+    assert general[0]['participant_ids'] == [results[8]['id']]
+    assert client.post('/provision', json=[], headers=headers).status_code == 400
+
+def test_provision_cli_resolves_refs_across_batches(client):
+    """
+    Test that the provisioning CLI writes in batches and resolves group refs from earlier batches.
+    """
+    import json
+    from provision import provision
+    authenticate_client(client, 'user1@example.com', 'Password1')
+    lines = [json.dumps({'type': 'group', 'ref': 'eng', 'name': 'Engineering', 'max_profiles': 5}), '',
+             json.dumps({'type': 'profile', 'group_ref': 'eng', 'email': 'user1@example.com', 'name': 'Ada'}),
+             json.dumps({'type': 'profile', 'group_ref': 'eng', 'email': 'user1@example.com', 'name': 'Ada 2'}),
+             '{broken']
+    with client.application.app_context():
+        created, errors = provision(lines, batch_size=1)
+        assert created == 2
+        assert errors == [(4, 'User already has a profile in this group'), (5, 'Invalid item type')]
+        group = Group.query.filter_by(name='Engineering').one()
+        assert group.profile_count == 1
+        assert [profile.name for profile in group.profiles] == ['Ada']
+
+def test_delete_group_async_hides_then_purges(tmp_path):
+    """
+    Test that an async delete hides the group and its contents at once and that the
+    background job purges them, with progress on the status endpoint.
+    """
+    import time
+    app = create_file_app(tmp_path, GROUP_PURGE_BATCH_SIZE=2, GROUP_PURGE_PAUSE_MS=0)
+    client = app.test_client()
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for i in range(5):
+        client.post('/messages', json={'content': f'Message {i}', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    assert client.delete(f'/groups/{group_id}?mode=later', headers=headers).status_code == 400
+
+    response = client.delete(f'/groups/{group_id}?mode=async', headers=headers)
+    assert response.status_code == 202
+    status_url = response.get_json()['status_url']
+    assert response.headers['Location'] == status_url
+    assert client.get(f'/groups/{group_id}', headers=headers).status_code == 404
+    assert client.get('/groups', headers=headers).get_json() == []
+    assert client.get(f'/profiles/{profile_id}', headers=headers).status_code == 404
+    assert client.get(f'/chats/{chat_id}', headers=headers).status_code == 404
+    assert client.get(f'/chats/{chat_id}/messages', headers=headers).get_json() == []
+    me = client.get('/users/me', headers=headers).get_json()
+    assert (me['profiles'], me['groups'], me['chats']) == ([], [], [])
+    assert client.delete(f'/groups/{group_id}?mode=async', headers=headers).status_code == 404
+    response = client.post(f'/groups/{group_id}/chats', json={'name': 'Late', 'participant_ids': []}, headers=headers)
+    assert response.status_code == 404
+
+    deadline = time.monotonic() + 10
+    while True:
+        job = client.get(status_url, headers=headers).get_json()
+        if job['status'] == 'done' or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert job['status'] == 'done'
+    assert job['deleted'] == {'messages': 5, 'participants': 2, 'chats': 2, 'profiles': 1}
+    with app.app_context():
+        for table in ('"group"', 'profile', 'chat', 'chat_participants', 'message'):
+            assert db.session.execute(db.text(f'SELECT COUNT(*) FROM {table}')).scalar() == 0
+
+def test_purger_resumes_jobs_after_restart(tmp_path):
+    """
+    Test that a process starts the purger on its first request and finishes jobs queued before it started.
+    """
+    import time
+    from services import request_group_deletion
+    app = create_file_app(tmp_path, GROUP_PURGE_PAUSE_MS=0)
+    client = app.test_client()
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    with app.app_context():
+        # Queued by a process that exited before purging
+        job_id = request_group_deletion(group_id).id
+    assert app.extensions['group_purger']._thread is None
+
+    restarted = create_file_app(tmp_path, GROUP_PURGE_PAUSE_MS=0, GROUP_PURGE_AUTOSTART=True).test_client()
+    deadline = time.monotonic() + 10
+    while True:
+        job = restarted.get(f'/group-deletions/{job_id}', headers=headers).get_json()
+        if job['status'] == 'done' or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert job['status'] == 'done'
+
+def test_purge_group_in_bounded_batches(client):
+    """
+    Test that a group is purged table by table, at most batch_size rows per transaction.
+    """
+    from services import request_group_deletion, purge_group_batch
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    for i in range(5):
+        client.post('/messages', json={'content': f'Message {i}', 'chat_id': chat_id, 'profile_id': profile_id}, headers=headers)
+    with client.application.app_context():
+        job_id = request_group_deletion(group_id).id
+        progress = []
+        while purge_group_batch(job_id, batch_size=2):
+            job = db.session.get(GroupDeletion, job_id)
+            progress.append((job.messages_deleted, job.participants_deleted, job.chats_deleted, job.profiles_deleted))
+        assert progress == [(2, 0, 0, 0), (4, 0, 0, 0), (5, 0, 0, 0), (5, 2, 0, 0), (5, 2, 2, 0), (5, 2, 2, 1)]
+        assert db.session.get(GroupDeletion, job_id).status == 'done'
+        assert db.session.execute(db.text('SELECT COUNT(*) FROM "group"')).scalar() == 0
+        assert purge_group_batch(job_id) is False
+
+def test_purge_group_records_failure(tmp_path):
+    """
+    Test that a purge batch failing on a foreign key is retried a bounded number of
+    times and the job then marked failed with the error, and that messages cannot
+    be posted as a profile of another group.
+    """
+    from sqlalchemy import event
+    from services import request_group_deletion, purge_group_batch
+    client = create_file_app(tmp_path).test_client()
+    token = authenticate_client(client, 'user1@example.com', 'Password1')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    other_group_id, other_profile_id, other_chat_id = setup_chat(client, token)
+    response = client.post('/messages', json={'content': 'Hello', 'chat_id': other_chat_id, 'profile_id': profile_id}, headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['message'] == "Profile does not belong to the chat's group"
+
+    with client.application.app_context():
+        # A cross-group message written around the API blocks deleting its sender
+        db.session.execute(db.text("INSERT INTO message (id, content, chat_id, profile_id, created_at, seq) "
+                                   "VALUES ('stray', 'Hello', :chat_id, :profile_id, CURRENT_TIMESTAMP, 99)"),
+                           {'chat_id': other_chat_id, 'profile_id': profile_id})
+        db.session.commit()
+        job_id = request_group_deletion(group_id).id
+        db.session.close()
+        engine = db.engine
+        engine.dispose()
+        enforce = lambda connection, record: connection.execute('PRAGMA foreign_keys=ON')
+        event.listen(engine, 'connect', enforce)
+        try:
+            while purge_group_batch(job_id, max_attempts=2):
+                pass
+            job = db.session.get(GroupDeletion, job_id)
+            assert (job.status, job.attempts, job.finished_at) == ('running', 1, None)
+            assert 'FOREIGN KEY' in job.error
+            assert purge_group_batch(job_id, max_attempts=2) is False
+            job = db.session.get(GroupDeletion, job_id)
+            db.session.refresh(job)
+            assert (job.status, job.attempts) == ('failed', 2)
+            assert job.finished_at is not None
+        finally:
+            event.remove(engine, 'connect', enforce)
+    status = client.get(f'/group-deletions/{job_id}', headers=headers).get_json()
+    assert (status['status'], status['attempts']) == ('failed', 2)
+
+def test_chat_participant_diffs(client):
+    """
+    Test that participant changes only touch the changed memberships and keep read markers.
+    """
+    token = authenticate_client(client, 'user0@example.com', 'Password0')
+    headers = {'Authorization': f'Bearer {token}'}
+    group_id, profile_id, chat_id = setup_chat(client, token)
+    profile_ids = [profile_id]
+    for i in range(1, 4):
+        other = authenticate_client(client, f'user{i}@example.com', f'Password{i}')
+        profile_ids.append(client.post('/profiles', json={'name': f'Profile {i + 1}', 'picture': 'http://example.com/pic.jpg', 'bio': 'Bio', 'group_id': group_id},
+                                       headers={'Authorization': f'Bearer {other}'}).get_json()['id'])
+    client.put(f'/chats/{chat_id}', json={'name': 'Test Chat', 'participant_ids': profile_ids[:3]}, headers=headers)
+    client.post('/messages', json={'content': 'Hello', 'chat_id': chat_id, 'profile_id': profile_ids[0]}, headers=headers)
+    cursor = client.get(f'/chats/{chat_id}/messages?limit=1', headers=headers).get_json()['next_cursor']
+    client.put(f'/chats/{chat_id}/read', json={'profile_id': profile_ids[1], 'cursor': cursor}, headers=headers)
+
+    with QueryCounter(client.application) as counter:
+        response = client.put(f'/chats/{chat_id}', json={'name': 'Renamed', 'participant_ids': [profile_ids[0], profile_ids[1], profile_ids[3]]},
+                              headers=headers)
+    assert response.status_code == 200
+    membership = [statement for statement in counter.statements if 'chat_participants' in statement]
+    assert [statement.split()[0] for statement in membership] == ['DELETE', 'INSERT']
+    # The participant list is checked against the group once
+    assert len([statement for statement in counter.statements if statement.startswith('SELECT profile.id, profile.group_id')]) == 1
+    chat = client.get(f'/chats/{chat_id}', headers=headers).get_json()
+    assert (chat['name'], sorted(chat['participant_ids'])) == ('Renamed', sorted([profile_ids[0], profile_ids[1], profile_ids[3]]))
+    chats = client.get(f'/groups/{group_id}/chats?profile_id={profile_ids[1]}', headers=headers).get_json()
+    assert [c['unread_count'] for c in chats if c['id'] == chat_id] == [0]
+
+    assert client.post(f'/chats/{chat_id}/participants', json={'profile_ids': [profile_ids[2], profile_ids[3]]}, headers=headers).get_json() == \
+        {'id': chat_id, 'added': 1}
+    assert client.post(f'/chats/{chat_id}/participants', json={'profile_ids': [profile_ids[2]]}, headers=headers).get_json()['added'] == 0
+    assert client.delete(f'/chats/{chat_id}/participants/{profile_ids[2]}', headers=headers).status_code == 204
+    assert client.delete(f'/chats/{chat_id}/participants/{profile_ids[2]}', headers=headers).status_code == 404
+    assert client.get(f'/chats/{chat_id}', headers=headers).get_json()['participant_ids'].count(profile_ids[2]) == 0
+
+    other_group, other_profile, _ = setup_chat(client, token, group_name='Other Group', profile_name='Other')
+    assert client.post(f'/chats/{chat_id}/participants', json={'profile_ids': [other_profile]}, headers=headers).status_code == 400
+    assert client.post(f'/chats/{chat_id}/participants', json={'profile_ids': ['missing']}, headers=headers).status_code == 400
+    assert client.post('/chats/missing/participants', json={'profile_ids': [profile_ids[0]]}, headers=headers).status_code == 404
@@ -0,0 +1,123 @@
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from broker import user_channel, group_channel
+from serializers import dumps
+
+def render_document(info):
+    """
+    Serializes a /users/me document and computes its ETag.
+
+    Args:
+        info (dict): The document.
+
+    Returns:
+        tuple: (body, etag).
+    """
+    body = dumps(info)
+    return body, hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+class UserInfoCache:
+    """
+    Per-process cache of rendered /users/me documents.
+
+    Each entry is the JSON body and ETag of one user's document. Entries are
+    invalidated by broker events rather than by polling the database: while a
+    user's document is cached, the cache listens on the user's channel and on the
+    channel of every group in the document, and any event on one of those channels
+    (profile, group, chat or message changes) drops the entries built from it.
+    Events are applied at the next lookup, so with the in-process broker a write is
+    visible to the writer's next request; across processes (Postgres broker) it is
+    visible as soon as the notification arrives. If events were dropped because the
+    queue overflowed, the whole cache is cleared. Entries also expire after `ttl`
+    seconds; this bounds staleness for writes made outside the application and for
+    a change to a group committed while the cache was not yet listening to it.
+    """
+    def __init__(self, broker, max_entries=1024, ttl=60.0, queue_size=1000):
+        self.broker = broker
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._channel_users = {}
+        self._subscriptions = {}
+        self._events = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """
+        Returns a user's cached document if it is still valid.
+
+        Args:
+            user_id (str): ID of the user.
+
+        Returns:
+            tuple: (body, etag), or None on a miss.
+        """
+        self._apply_events()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            body, etag, _, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove(user_id)
+                return None
+            self._entries.move_to_end(user_id)
+            return body, etag
+
+    def set(self, user_id, info):
+        """
+        Renders and caches a user's document.
+
+        Args:
+            user_id (str): ID of the user.
+            info (dict): The document, as returned by get_user_info.
+
+        Returns:
+            tuple: (body, etag).
+        """
+        body, etag = render_document(info)
+        channels = {user_channel(user_id)} | {group_channel(group['id']) for group in info['groups']}
+        with self._lock:
+            self._remove(user_id)
+            self._entries[user_id] = (body, etag, channels, time.monotonic() + self.ttl)
+            for channel in channels:
+                self._channel_users.setdefault(channel, set()).add(user_id)
+                if channel not in self._subscriptions:
+                    self._subscriptions[channel] = self.broker.subscribe([channel], sink=self._events)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        return body, etag
+
+    def _apply_events(self):
+        channels = set()
+        while True:
+            try:
+                channel, _ = self._events.get_nowait()
+            except queue.Empty:
+                break
+            channels.add(channel)
+        with self._lock:
+            if any(subscription.overflowed for subscription in self._subscriptions.values()):
+                for subscription in self._subscriptions.values():
+                    subscription.overflowed = False
+                channels = set(self._channel_users)
+            for channel in channels:
+                for user_id in list(self._channel_users.get(channel, ())):
+                    self._remove(user_id)
+
+    def _remove(self, user_id):
+        # Caller holds the lock
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        for channel in entry[2]:
+            users = self._channel_users.get(channel)
+            if users is None:
+                continue
+            users.discard(user_id)
+            if not users:
+                del self._channel_users[channel]
+                self._subscriptions.pop(channel).close()
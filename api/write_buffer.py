@@ -0,0 +1,124 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from werkzeug.exceptions import ServiceUnavailable
+from models import db
+from services import insert_messages, publish_message_created
+
+class MessageWriteBuffer:
+    """
+    Group-commit buffer for message inserts.
+
+    Request threads hand validated rows to write() and block until their row is
+    committed. A single flusher thread per process collects rows for up to
+    `max_delay` seconds or `max_rows` rows, whichever comes first, and stores the
+    whole batch with one multi-row INSERT and one COMMIT, so a burst of messages
+    costs one transaction instead of one per message. A write that times out
+    before the flusher picks it up is withdrawn, so a 503 means the message was
+    not stored and can be retried without creating a duplicate.
+    """
+    def __init__(self, app, max_rows=100, max_delay=0.005, ack_timeout=5.0):
+        self.app = app
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.ack_timeout = ack_timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def write(self, row, group_id):
+        """
+        Queues a message row and waits until it has been committed.
+
+        Args:
+            row (dict): Message column values, including a client-generated id; created_at and seq are set when stored.
+            group_id (str): ID of the group the message's chat belongs to, for notifications.
+
+        Raises:
+            ServiceUnavailable: If the flusher did not pick the row up within
+                ack_timeout; the row is then withdrawn and never stored.
+            Exception: The database error if the row could not be stored.
+        """
+        future = Future()
+        self._ensure_started()
+        self._queue.put((row, group_id, future))
+        try:
+            future.result(timeout=self.ack_timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise ServiceUnavailable('Message could not be stored in time, please retry')
+            # Already being written: wait for the outcome rather than report a write that may succeed
+            future.result()
+
+    def _ensure_started(self):
+        # Gunicorn forks workers after the app is created, so each process starts its own flusher
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='message-write-buffer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Skip rows whose writers gave up; the others can no longer be cancelled
+            batch = [entry for entry in batch if entry[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            with self.app.app_context():
+                try:
+                    self.flush(batch)
+                finally:
+                    db.session.remove()
+
+    def flush(self, batch):
+        """
+        Commits a batch of queued rows and resolves their waiters.
+
+        If the multi-row insert fails, rows are retried one transaction each so a
+        single bad row only fails its own request.
+
+        Args:
+            batch (List[tuple]): (row, group_id, future) entries.
+        """
+        try:
+            insert_messages([row for row, _, _ in batch])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logging.warning('Group commit of %d messages failed, retrying individually', len(batch))
+            for entry in batch:
+                self._flush_one(entry)
+            return
+        for row, group_id, future in batch:
+            # Publish before acking so caches are invalidated by the time the writer gets its response
+            publish_message_created(row, group_id)
+            future.set_result(row['id'])
+
+    def _flush_one(self, entry):
+        row, group_id, future = entry
+        try:
+            insert_messages([row])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            future.set_exception(e)
+            return
+        publish_message_created(row, group_id)
+        future.set_result(row['id'])
@@ -7,6 +7,7 @@ import { Container, Box, List, ListItem, ListItemText, TextField, Button, Typogr
 import { useParams } from 'react-router-dom';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:5001';
+const MESSAGE_PAGE_SIZE = 100;
 
 /**
  * @component ChatPage
@@ -91,7 +92,7 @@ function ChatPage({ userData }) {
     if (userData) {
       fetchChats();
 
-      fetch(`${API_URL}/profiles`, {
+      fetch(`${API_URL}/profiles?group_id=${groupId}`, {
         headers: {
           'Authorization': `Bearer ${localStorage.getItem('token')}`
         }
@@ -101,21 +102,61 @@ function ChatPage({ userData }) {
     }
   }, [groupId, profileId, userData]);
 
+  const nextCursorRef = useRef(null);
+
+  /**
+   * @function appendMessages
+   * @description Appends messages that are not already displayed.
+   * @param {Array<object>} newMessages - Messages in chronological order.
+   */
+  const appendMessages = (newMessages) => {
+    setMessages(previous => {
+      const seen = new Set(previous.map(m => m.id));
+      return [...previous, ...newMessages.filter(m => !seen.has(m.id))];
+    });
+  };
+
+  /**
+   * @function fetchLatestMessages
+   * @description Loads the most recent page of messages and remembers its cursor.
+   * @param {string} chatId - ID of the chat.
+   */
+  const fetchLatestMessages = (chatId) => {
+    return fetch(`${API_URL}/chats/${chatId}/messages?limit=${MESSAGE_PAGE_SIZE}`, {
+      headers: {
+        'Authorization': `Bearer ${localStorage.getItem('token')}`
+      }
+    })
+    .then(response => response.json())
+    .then(data => {
+      nextCursorRef.current = data.next_cursor;
+      appendMessages(data.messages || []);
+    });
+  };
+
   useEffect(() => {
     if (selectedChat) {
-      const fetchMessages = () => {
-        fetch(`${API_URL}/chats/${selectedChat.id}/messages`, {
-          headers: {
-            'Authorization': `Bearer ${localStorage.getItem('token')}`
-          }
-        })
-        .then(response => response.json())
-        .then(data => setMessages(data));
+      let source = null;
+      let cancelled = false;
+      nextCursorRef.current = null;
+      setMessages([]);
+      fetchLatestMessages(selectedChat.id).then(() => {
+        if (cancelled) return;
+        // The stream resumes after the last loaded message and pushes new ones as they are sent
+        const params = new URLSearchParams({ jwt: localStorage.getItem('token') });
+        if (nextCursorRef.current) {
+          params.set('last_event_id', nextCursorRef.current);
+        }
+        source = new EventSource(`${API_URL}/chats/${selectedChat.id}/stream?${params}`);
+        source.onmessage = (event) => {
+          nextCursorRef.current = event.lastEventId;
+          appendMessages([JSON.parse(event.data)]);
+        };
+      });
+      return () => {
+        cancelled = true;
+        if (source) source.close();
       };
-
-      fetchMessages();
-      const interval = setInterval(fetchMessages, 1000);
-      return () => clearInterval(interval);
     }
   }, [selectedChat]);
 
@@ -136,16 +177,7 @@ function ChatPage({ userData }) {
     });
 
     if (response.ok) {
-      const message = await response.json();
-      setMessages([...messages, message]);
       setNewMessage('');
-      fetch(`${API_URL}/chats/${selectedChat.id}/messages`, {
-        headers: {
-          'Authorization': `Bearer ${localStorage.getItem('token')}`
-        }
-      })
-      .then(response => response.json())
-      .then(data => setMessages(data));
     }
   };
 
@@ -42,13 +42,7 @@ function ProfileForm({ userData }) { // Added userData as a prop
     });
     if (response.ok) {
       const group = await response.json();
-      const profilesResponse = await fetch(`${API_URL}/profiles?group_id=${group_id}`, {
-        headers: {
-          'Authorization': `Bearer ${localStorage.getItem('token')}`
-        }
-      });
-      const profiles = await profilesResponse.json();
-      setGroupProfilesLeft(group.max_profiles - profiles.length);
+      setGroupProfilesLeft(group.max_profiles - group.profile_count);
       setStep(2);
     } else {
       setGroupError('Invalid Group ID');